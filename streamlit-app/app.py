@@ -1,75 +1,12 @@
 import streamlit as st
-import requests
-import json
 import base64
 import os
-import re
-import ssl
-import urllib3
 import hashlib
-import uuid
-from datetime import datetime, timedelta, timezone
-from dateutil import parser as date_parser
+import io
+import tempfile
+import time
+from datetime import datetime
 from typing import Optional, Dict, Any, List
-from urllib.parse import urlencode, quote
-
-def format_timestamp():
-    return datetime.now().isoformat()
-
-def log_json(log_entry):
-    print(json.dumps(log_entry))
-
-def log_request(operation, method, url, headers, body=None):
-    sanitized_headers = {}
-    for key, value in headers.items():
-        if key.lower() == "authorization":
-            sanitized_headers[key] = value[:100] + "...[truncated]" if len(value) > 100 else value
-        else:
-            sanitized_headers[key] = value
-    
-    log_json({
-        "timestamp": format_timestamp(),
-        "severity": "INFO",
-        "type": "REQUEST",
-        "operation": operation,
-        "method": method,
-        "url": url,
-        "headers": sanitized_headers,
-        "body": body
-    })
-
-def log_response(operation, status_code, status_text, headers=None, body=None, response_time_ms=None):
-    log_json({
-        "timestamp": format_timestamp(),
-        "severity": "ERROR" if status_code >= 400 else "INFO",
-        "type": "RESPONSE",
-        "operation": operation,
-        "statusCode": status_code,
-        "statusText": status_text,
-        "headers": dict(headers) if headers else None,
-        "body": body,
-        "responseTimeMs": response_time_ms
-    })
-
-def log_event(operation, message, data=None, severity="INFO"):
-    log_entry = {
-        "timestamp": format_timestamp(),
-        "severity": severity,
-        "type": "EVENT",
-        "operation": operation,
-        "message": message
-    }
-    if data:
-        log_entry.update(data)
-    log_json(log_entry)
-
-try:
-    import jwt as pyjwt
-    from cryptography import x509
-    from cryptography.hazmat.primitives import serialization
-    JWT_AVAILABLE = True
-except ImportError:
-    JWT_AVAILABLE = False
 
 st.set_page_config(
     page_title="CommonWell Document Query",
@@ -78,6 +15,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+script_started = time.perf_counter()
+
 st.markdown("""
 <style>
     .main-header {
@@ -154,526 +93,161 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 from config import (
-    CW_ORG_OID, CW_ORG_NAME, CLEAR_OID,
-    CLIENT_CERT_PATH, CLIENT_KEY_PATH, CA_CERT_PATH,
-    CERTIFICATE_PATH, PRIVATE_KEY_PATH,
-    API_BASE_URLS, PATIENT_API_BASE_URLS,
-    API_TIMEOUT, SKIP_TLS_VERIFY
+    CLIENT_KEY_PATH, CERTIFICATE_PATH, PRIVATE_KEY_PATH,
+    HTTP_POOL_SIZE, HTTP_POOL_IDLE_TIMEOUT,
+    DOCUMENT_CACHE_ENABLED, DOCUMENT_CACHE_DIR, DOCUMENT_CACHE_MAX_BYTES, DOCUMENT_CACHE_TTL,
+    QUERY_CACHE_TTL, QUERY_CACHE_STALE_TTL, QUERY_CACHE_MAX_ENTRIES,
+    JWT_REFRESH_WINDOW, JWT_CACHE_MAX_ENTRIES,
+    RESULTS_PAGE_SIZE, RESULTS_PAGE_SIZE_OPTIONS, RESULTS_TABLE_VIEW_THRESHOLD,
+    METRICS_PORT, ASYNC_CLIENT_ENABLED,
+    XML_PREVIEW_MAX_BYTES, XML_PREVIEW_MAX_CHARS, PREVIEW_SERVER_PORT, PREVIEW_PUBLIC_URL,
+    HISTORY_DB_PATH, HISTORY_RETENTION_DAYS, HISTORY_PAGE_SIZE,
+    ENROLLMENT_REGISTRY_PATH, ENROLLMENT_WORKERS,
+    RAW_JSON_CHUNK_ENTRIES, RAW_JSON_MAX_BYTES
 )
+from commonwell.transport import SessionPool
+from commonwell.aio import CommonWellClient, async_client_available
+from commonwell.bulk import download_all
+from commonwell.ccda import extract_outline, pretty_print_xml
+from commonwell.auth import decode_clear_id_token, generate_commonwell_jwt
+from commonwell.batch import is_jsonl, parse_rows
+from commonwell.enrollment import EnrollmentRegistry, enroll, report_csv, summarize
+from commonwell.fhir import (
+    DOCUMENT_STATUS_OPTIONS, DOCUMENT_TYPE_OPTIONS, CONTENT_TYPE_OPTIONS,
+    build_query_url, execute_query, execute_paginated_query,
+    download_document_stream, read_document_bytes
+)
+from commonwell.document_index import DocumentIndex
+from commonwell.history import HistoryStore
+from commonwell.patient import build_patient_object, create_patient
+from commonwell.preview_server import PreviewServer, start_preview_server
+from commonwell.raw_json import RawBundle
+from commonwell.document_cache import DocumentCache, derive_cache_key
+from commonwell.metrics import get_registry, observe_phase, start_metrics_server, timed
+from commonwell.query_cache import QueryCache
+from commonwell.signing import SigningMaterial
+from commonwell.token_cache import TokenCache
 
-def decode_clear_id_token(token: str) -> Optional[Dict[str, Any]]:
-    try:
-        parts = token.split(".")
-        if len(parts) != 3:
-            return None
-        payload_padding = "=" * (4 - len(parts[1]) % 4) if len(parts[1]) % 4 else ""
-        payload = json.loads(base64.urlsafe_b64decode(parts[1] + payload_padding))
-        return payload
-    except Exception:
-        return None
+@st.cache_resource
+def get_http_pool() -> SessionPool:
+    return SessionPool(HTTP_POOL_SIZE, HTTP_POOL_IDLE_TIMEOUT)
 
-def get_x5t_from_cert(cert_path: str) -> Optional[str]:
-    if not JWT_AVAILABLE:
+@st.cache_resource
+def get_document_cache() -> Optional[DocumentCache]:
+    if not DOCUMENT_CACHE_ENABLED:
         return None
-    try:
-        with open(cert_path, "rb") as f:
-            cert = x509.load_pem_x509_certificate(f.read())
-        cert_der = cert.public_bytes(serialization.Encoding.DER)
-        thumbprint = hashlib.sha1(cert_der).digest()
-        return base64.urlsafe_b64encode(thumbprint).rstrip(b"=").decode("utf-8")
-    except Exception:
+    key = derive_cache_key([CLIENT_KEY_PATH, PRIVATE_KEY_PATH])
+    if not key:
         return None
+    return DocumentCache(key, DOCUMENT_CACHE_DIR, DOCUMENT_CACHE_MAX_BYTES, DOCUMENT_CACHE_TTL)
 
-def generate_commonwell_jwt(clear_id_token: str) -> Dict[str, Any]:
-    if not JWT_AVAILABLE:
-        return {"error": "PyJWT and cryptography packages required. Install with: pip install PyJWT cryptography"}
-    
-    cert_path = CERTIFICATE_PATH
-    key_path = PRIVATE_KEY_PATH
-    
-    if not os.path.exists(cert_path) or not os.path.exists(key_path):
-        return {"error": f"Certificate files not found. Ensure certificate.pem and private_key.pem exist in certs/ folder."}
-    
-    try:
-        with open(key_path, "rb") as f:
-            private_key = serialization.load_pem_private_key(f.read(), password=None)
-        
-        claims = decode_clear_id_token(clear_id_token)
-        if not claims:
-            return {"error": "Failed to decode CLEAR ID token"}
-        
-        patient_name = f"{claims.get('given_name', '')} {claims.get('family_name', '')}".strip()
-        now = datetime.now(timezone.utc)
-        
-        x5t = get_x5t_from_cert(cert_path)
-        
-        headers = {
-            "typ": "JWT",
-            "alg": "RS384",
-        }
-        if x5t:
-            headers["x5t"] = x5t
-        
-        payload = {
-            "iss": f"urn:oid:{CW_ORG_OID}",
-            "sub": f"urn:oid:{CW_ORG_OID}",
-            "aud": "urn:commonwellalliance.org",
-            "iat": int(now.timestamp()),
-            "nbf": int(now.timestamp()),
-            "exp": int((now + timedelta(hours=1)).timestamp()),
-            "jti": str(uuid.uuid4()),
-            "urn:oasis:names:tc:xspa:1.0:subject:purposeofuse": "REQUEST",
-            "urn:oasis:names:tc:xacml:2.0:subject:role": "116154003",
-            "urn:oasis:names:tc:xspa:1.0:subject:subject-id": patient_name,
-            "urn:oasis:names:tc:xspa:1.0:subject:organization": CW_ORG_NAME,
-            "urn:oasis:names:tc:xspa:1.0:subject:organization-id": f"urn:oid:{CW_ORG_OID}",
-            "extensions": {
-                "tefca_ias": {
-                    "id_token": clear_id_token
-                }
-            }
-        }
-        
-        signed_jwt = pyjwt.encode(payload, private_key, algorithm="RS384", headers=headers)
-        
-        return {"success": True, "jwt": signed_jwt, "claims": claims}
-    except Exception as e:
-        return {"error": f"Failed to generate JWT: {str(e)}"}
+@st.cache_resource
+def get_signing_material() -> SigningMaterial:
+    return SigningMaterial(PRIVATE_KEY_PATH, CERTIFICATE_PATH)
 
-def build_patient_object(clear_claims: Dict[str, Any], cvs_patient_id: str, cvs_aaid: str) -> Dict[str, Any]:
-    patient = {
-        "identifier": [
-            {
-                "value": cvs_patient_id,
-                "system": cvs_aaid,
-                "use": "official",
-                "assigner": CW_ORG_NAME
-            },
-            {
-                "value": clear_claims.get("sub", ""),
-                "system": CLEAR_OID,
-                "use": "secondary",
-                "type": "IAL2",
-                "assigner": "CLEAR"
-            }
-        ],
-        "name": [{
-            "given": [clear_claims.get("given_name", "")],
-            "family": [clear_claims.get("family_name", "")],
-            "text": f"{clear_claims.get('given_name', '')} {clear_claims.get('middle_name', '')} {clear_claims.get('family_name', '')}".replace("  ", " ").strip(),
-            "use": "usual"
-        }],
-        "birthDate": clear_claims.get("birthdate"),
-        "active": True
-    }
-    
-    if clear_claims.get("middle_name"):
-        patient["name"][0]["given"].append(clear_claims["middle_name"])
-    
-    if clear_claims.get("gender"):
-        patient["gender"] = clear_claims["gender"]
-    
-    address = clear_claims.get("address")
-    if address:
-        patient["address"] = [{
-            "line": [address.get("street_address", "")],
-            "city": address.get("locality", ""),
-            "state": address.get("region", ""),
-            "postalCode": address.get("postal_code", ""),
-            "country": address.get("country", "US"),
-            "use": "home"
-        }]
-    
-    phone = clear_claims.get("phone_number")
-    if phone:
-        phone_clean = re.sub(r"^\+1", "", phone)
-        phone_clean = re.sub(r"\D", "", phone_clean)
-        patient["telecom"] = [{
-            "value": phone_clean,
-            "system": "phone",
-            "use": "home"
-        }]
-    
-    historical = clear_claims.get("historical_address", [])
-    if historical:
-        if "address" not in patient:
-            patient["address"] = []
-        for hist in historical:
-            patient["address"].append({
-                "line": [hist.get("street_address", "")],
-                "city": hist.get("locality", ""),
-                "state": hist.get("region", ""),
-                "postalCode": hist.get("postal_code", ""),
-                "country": hist.get("country", "US"),
-                "use": "old",
-                "type": "both"
-            })
-    
-    alternate = {
-        "identifier": [{
-            "value": clear_claims.get("sub", ""),
-            "system": CLEAR_OID,
-            "use": "secondary",
-            "type": "IAL2",
-            "assigner": "CLEAR"
-        }],
-        "name": [{
-            "given": [clear_claims.get("given_name", "")],
-            "family": [clear_claims.get("family_name", "")],
-            "use": "usual"
-        }],
-        "birthDate": clear_claims.get("birthdate")
-    }
-    
-    if clear_claims.get("middle_name"):
-        alternate["name"][0]["given"].append(clear_claims["middle_name"])
-    
-    if clear_claims.get("gender"):
-        alternate["gender"] = clear_claims["gender"]
-    
-    if address:
-        alternate["address"] = [{
-            "line": [address.get("street_address", "")],
-            "city": address.get("locality", ""),
-            "state": address.get("region", ""),
-            "postalCode": address.get("postal_code", ""),
-            "use": "home"
-        }]
-    
-    if phone and clear_claims.get("phone_number_verified") is True:
-        phone_clean = re.sub(r"^\+1", "", phone)
-        phone_clean = re.sub(r"\D", "", phone_clean)
-        alternate["telecom"] = [{
-            "value": phone_clean,
-            "system": "phone",
-            "use": "home"
-        }]
-    
-    patient["alternatePatients"] = [alternate]
-    
-    return patient
+@st.cache_resource
+def get_token_cache() -> TokenCache:
+    signing_material = get_signing_material()
+    return TokenCache(lambda token: generate_commonwell_jwt(token, signing_material), JWT_REFRESH_WINDOW, JWT_CACHE_MAX_ENTRIES)
 
-def create_patient(environment: str, cw_jwt: str, patient_object: Dict[str, Any], skip_verify: bool = False) -> Dict[str, Any]:
-    base_url = PATIENT_API_BASE_URLS[environment]
-    patient_url = f"{base_url}org/{CW_ORG_OID}/Patient"
-    
-    cert, verify = get_ssl_context(skip_verify)
-    
-    headers = {
-        "Authorization": f"Bearer {cw_jwt}",
-        "Accept": "application/fhir+json",
-        "Content-Type": "application/fhir+json"
-    }
-    
-    log_request("Patient Create", "POST", patient_url, headers, patient_object)
-    
-    try:
-        response = requests.post(
-            patient_url,
-            headers=headers,
-            json=patient_object,
-            cert=cert,
-            verify=verify,
-            timeout=55
-        )
-        
-        try:
-            response_data = response.json() if response.text else {}
-        except:
-            response_data = {"raw": response.text}
-        
-        log_response("Patient Create", response.status_code, response.reason, dict(response.headers), response_data)
-        
-        if response.status_code >= 200 and response.status_code < 300:
-            return {
-                "success": True,
-                "patient": response_data,
-                "patient_object": patient_object
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"HTTP {response.status_code}: {response.text}",
-                "patient_object": patient_object
-            }
-    except Exception as e:
-        print(f"[Patient Create] Error: {str(e)}")
-        return {"success": False, "error": str(e), "patient_object": patient_object}
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    return QueryCache(QUERY_CACHE_TTL, QUERY_CACHE_STALE_TTL, QUERY_CACHE_MAX_ENTRIES)
 
-DOCUMENT_STATUS_OPTIONS = [
-    {"value": "", "label": "All Statuses"},
-    {"value": "current", "label": "Current"},
-    {"value": "superseded", "label": "Superseded"},
-    {"value": "entered-in-error", "label": "Entered in Error"}
-]
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    return HistoryStore(HISTORY_DB_PATH, HISTORY_RETENTION_DAYS)
 
-DOCUMENT_TYPE_OPTIONS = [
-    {"value": "", "label": "All Types"},
-    {"value": "34133-9", "label": "Summarization of Episode Note (34133-9)"},
-    {"value": "11488-4", "label": "Consultation Note (11488-4)"},
-    {"value": "18842-5", "label": "Discharge Summary (18842-5)"},
-    {"value": "11506-3", "label": "Progress Note (11506-3)"},
-    {"value": "28570-0", "label": "Procedure Note (28570-0)"},
-    {"value": "57133-1", "label": "Referral Note (57133-1)"}
-]
+@st.cache_resource
+def get_enrollment_registry() -> EnrollmentRegistry:
+    return EnrollmentRegistry(ENROLLMENT_REGISTRY_PATH)
 
-CONTENT_TYPE_OPTIONS = [
-    {"value": "", "label": "All Content Types"},
-    {"value": "application/xml", "label": "XML (application/xml)"},
-    {"value": "text/xml", "label": "XML (text/xml)"},
-    {"value": "application/pdf", "label": "PDF (application/pdf)"},
-    {"value": "text/plain", "label": "Plain Text (text/plain)"},
-    {"value": "application/hl7-v3+xml", "label": "HL7 V3 (application/hl7-v3+xml)"}
+@st.cache_resource
+def get_metrics_server():
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+
+@st.cache_resource
+def get_preview_server() -> Optional[PreviewServer]:
+    # Without a public URL the browser may not be on this host, so PDFs are embedded as data: URIs instead
+    return start_preview_server(PREVIEW_SERVER_PORT) if PREVIEW_SERVER_PORT and PREVIEW_PUBLIC_URL else None
+
+@st.cache_resource
+def get_async_client() -> Optional[CommonWellClient]:
+    if not ASYNC_CLIENT_ENABLED or not async_client_available():
+        return None
+    return CommonWellClient()
+
+def run_query_request(params: Dict[str, Any]) -> Dict[str, Any]:
+    client = get_async_client()
+    if client:
+        return client.execute_query(params)
+    return execute_query(params, pool=get_http_pool())
+
+def run_paginated_query_request(params: Dict[str, Any], max_pages: Optional[int], max_documents: Optional[int], on_page=None) -> Dict[str, Any]:
+    client = get_async_client()
+    if client:
+        return client.execute_paginated_query(params, max_pages, max_documents, on_page)
+    return execute_paginated_query(params, max_pages, max_documents, on_page=on_page, pool=get_http_pool())
+
+get_metrics_server()
+
+def query_identifier(aaid: str, patient_id: str) -> str:
+    return f"{(aaid or '').strip()}|{(patient_id or '').strip()}"
+
+RESULTS_WIDGET_KEYS = [
+    "results_page", "results_selected", "results_view", "results_search",
+    "results_status", "results_type", "results_content_type", "results_author",
+    "raw_json", "raw_json_entries", "raw_json_id"
 ]
 
-if "query_history" not in st.session_state:
-    st.session_state.query_history = []
+# Widgets inside a fragment rerun only that fragment instead of the whole script
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+
+if "history_cursors" not in st.session_state:
+    st.session_state.history_cursors = [None]
 if "results" not in st.session_state:
     st.session_state.results = None
 if "error" not in st.session_state:
     st.session_state.error = None
 if "response_time" not in st.session_state:
     st.session_state.response_time = None
+if "query_cache_status" not in st.session_state:
+    st.session_state.query_cache_status = (None, None)
 
-def validate_jwt(token: str) -> Dict[str, Any]:
-    if not token or not token.strip():
-        return {"valid": False, "error": "JWT token is required"}
-    
-    parts = token.strip().split(".")
-    if len(parts) != 3:
-        return {"valid": False, "error": "Invalid JWT format - must have 3 parts separated by dots"}
-    
-    try:
-        header_padding = "=" * (4 - len(parts[0]) % 4) if len(parts[0]) % 4 else ""
-        header = json.loads(base64.urlsafe_b64decode(parts[0] + header_padding))
-        
-        payload_padding = "=" * (4 - len(parts[1]) % 4) if len(parts[1]) % 4 else ""
-        payload = json.loads(base64.urlsafe_b64decode(parts[1] + payload_padding))
-        
-        exp = payload.get("exp")
-        if exp:
-            exp_date = datetime.fromtimestamp(exp)
-            if exp_date < datetime.now():
-                return {"valid": False, "error": f"Token expired on {exp_date.strftime('%Y-%m-%d %H:%M:%S')}"}
-            return {"valid": True, "expires": exp_date.strftime('%Y-%m-%d %H:%M:%S')}
-        
-        return {"valid": True, "expires": None}
-    except Exception as e:
-        return {"valid": False, "error": f"Failed to decode JWT: {str(e)}"}
 
-def build_query_url(params: Dict[str, Any]) -> str:
-    base_url = API_BASE_URLS.get(params.get("environment", "integration"), API_BASE_URLS["integration"])
-    url = f"{base_url}DocumentReference?"
-    
-    query_params = []
-    
-    aaid = params.get("aaid", "").strip()
-    patient_id = params.get("patient_id", "").strip()
-    if aaid and patient_id:
-        identifier = f"{aaid}|{patient_id}"
-        query_params.append(f"patient.identifier={quote(identifier, safe='')}")
-    
-    status = params.get("status", "")
-    if status:
-        query_params.append(f"status={status}")
-    
-    date_from = params.get("date_from")
-    date_to = params.get("date_to")
-    if date_from:
-        query_params.append(f"date=ge{date_from.strftime('%Y-%m-%d')}")
-    if date_to:
-        query_params.append(f"date=le{date_to.strftime('%Y-%m-%d')}")
-    
-    doc_type = params.get("document_type", "")
-    if doc_type:
-        query_params.append(f"type={quote(f'http://loinc.org|{doc_type}', safe='')}")
-    
-    content_type = params.get("content_type", "")
-    if content_type:
-        query_params.append(f"contenttype={quote(content_type, safe='')}")
-    
-    author = params.get("author", "").strip()
-    if author:
-        query_params.append(f"author={quote(author, safe='')}")
-    
-    return url + "&".join(query_params)
-
-def get_ssl_context(skip_verify: bool = False):
-    cert_path = CLIENT_CERT_PATH
-    key_path = CLIENT_KEY_PATH
-    ca_path = CA_CERT_PATH
-    
-    cert = None
-    verify = True
-    
-    if cert_path and key_path and os.path.exists(cert_path) and os.path.exists(key_path):
-        cert = (cert_path, key_path)
-    
-    if skip_verify or SKIP_TLS_VERIFY:
-        verify = False
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    elif ca_path and os.path.exists(ca_path):
-        verify = ca_path
-    
-    return cert, verify
-
-def execute_query(params: Dict[str, Any]) -> Dict[str, Any]:
-    url = build_query_url(params)
-    jwt_token = params.get("jwt_token", "").strip()
-    skip_verify = params.get("skip_tls_verify", False)
-    
-    cert, verify = get_ssl_context(skip_verify)
-    
-    headers = {
-        "Authorization": f"Bearer {jwt_token}",
-        "Accept": "application/fhir+json",
-        "Content-Type": "application/fhir+json"
-    }
-    
-    log_request("DocumentReference Query", "GET", url, headers)
-    
-    try:
-        start_time = datetime.now()
-        response = requests.get(
-            url,
-            headers=headers,
-            cert=cert,
-            verify=verify,
-            timeout=55
-        )
-        end_time = datetime.now()
-        response_time = (end_time - start_time).total_seconds() * 1000
-        
-        try:
-            response_data = response.json()
-        except:
-            response_data = {"raw": response.text}
-        
-        log_response("DocumentReference Query", response.status_code, response.reason, dict(response.headers), response_data, response_time)
-        
-        if response.status_code == 200:
-            return {
-                "success": True,
-                "data": response_data,
-                "response_time": response_time
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"HTTP {response.status_code}: {response.text}",
-                "response_time": response_time
-            }
-    except requests.exceptions.SSLError as e:
-        return {"success": False, "error": f"SSL/TLS Error: {str(e)}. Check your certificate configuration."}
-    except requests.exceptions.Timeout:
-        return {"success": False, "error": "Request timed out after 55 seconds"}
-    except requests.exceptions.RequestException as e:
-        return {"success": False, "error": f"Request failed: {str(e)}"}
-
-def download_document(environment: str, jwt_token: str, document_url: str, skip_verify: bool = False) -> Dict[str, Any]:
-    allowed_hosts = {
-        "integration": "api.integration.commonwellalliance.lkopera.com",
-        "production": "api.commonwellalliance.lkopera.com"
-    }
-    
-    from urllib.parse import urlparse
-    parsed = urlparse(document_url)
-    expected_host = allowed_hosts.get(environment)
-    
-    if parsed.scheme != "https" or parsed.hostname != expected_host:
-        return {"success": False, "error": f"Invalid URL. Must be from {expected_host} using HTTPS"}
-    
-    cert, verify = get_ssl_context(skip_verify)
-    
-    headers = {
-        "Authorization": f"Bearer {jwt_token}",
-        "Accept": "application/fhir+json"
-    }
-    
-    log_request("Binary Retrieve", "GET", document_url, headers)
-    
-    try:
-        response = requests.get(
-            document_url,
-            headers=headers,
-            cert=cert,
-            verify=verify,
-            timeout=55
-        )
-        
-        try:
-            response_data = response.json()
-        except:
-            response_data = {"raw": response.text}
-        
-        log_response("Binary Retrieve", response.status_code, response.reason, dict(response.headers), response_data)
-        
-        if response.status_code == 200:
-            data = response_data
-            return {
-                "success": True,
-                "content_type": data.get("contentType", "application/octet-stream"),
-                "data": data.get("data", ""),
-                "id": data.get("id", "")
-            }
-        else:
-            return {"success": False, "error": f"HTTP {response.status_code}: {response.text}"}
-    except Exception as e:
-        return {"success": False, "error": str(e)}
-
-def extract_documents(bundle: Dict[str, Any]) -> List[Dict[str, Any]]:
-    documents = []
-    entries = bundle.get("entry", [])
-    
-    for entry in entries:
-        resource = entry.get("resource", {})
-        if resource.get("resourceType") == "DocumentReference":
-            doc = {
-                "id": resource.get("id", "Unknown"),
-                "status": resource.get("status", "unknown"),
-                "description": resource.get("description", "No description"),
-                "date": resource.get("date"),
-                "author": None,
-                "content": []
-            }
-            
-            authors = resource.get("author", [])
-            if authors and len(authors) > 0:
-                doc["author"] = authors[0].get("display") or authors[0].get("reference")
-            
-            for content in resource.get("content", []):
-                attachment = content.get("attachment", {})
-                doc["content"].append({
-                    "contentType": attachment.get("contentType", "unknown"),
-                    "url": attachment.get("url"),
-                    "size": attachment.get("size"),
-                    "title": attachment.get("title")
-                })
-            
-            documents.append(doc)
-    
-    return documents
+# Keyed by the document's SHA-256; the file argument is not hashed on every rerun
+@st.cache_data(max_entries=20, show_spinner=False)
+def format_xml(digest: str, _document_file, max_chars: Optional[int] = None):
+    return pretty_print_xml(_document_file, max_chars)
 
-def format_xml(xml_string: str) -> str:
-    try:
-        import xml.dom.minidom as minidom
-        dom = minidom.parseString(xml_string)
-        return dom.toprettyxml(indent="  ")
-    except:
-        return xml_string
+@st.cache_data(max_entries=20, show_spinner=False)
+def ccda_outline(digest: str, _document_file) -> Dict[str, Any]:
+    return extract_outline(_document_file)
 
-def add_to_history(params: Dict[str, Any], success: bool):
-    history_entry = {
-        "timestamp": datetime.now().isoformat(),
-        "environment": params.get("environment"),
-        "patient_id": params.get("patient_id"),
-        "aaid": params.get("aaid"),
-        "success": success,
-        "url": build_query_url(params)
-    }
-    st.session_state.query_history.insert(0, history_entry)
-    if len(st.session_state.query_history) > 50:
-        st.session_state.query_history = st.session_state.query_history[:50]
+def add_to_history(
+    params: Dict[str, Any],
+    success: bool,
+    cache_status: Optional[str] = None,
+    url: Optional[str] = None,
+    latency_ms: Optional[float] = None,
+    document_count: Optional[int] = None,
+    pages: Optional[int] = None,
+    error: Optional[str] = None
+):
+    get_history_store().add(
+        params.get("environment", "integration"),
+        params.get("aaid", "").strip(),
+        params.get("patient_id", "").strip(),
+        success,
+        url or build_query_url(params),
+        cache=cache_status,
+        latency_ms=latency_ms,
+        document_count=document_count,
+        pages=pages,
+        error=error
+    )
+    st.session_state.history_cursors = [None]
 
 st.markdown('<p class="main-header">CommonWell Document Query</p>', unsafe_allow_html=True)
 st.markdown('<p class="sub-header">CVS IAS Platform - E2E Testing Tool</p>', unsafe_allow_html=True)
@@ -704,7 +278,6 @@ with st.sidebar:
         st.session_state["generated_jwt"] = ""
     
     if clear_id_token:
-        import hashlib
         token_hash = hashlib.sha256(clear_id_token.encode()).hexdigest()[:16]
         
         if st.session_state["jwt_source_token"] != token_hash:
@@ -722,20 +295,54 @@ with st.sidebar:
             else:
                 st.info(f"Patient: {clear_claims.get('given_name', '')} {clear_claims.get('family_name', '')} | DOB: {clear_claims.get('birthdate', 'N/A')}")
                 
+                token_cache = get_token_cache()
+                
                 if st.button("Generate CommonWell JWT", type="primary", use_container_width=True):
                     with st.spinner("Generating JWT..."):
-                        jwt_result = generate_commonwell_jwt(clear_id_token)
+                        jwt_result = token_cache.get(token_hash, clear_id_token)
                         if "error" in jwt_result:
                             st.error(f"JWT generation failed: {jwt_result['error']}")
                         else:
                             st.session_state["generated_jwt"] = jwt_result["jwt"]
                             st.session_state["jwt_source_token"] = token_hash
-                            st.success("CommonWell JWT generated successfully! Expires in 1 hour.")
+                            st.session_state.pop("jwt_expired_token", None)
+                            expires = datetime.fromtimestamp(jwt_result["expires_at"]).strftime("%H:%M:%S")
+                            if jwt_result.get("cached"):
+                                st.success(f"Reusing cached CommonWell JWT (expires {expires}).")
+                            else:
+                                st.success(f"CommonWell JWT generated successfully! Expires {expires}.")
+                elif not st.session_state["jwt_source_token"]:
+                    cached_jwt = token_cache.get(token_hash, clear_id_token, mint_on_miss=False)
+                    if cached_jwt:
+                        st.session_state["jwt_source_token"] = token_hash
+                
+                if st.session_state["jwt_source_token"] == token_hash:
+                    # Picks up background re-signs; an expired JWT is only re-minted from the button
+                    current_jwt = token_cache.get(token_hash, clear_id_token, mint_on_miss=False, record=False)
+                    if current_jwt:
+                        st.session_state["generated_jwt"] = current_jwt["jwt"]
+                    else:
+                        st.session_state["generated_jwt"] = ""
+                        st.session_state["jwt_source_token"] = ""
+                        st.session_state["jwt_expired_token"] = token_hash
+                
+                if not st.session_state["jwt_source_token"] and st.session_state.get("jwt_expired_token") == token_hash:
+                    if clear_claims.get("exp") and clear_claims["exp"] <= time.time():
+                        st.warning("CommonWell JWT expired and so has the CLEAR ID Token. Paste a new CLEAR ID Token, then regenerate.")
+                    else:
+                        st.warning("CommonWell JWT expired. Regenerate it to continue.")
                 
                 if st.session_state["generated_jwt"] and st.session_state["jwt_source_token"] == token_hash:
                     jwt_token = st.session_state["generated_jwt"]
                     with st.expander("View Generated JWT"):
                         st.code(jwt_token[:200] + "..." if len(jwt_token) > 200 else jwt_token)
+                        token_metrics = token_cache.metrics()
+                        if token_metrics["hit_rate"] is not None:
+                            st.caption(
+                                f"JWT cache: {token_metrics['hit_rate']:.0%} hit rate, "
+                                f"{token_metrics['signatures_saved']} signatures saved, "
+                                f"{token_metrics['background_refreshes']} background refreshes"
+                            )
         else:
             st.error("Invalid CLEAR ID Token format. Ensure it has 3 parts (header.payload.signature) with valid base64 encoding.")
     else:
@@ -748,6 +355,13 @@ with st.sidebar:
         help="Enable for testing with self-signed certificates"
     )
     
+    document_cache = get_document_cache()
+    if document_cache:
+        cache_stats = document_cache.stats()
+        if st.button(f"Clear Document Cache ({cache_stats['bytes'] / (1024 * 1024):.1f} MB)", use_container_width=True):
+            document_cache.clear()
+            st.rerun()
+    
     st.markdown('<p class="section-header">Create Patient in CommonWell</p>', unsafe_allow_html=True)
     
     st.caption("Create a patient record using demographics from the CLEAR ID Token before querying documents.")
@@ -770,9 +384,14 @@ with st.sidebar:
         if clear_claims and jwt_token:
             with st.spinner("Creating patient..."):
                 patient_obj = build_patient_object(clear_claims, cvs_patient_id, cvs_aaid)
-                result = create_patient(environment, jwt_token, patient_obj, skip_tls)
+                async_client = get_async_client()
+                if async_client:
+                    result = async_client.create_patient(environment, jwt_token, patient_obj, skip_tls)
+                else:
+                    result = create_patient(environment, jwt_token, patient_obj, skip_tls, pool=get_http_pool())
                 
                 if result.get("success"):
+                    get_query_cache().invalidate_identifier(query_identifier(cvs_aaid, cvs_patient_id))
                     st.success("Patient created successfully!")
                     with st.expander("View Patient Object"):
                         st.json(result.get("patient_object", {}))
@@ -784,6 +403,64 @@ with st.sidebar:
     if not clear_id_token:
         st.warning("Enter a CLEAR ID Token and generate JWT first")
     
+    with st.expander("Batch Enrollment"):
+        st.caption("Create many patients from a CSV or JSONL file with clear_token, patient_id and aaid columns. Patients already created from this host are skipped.")
+        enrollment_file = st.file_uploader("Cohort file", type=["csv", "jsonl", "ndjson"], key="enrollment_file")
+        enrollment_workers = st.number_input("Concurrent creates", min_value=1, max_value=16, value=ENROLLMENT_WORKERS, key="enrollment_workers")
+        retry_unknown = st.checkbox(
+            "Retry unknown outcomes",
+            key="enrollment_retry_unknown",
+            help="Send again patients whose earlier create timed out or was interrupted. Confirm they are not in CommonWell first."
+        )
+        
+        if st.button("Enroll Patients", disabled=enrollment_file is None, use_container_width=True):
+            try:
+                cohort = list(parse_rows(io.StringIO(enrollment_file.getvalue().decode("utf-8-sig"), newline=""), is_jsonl(enrollment_file.name)))
+            except ValueError as e:
+                cohort = []
+                st.error(f"Could not read {enrollment_file.name}: {e}")
+            
+            if cohort:
+                async_client = get_async_client()
+                if async_client:
+                    create = async_client.create_patient
+                else:
+                    pool = get_http_pool()
+                    create = lambda env, cw_jwt, patient_obj, skip_verify: create_patient(env, cw_jwt, patient_obj, skip_verify, pool=pool)
+                
+                progress_bar = st.progress(0.0, text="Starting enrollment...")
+                records = []
+                # Rows are only sent to the environment selected above; a different environment column fails the row
+                for record in enroll(
+                    cohort, environment, get_enrollment_registry(), get_token_cache(), create,
+                    skip_tls, retry_unknown, int(enrollment_workers), environment_column=False
+                ):
+                    records.append(record)
+                    if record["outcome"] == "created":
+                        get_query_cache().invalidate_identifier(query_identifier(record["aaid"], record["patient_id"]))
+                    progress_bar.progress(len(records) / len(cohort), text=f"Processed {len(records)}/{len(cohort)} rows")
+                progress_bar.empty()
+                st.session_state["enrollment_records"] = records
+        
+        enrollment_records = st.session_state.get("enrollment_records")
+        if enrollment_records:
+            summary = summarize(enrollment_records)
+            st.caption(", ".join(f"{count} {outcome}" for outcome, count in sorted(summary["outcomes"].items())))
+            if summary["latency"]["count"]:
+                st.caption(f"Create latency p50 {summary['latency']['p50']:.0f} ms, p95 {summary['latency']['p95']:.0f} ms")
+            st.dataframe(
+                [{k: record[k] for k in ("row", "patient_id", "outcome", "error")} for record in sorted(enrollment_records, key=lambda record: record["row"])],
+                use_container_width=True,
+                hide_index=True
+            )
+            st.download_button(
+                "Download Report",
+                report_csv(enrollment_records),
+                file_name=f"enrollment_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+    
     st.markdown('<p class="section-header">Patient Identifier (for Query)</p>', unsafe_allow_html=True)
     
     aaid = st.text_input(
@@ -844,6 +521,29 @@ with st.sidebar:
         help="Filter by document author"
     )
     
+    st.markdown('<p class="section-header">Pagination</p>', unsafe_allow_html=True)
+    
+    paginate = st.checkbox(
+        "Follow next page links",
+        value=True,
+        help="Fetch every page of the Bundle (link rel=next) and show documents as pages arrive"
+    )
+    
+    page_size = st.number_input(
+        "Page size (_count)",
+        min_value=0,
+        max_value=1000,
+        value=0,
+        step=10,
+        help="Documents per page requested from the server. 0 uses the server default."
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        max_pages = st.number_input("Max pages", min_value=0, value=0, help="0 = no limit", disabled=not paginate)
+    with col2:
+        max_documents = st.number_input("Max documents", min_value=0, value=0, help="0 = no limit", disabled=not paginate)
+    
     st.markdown('<p class="section-header">Query URL Preview</p>', unsafe_allow_html=True)
     
     query_params = {
@@ -857,27 +557,428 @@ with st.sidebar:
         "document_type": document_type,
         "content_type": content_type,
         "author": author,
+        "page_size": page_size,
         "skip_tls_verify": skip_tls
     }
     
     preview_url = build_query_url(query_params)
     st.markdown(f'<div class="url-preview">{preview_url}</div>', unsafe_allow_html=True)
     
+    bypass_query_cache = st.checkbox(
+        "Bypass query cache",
+        value=False,
+        help="Always send the query to CommonWell instead of reusing a recent identical result"
+    )
+    
     can_execute = bool(jwt_token and aaid and patient_id)
     
-    if st.button("Execute Query", type="primary", disabled=not can_execute, use_container_width=True):
+    run_query = st.button("Execute Query", type="primary", disabled=not can_execute, use_container_width=True)
+    
+    with st.expander("Latency metrics"):
+        registry = get_registry()
+        phases = [
+            {
+                "Operation": row.get("operation") or row.get("endpoint") or row.get("host"),
+                "Phase": row.get("phase", "queue wait"),
+                "Count": row["count"],
+                "p50 (ms)": round(row["p50_ms"], 1) if row["p50_ms"] is not None else None,
+                "p95 (ms)": round(row["p95_ms"], 1) if row["p95_ms"] is not None else None,
+                "Max (ms)": round(row["max_ms"], 1)
+            }
+            for row in registry.snapshot()["histograms"]
+        ]
+        if phases:
+            st.dataframe(phases, use_container_width=True, hide_index=True)
+        else:
+            st.caption("No requests timed yet")
+        if METRICS_PORT:
+            st.caption(f"Prometheus endpoint: http://127.0.0.1:{METRICS_PORT}/metrics")
+        st.download_button(
+            "Export snapshot",
+            registry.render_prometheus(),
+            file_name=f"commonwell_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prom",
+            mime="text/plain",
+            use_container_width=True
+        )
+
+if run_query:
+    query_started = time.perf_counter()
+    if paginate:
+        progress = st.empty()
+        loaded_rows = []
+        
+        def show_page(page: Dict[str, Any]):
+            for doc in page["documents"]:
+                loaded_rows.append({
+                    "ID": doc["id"],
+                    "Status": doc["status"],
+                    "Date": doc.get("date"),
+                    "Description": doc["description"],
+                    "Author": doc.get("author")
+                })
+            with progress.container():
+                suffix = " (loading next page...)" if page["has_more"] else ""
+                st.caption(f"Page {page['page']}: {page['document_count']} documents loaded{suffix}")
+                st.dataframe(loaded_rows, use_container_width=True, hide_index=True)
+        
+        result = get_query_cache().get_or_fetch(
+            preview_url,
+            jwt_token,
+            query_identifier(aaid, patient_id),
+            lambda: run_paginated_query_request(query_params, max_pages or None, max_documents or None, on_page=show_page),
+            bypass=bypass_query_cache,
+            variant=f"pages={max_pages}|documents={max_documents}",
+            refresh=lambda: run_paginated_query_request(query_params, max_pages or None, max_documents or None)
+        )
+        progress.empty()
+    else:
         with st.spinner("Executing query..."):
-            result = execute_query(query_params)
-            add_to_history(query_params, result["success"])
-            
-            if result["success"]:
-                st.session_state.results = result["data"]
-                st.session_state.error = None
-                st.session_state.response_time = result.get("response_time")
-            else:
-                st.session_state.results = None
-                st.session_state.error = result["error"]
-                st.session_state.response_time = result.get("response_time")
+            result = get_query_cache().get_or_fetch(
+                preview_url,
+                jwt_token,
+                query_identifier(aaid, patient_id),
+                lambda: run_query_request(query_params),
+                bypass=bypass_query_cache,
+                variant="single-page"
+            )
+    
+    query_latency_ms = (time.perf_counter() - query_started) * 1000
+    
+    bulk = st.session_state.pop("bulk_download", None)
+    if bulk and os.path.exists(bulk["path"]):
+        os.remove(bulk["path"])
+    for key in RESULTS_WIDGET_KEYS:
+        st.session_state.pop(key, None)
+    for key in [key for key in st.session_state if key.startswith("preview_data_")]:
+        st.session_state.pop(key)
+    
+    if result["success"]:
+        st.session_state.results = result["data"]
+        with timed("index", "results"):
+            st.session_state.document_index = DocumentIndex.from_bundle(result["data"])
+        st.session_state.error = None
+        st.session_state.response_time = result.get("response_time")
+        st.session_state.query_cache_status = (result.get("cache"), result.get("cache_age"))
+        if result.get("truncated"):
+            st.warning(f"Stopped after {result['pages']} page(s); more documents are available on the server.")
+    else:
+        st.session_state.results = None
+        st.session_state.document_index = None
+        st.session_state.error = result["error"]
+        st.session_state.response_time = result.get("response_time")
+    
+    add_to_history(
+        query_params, result["success"], result.get("cache"), preview_url,
+        latency_ms=query_latency_ms,
+        document_count=len(st.session_state.document_index) if result["success"] else None,
+        pages=result.get("pages", 1 if result["success"] else None),
+        error=result.get("error")
+    )
+
+@fragment
+def render_bulk_download(attachments: List[Dict[str, Any]], environment: str, jwt_token: str, skip_tls: bool, document_cache: Optional[DocumentCache]):
+    if st.button(f"Download all attachments ({len(attachments)})", key="bulk_download_start"):
+        progress_bar = st.progress(0.0, text="Starting downloads...")
+        previous = st.session_state.pop("bulk_download", None)
+        if previous and os.path.exists(previous["path"]):
+            os.remove(previous["path"])
+
+        # Streamed downloads go through the document cache and raw content negotiation, and never hold a whole base64 body
+        fetch = lambda job: download_document_stream(
+            environment, jwt_token, job["url"], skip_tls, job.get("content_type"),
+            pool=get_http_pool(), cache=document_cache
+        )
+
+        with tempfile.NamedTemporaryFile(prefix="commonwell_", suffix=".zip", delete=False) as zip_file:
+            report = download_all(
+                attachments,
+                fetch,
+                zip_file,
+                on_progress=lambda done, total, entry: progress_bar.progress(done / total, text=f"Downloaded {done}/{total} files")
+            )
+        progress_bar.empty()
+        st.session_state.bulk_download = {"path": zip_file.name, "report": report}
+
+    bulk = st.session_state.get("bulk_download")
+    if bulk and os.path.exists(bulk["path"]):
+        report = bulk["report"]
+        m1, m2, m3, m4, m5 = st.columns(5)
+        m1.metric("Files", report["file_count"], delta=f"-{report['failed']} failed" if report["failed"] else None)
+        m2.metric("Size", f"{report['bytes'] / (1024 * 1024):.2f} MB")
+        m3.metric("Throughput", f"{report['files_per_second'] or 0:.1f} files/s")
+        m4.metric("p50 latency", f"{report['latency_p50_ms'] or 0:.0f} ms")
+        m5.metric("p95 latency", f"{report['latency_p95_ms'] or 0:.0f} ms")
+
+        with open(bulk["path"], "rb") as zip_file:
+            st.download_button(
+                "Save ZIP",
+                zip_file,
+                file_name=f"commonwell_documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                mime="application/zip",
+                key="bulk_download_save"
+            )
+        with st.expander("Per-file results"):
+            st.dataframe([
+                {
+                    "File": f["name"],
+                    "Status": "OK" if f["success"] else f.get("error"),
+                    "Bytes": f.get("bytes"),
+                    "Latency (ms)": round(f["latency_ms"]) if f.get("latency_ms") is not None else None
+                }
+                for f in report["files"]
+            ], use_container_width=True, hide_index=True)
+
+    st.divider()
+
+def render_document_card(doc: Dict[str, Any], environment: str, jwt_token: str, skip_tls: bool, document_cache: Optional[DocumentCache]):
+    with st.container():
+        st.markdown(f"""
+        <div class="doc-card">
+            <div class="doc-title">{doc['description']}</div>
+            <div class="doc-meta">
+                ID: {doc['id']} | 
+                Status: <span class="status-badge status-{doc['status']}">{doc['status']}</span> |
+                Date: {doc.get('date', 'N/A')} |
+                Author: {doc.get('author', 'N/A')}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        cols = st.columns(len(doc["content"]) if doc["content"] else 1)
+        for idx, content in enumerate(doc["content"]):
+            with cols[idx % len(cols)]:
+                content_type_str = content.get("contentType", "unknown")
+                size = content.get("size")
+                size_str = f" ({size} bytes)" if size else ""
+                
+                st.markdown(f"**{content_type_str}**{size_str}")
+                
+                if content.get("url"):
+                    col_a, col_b, col_c = st.columns(3)
+                    with col_a:
+                        if st.button("Copy URL", key=f"copy_{doc['id']}_{idx}"):
+                            st.code(content["url"])
+                    with col_b:
+                        if st.button("Preview", key=f"preview_{doc['id']}_{idx}"):
+                            with st.spinner("Loading document..."):
+                                result = download_document_stream(
+                                    environment,
+                                    jwt_token,
+                                    content["url"],
+                                    skip_tls,
+                                    content.get("contentType"),
+                                    pool=get_http_pool(),
+                                    cache=document_cache
+                                )
+                                if result["success"]:
+                                    digest = hashlib.sha256()
+                                    result["file"].seek(0)
+                                    for block in iter(lambda: result["file"].read(1 << 20), b""):
+                                        digest.update(block)
+                                    result["file"].seek(0)
+                                    result["sha256"] = digest.hexdigest()
+                                    st.session_state[f"preview_data_{doc['id']}_{idx}"] = result
+                                else:
+                                    st.error(result["error"])
+                    with col_c:
+                        if st.button("Download", key=f"download_{doc['id']}_{idx}"):
+                            with st.spinner("Downloading..."):
+                                result = download_document_stream(
+                                    environment,
+                                    jwt_token,
+                                    content["url"],
+                                    skip_tls,
+                                    content.get("contentType"),
+                                    pool=get_http_pool(),
+                                    cache=document_cache
+                                )
+                                if result["success"]:
+                                    file_data = result["file"]
+                                    file_data.seek(0)
+                                    ext = ".xml" if "xml" in result["content_type"] else ".pdf" if "pdf" in result["content_type"] else ".bin"
+                                    st.download_button(
+                                        "Save File",
+                                        file_data,
+                                        file_name=f"{doc['id']}{ext}",
+                                        mime=result["content_type"],
+                                        key=f"save_{doc['id']}_{idx}"
+                                    )
+                                else:
+                                    st.error(result["error"])
+                    
+                    # Not the Preview button's key: a button's session state is reset on every rerun
+                    preview_key = f"preview_data_{doc['id']}_{idx}"
+                    if preview_key in st.session_state and st.session_state[preview_key]:
+                        preview_data = st.session_state[preview_key]
+                        if preview_data.get("cached"):
+                            st.caption("Served from local document cache")
+                        
+                        if "xml" in preview_data["content_type"]:
+                            render_xml_preview(preview_data)
+                        elif "pdf" in preview_data["content_type"]:
+                            render_pdf_preview(preview_data)
+                        else:
+                            st.text(read_document_bytes(preview_data, 5000).decode("utf-8", errors="replace"))
+        
+        st.divider()
+
+def render_pdf_preview(preview_data: Dict[str, Any]):
+    preview_server = get_preview_server()
+    if preview_server:
+        # The browser fetches the PDF (by range) from the local endpoint; only the URL goes over the websocket
+        src = preview_server.publish(preview_data["sha256"], preview_data["file"], preview_data["size"], preview_data["content_type"])
+    else:
+        src = f"data:application/pdf;base64,{base64.b64encode(read_document_bytes(preview_data)).decode()}"
+    st.markdown(f'<iframe src="{src}" width="100%" height="500px"></iframe>', unsafe_allow_html=True)
+
+def render_xml_preview(preview_data: Dict[str, Any]):
+    document_file = preview_data["file"]
+    digest = preview_data["sha256"]
+    size = preview_data.get("size") or 0
+    large = size > XML_PREVIEW_MAX_BYTES
+    
+    sections_tab, formatted_tab, raw_tab = st.tabs(["Sections", "Formatted", "Raw"])
+    with sections_tab:
+        outline = ccda_outline(digest, document_file)
+        if outline["title"]:
+            st.markdown(f"**{outline['title']}**")
+        if outline["error"]:
+            st.warning(outline["error"])
+        if not outline["sections"]:
+            st.caption("No C-CDA sections found")
+        for section in outline["sections"]:
+            label = f"{'↳ ' * section['level']}{section['name']} ({section['entries']} entries)"
+            with st.expander(label):
+                st.caption(f"LOINC {section['code']}" + (f" | {section['title']}" if section["title"] != section["name"] else ""))
+                st.write(section["text"] or "No narrative text")
+    with formatted_tab:
+        formatted, truncated = format_xml(digest, document_file, XML_PREVIEW_MAX_CHARS if large else None)
+        if truncated:
+            st.caption(f"Showing the start of a {size / (1024 * 1024):.1f} MB document; use Download for the full file")
+        st.code(formatted, language="xml")
+    with raw_tab:
+        raw = read_document_bytes(preview_data, XML_PREVIEW_MAX_CHARS if large else None)
+        if large:
+            st.caption(f"Showing the first {XML_PREVIEW_MAX_CHARS:,} bytes")
+        st.code(raw.decode("utf-8", errors="replace"), language="xml")
+
+SORT_OPTIONS = {"Date": "date", "Status": "status", "Type": "type", "Author": "author", "Content type": "content_type", "Size": "size", "ID": "id"}
+
+@fragment
+def render_document_list(index: DocumentIndex, environment: str, jwt_token: str, skip_tls: bool, document_cache: Optional[DocumentCache]):
+    with timed("render", "document_list"):
+        render_document_rows(index, environment, jwt_token, skip_tls, document_cache)
+
+def render_document_rows(index: DocumentIndex, environment: str, jwt_token: str, skip_tls: bool, document_cache: Optional[DocumentCache]):
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        search = st.text_input("Search", placeholder="ID, description, author or type", key="results_search")
+    with col2:
+        sort_label = st.selectbox("Sort by", list(SORT_OPTIONS), key="results_sort")
+    with col3:
+        descending = st.toggle("Descending", value=True, key="results_descending")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        statuses = st.multiselect("Status", index.distinct("status"), key="results_status")
+    with col2:
+        types = st.multiselect("Type", index.distinct("type"), key="results_type")
+    with col3:
+        content_types = st.multiselect("Content type", index.distinct("content_type"), key="results_content_type")
+    with col4:
+        authors = st.multiselect("Author", index.distinct("author"), key="results_author")
+    
+    rows = index.rows(statuses, types, content_types, authors, search, SORT_OPTIONS[sort_label], descending)
+    if not rows:
+        st.info(f"No documents match the filters ({len(index)} in the result)")
+        return
+    
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        view = st.radio(
+            "View",
+            ["Cards", "Table"],
+            index=1 if len(index) > RESULTS_TABLE_VIEW_THRESHOLD else 0,
+            horizontal=True,
+            key="results_view"
+        )
+    
+    if view == "Table":
+        st.dataframe({
+            "ID": [index.ids[row] for row in rows],
+            "Status": [index.statuses[row] for row in rows],
+            "Date": [index.dates[row] for row in rows],
+            "Type": [index.type_labels[row] for row in rows],
+            "Description": [index.descriptions[row] for row in rows],
+            "Author": [index.authors[row] for row in rows],
+            "Content Types": [", ".join(index.content_types[row]) for row in rows],
+            "Size": [index.sizes[row] for row in rows]
+        }, use_container_width=True, hide_index=True)
+        
+        selected = st.selectbox(
+            "Open document",
+            rows,
+            index=None,
+            format_func=lambda row: f"{index.ids[row]} - {index.descriptions[row]}",
+            placeholder=f"Select one of {len(rows)} documents to preview or download",
+            key="results_selected"
+        )
+        if selected is not None and selected < len(index):
+            render_document_card(index.document(selected), environment, jwt_token, skip_tls, document_cache)
+        return
+    
+    with col2:
+        page_size = st.selectbox(
+            "Per page",
+            RESULTS_PAGE_SIZE_OPTIONS,
+            index=RESULTS_PAGE_SIZE_OPTIONS.index(RESULTS_PAGE_SIZE),
+            key="results_page_size"
+        )
+    page_count = max(1, -(-len(rows) // page_size))
+    # Clamp before the widget is created; filtering or a larger page size can leave the old page out of range
+    if st.session_state.setdefault("results_page", 1) > page_count:
+        st.session_state.results_page = page_count
+    with col3:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, key="results_page")
+    
+    start = (page - 1) * page_size
+    visible = rows[start:start + page_size]
+    st.caption(f"Showing {start + 1}-{start + len(visible)} of {len(rows)} documents" + (f" ({len(index)} in the result)" if len(rows) < len(index) else ""))
+    for row in visible:
+        render_document_card(index.document(row), environment, jwt_token, skip_tls, document_cache)
+
+@fragment
+def render_raw_json(raw: RawBundle):
+    size_mb = raw.size / (1024 * 1024)
+    st.json(raw.envelope, expanded=False)
+    
+    doc_id = st.text_input("Jump to DocumentReference ID", key="raw_json_id").strip()
+    if doc_id:
+        entry = raw.find(doc_id)
+        if entry is None:
+            st.warning(f"No entry with ID {doc_id}")
+        else:
+            st.json(entry)
+        return
+    
+    if raw.size > RAW_JSON_MAX_BYTES:
+        st.info(f"The response is {size_mb:.1f} MB, too large to show here. Look up an entry by ID above or download it as NDJSON.")
+        st.download_button(
+            "Download NDJSON",
+            raw.ndjson(),
+            file_name=f"commonwell_documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson",
+            mime="application/x-ndjson",
+            key="raw_json_ndjson"
+        )
+        return
+    
+    shown = min(st.session_state.setdefault("raw_json_entries", RAW_JSON_CHUNK_ENTRIES), len(raw))
+    st.caption(f"Entries 1-{shown} of {len(raw)} ({raw.size / 1024:,.0f} KB)")
+    st.json(raw.chunk(0, shown))
+    if shown < len(raw):
+        if st.button(f"Show {min(RAW_JSON_CHUNK_ENTRIES, len(raw) - shown)} more", key="raw_json_more"):
+            st.session_state.raw_json_entries = shown + RAW_JSON_CHUNK_ENTRIES
+            st.rerun()
 
 tab1, tab2, tab3 = st.tabs(["Results", "Query History", "Help"])
 
@@ -892,120 +993,119 @@ with tab1:
         with col1:
             st.markdown(f"### Results ({total} documents)")
         with col2:
-            if st.session_state.response_time:
+            cache_status, cache_age = st.session_state.query_cache_status
+            if cache_status in ("hit", "stale"):
+                st.markdown(f"*Cached result ({cache_age:.0f}s old{', refreshing' if cache_status == 'stale' else ''})*")
+            elif st.session_state.response_time:
                 st.markdown(f"*Response time: {st.session_state.response_time:.0f}ms*")
         
         result_tab1, result_tab2 = st.tabs(["Documents List", "Raw JSON"])
         
         with result_tab1:
-            documents = extract_documents(bundle)
+            index = st.session_state.get("document_index")
+            if index is None:
+                with timed("index", "results"):
+                    index = st.session_state.document_index = DocumentIndex.from_bundle(bundle)
             
-            if documents:
-                for doc in documents:
-                    with st.container():
-                        st.markdown(f"""
-                        <div class="doc-card">
-                            <div class="doc-title">{doc['description']}</div>
-                            <div class="doc-meta">
-                                ID: {doc['id']} | 
-                                Status: <span class="status-badge status-{doc['status']}">{doc['status']}</span> |
-                                Date: {doc.get('date', 'N/A')} |
-                                Author: {doc.get('author', 'N/A')}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        cols = st.columns(len(doc["content"]) if doc["content"] else 1)
-                        for idx, content in enumerate(doc["content"]):
-                            with cols[idx % len(cols)]:
-                                content_type_str = content.get("contentType", "unknown")
-                                size = content.get("size")
-                                size_str = f" ({size} bytes)" if size else ""
-                                
-                                st.markdown(f"**{content_type_str}**{size_str}")
-                                
-                                if content.get("url"):
-                                    col_a, col_b, col_c = st.columns(3)
-                                    with col_a:
-                                        if st.button("Copy URL", key=f"copy_{doc['id']}_{idx}"):
-                                            st.code(content["url"])
-                                    with col_b:
-                                        if st.button("Preview", key=f"preview_{doc['id']}_{idx}"):
-                                            with st.spinner("Loading document..."):
-                                                result = download_document(
-                                                    environment,
-                                                    jwt_token,
-                                                    content["url"],
-                                                    skip_tls
-                                                )
-                                                if result["success"]:
-                                                    st.session_state[f"preview_{doc['id']}_{idx}"] = result
-                                                else:
-                                                    st.error(result["error"])
-                                    with col_c:
-                                        if st.button("Download", key=f"download_{doc['id']}_{idx}"):
-                                            with st.spinner("Downloading..."):
-                                                result = download_document(
-                                                    environment,
-                                                    jwt_token,
-                                                    content["url"],
-                                                    skip_tls
-                                                )
-                                                if result["success"]:
-                                                    file_data = base64.b64decode(result["data"])
-                                                    ext = ".xml" if "xml" in result["content_type"] else ".pdf" if "pdf" in result["content_type"] else ".bin"
-                                                    st.download_button(
-                                                        "Save File",
-                                                        file_data,
-                                                        file_name=f"{doc['id']}{ext}",
-                                                        mime=result["content_type"],
-                                                        key=f"save_{doc['id']}_{idx}"
-                                                    )
-                                                else:
-                                                    st.error(result["error"])
-                                    
-                                    preview_key = f"preview_{doc['id']}_{idx}"
-                                    if preview_key in st.session_state and st.session_state[preview_key]:
-                                        preview_data = st.session_state[preview_key]
-                                        decoded = base64.b64decode(preview_data["data"]).decode("utf-8", errors="replace")
-                                        
-                                        if "xml" in preview_data["content_type"]:
-                                            formatted_tab, raw_tab = st.tabs(["Formatted", "Raw"])
-                                            with formatted_tab:
-                                                st.code(format_xml(decoded), language="xml")
-                                            with raw_tab:
-                                                st.code(decoded, language="xml")
-                                        elif "pdf" in preview_data["content_type"]:
-                                            st.markdown(f'<iframe src="data:application/pdf;base64,{preview_data["data"]}" width="100%" height="500px"></iframe>', unsafe_allow_html=True)
-                                        else:
-                                            st.text(decoded[:5000])
-                        
-                        st.divider()
+            if len(index):
+                attachments = index.attachments()
+                
+                if attachments:
+                    render_bulk_download(attachments, environment, jwt_token, skip_tls, document_cache)
+                
+                render_document_list(index, environment, jwt_token, skip_tls, document_cache)
             else:
                 st.info("No documents found in the response")
         
         with result_tab2:
-            st.json(bundle)
+            raw = st.session_state.get("raw_json")
+            if raw is None:
+                with timed("serialize", "results"):
+                    raw = st.session_state.raw_json = RawBundle.from_bundle(bundle)
+            render_raw_json(raw)
     else:
         st.info("Execute a query to see results here")
 
-with tab2:
-    if st.session_state.query_history:
-        if st.button("Clear History"):
-            st.session_state.query_history = []
-            st.rerun()
-        
-        for entry in st.session_state.query_history:
-            status_icon = "✅" if entry["success"] else "❌"
-            timestamp = datetime.fromisoformat(entry["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
-            st.markdown(f"""
-            {status_icon} **{entry['environment'].title()}** - {entry.get('aaid', '')}|{entry.get('patient_id', '')}  
-            *{timestamp}*
-            """)
-            with st.expander("View URL"):
-                st.code(entry["url"])
-    else:
+@fragment
+def render_query_history():
+    history = get_history_store()
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col1:
+        history_environment = st.selectbox("Environment", ["All", "integration", "production"], key="history_environment")
+    with col2:
+        history_aaid = st.text_input("AAID", key="history_aaid").strip()
+    with col3:
+        history_patient_id = st.text_input("Patient ID", key="history_patient_id").strip()
+    filters = {
+        "environment": None if history_environment == "All" else history_environment,
+        "aaid": history_aaid or None,
+        "patient_id": history_patient_id or None
+    }
+    # A new filter starts again from the newest entry
+    if st.session_state.get("history_filters") != filters:
+        st.session_state.history_filters = filters
+        st.session_state.history_cursors = [None]
+    
+    with st.expander("Daily latency"):
+        summary = history.daily_summary(14, filters["environment"])
+        if summary:
+            st.dataframe([
+                {
+                    "Day": day["day"],
+                    "Queries": day["queries"],
+                    "Success": f"{day['success_rate']:.0%}",
+                    "p50 (ms)": round(day["p50_ms"]) if day["p50_ms"] is not None else None,
+                    "p95 (ms)": round(day["p95_ms"]) if day["p95_ms"] is not None else None,
+                    "Max (ms)": round(day["max_ms"]) if day["max_ms"] is not None else None
+                }
+                for day in summary
+            ], use_container_width=True, hide_index=True)
+            st.caption("Latency excludes results served from the query cache")
+        else:
+            st.caption("No queries in the last 14 days")
+    
+    cursors = st.session_state.history_cursors
+    entries, next_cursor = history.page(HISTORY_PAGE_SIZE, cursors[-1], **filters)
+    if not entries:
         st.info("No query history yet")
+        return
+    
+    for entry in entries:
+        status_icon = "✅" if entry["success"] else "❌"
+        timestamp = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        cache_note = " · from cache" if entry.get("cache") in ("hit", "stale") else ""
+        details = []
+        if entry["latency_ms"] is not None:
+            details.append(f"{entry['latency_ms']:.0f} ms")
+        if entry["document_count"] is not None:
+            details.append(f"{entry['document_count']} documents")
+        detail_note = f" · {' · '.join(details)}" if details else ""
+        st.markdown(f"""
+        {status_icon} **{entry['environment'].title()}** - {entry['aaid']}|{entry['patient_id']}  
+        *{timestamp}{cache_note}{detail_note}*
+        """)
+        with st.expander("View URL"):
+            st.code(entry["url"])
+            if entry["error"]:
+                st.error(entry["error"])
+    
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col1:
+        if st.button("Newer", disabled=len(cursors) == 1, use_container_width=True, key="history_newer"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if st.button("Older", disabled=next_cursor is None, use_container_width=True, key="history_older"):
+            cursors.append(next_cursor)
+            st.rerun()
+    with col3:
+        if st.button("Clear History", use_container_width=True, key="history_clear"):
+            history.clear()
+            st.session_state.history_cursors = [None]
+            st.rerun()
+
+with tab2:
+    render_query_history()
 
 with tab3:
     st.markdown("""
@@ -1047,3 +1147,5 @@ with tab3:
     - **Preview**: View the document content inline
     - **Download**: Download the document file
     """)
+
+observe_phase("render", time.perf_counter() - script_started, "app")
@@ -0,0 +1,141 @@
+"""Compare query fan-out throughput: requests with a thread pool vs the async client.
+
+Both paths run the same DocumentReference query many times against a local
+HTTP server that answers after a fixed delay, with the client-side rate
+limits lifted so only the transport is measured.
+
+    python benchmarks/async_client.py --requests 200 --concurrency 20 --latency 0.05
+
+The local server speaks HTTP/1.1 over plain HTTP, so this measures the
+asyncio path, not HTTP/2 multiplexing; point both clients at an HTTP/2
+server to see that.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+def synthetic_bundle(documents: int) -> bytes:
+    return json.dumps({
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": documents,
+        "entry": [
+            {"resource": {"resourceType": "DocumentReference", "id": f"doc-{i}", "status": "current", "description": f"Document {i}"}}
+            for i in range(documents)
+        ]
+    }).encode("utf-8")
+
+def start_server(latency: float, body: bytes) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/fhir+json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_threads(params, requests_count: int, concurrency: int):
+    from commonwell.fhir import execute_query
+    from commonwell.transport import SessionPool
+
+    pool = SessionPool(pool_size=concurrency)
+    latencies = []
+
+    def one(_):
+        start = time.perf_counter()
+        result = execute_query(params, pool=pool)
+        latencies.append((time.perf_counter() - start) * 1000)
+        return result["success"]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        ok = sum(executor.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return elapsed, ok, latencies
+
+def run_async(params, requests_count: int, concurrency: int):
+    from commonwell.aio import AsyncCommonWellClient
+
+    latencies = []
+
+    async def main():
+        client = AsyncCommonWellClient(max_connections=concurrency)
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with gate:
+                start = time.perf_counter()
+                result = await client.execute_query(params)
+                latencies.append((time.perf_counter() - start) * 1000)
+                return result["success"]
+
+        try:
+            return sum(await asyncio.gather(*(one() for _ in range(requests_count))))
+        finally:
+            await client.aclose()
+
+    start = time.perf_counter()
+    ok = asyncio.run(main())
+    return time.perf_counter() - start, ok, latencies
+
+def report(name: str, elapsed: float, ok: int, latencies, requests_count: int):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(
+        f"{name:<8} {requests_count / elapsed:8.1f} req/s  {elapsed * 1000:8.0f} ms total  "
+        f"p50 {statistics.median(latencies):6.1f} ms  p95 {p95:6.1f} ms  ok {ok}/{requests_count}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Server delay per request in seconds")
+    parser.add_argument("--documents", type=int, default=50, help="DocumentReferences per response Bundle")
+    args = parser.parse_args()
+
+    os.chdir(APP_DIR)
+    import config
+    from commonwell.aio import async_client_available
+    from commonwell.governor import get_governor
+    from commonwell.log import get_logger
+
+    if not async_client_available():
+        raise SystemExit('The async client requires httpx. Install with: pip install "httpx[http2]"')
+
+    # Keep log formatting off the measured path
+    get_logger().level = 100
+    server = start_server(args.latency, synthetic_bundle(args.documents))
+    config.API_BASE_URLS["benchmark"] = f"http://127.0.0.1:{server.server_port}/v2/R4/"
+    get_governor().configure("query", rate=1e9, burst=1e9, concurrency=args.concurrency)
+    params = {"environment": "benchmark", "jwt_token": "benchmark", "aaid": "2.16.840.1", "patient_id": "1"}
+
+    print(f"{args.requests} queries, concurrency {args.concurrency}, server latency {args.latency * 1000:.0f} ms, {args.documents} documents per Bundle")
+    report("threads", *run_threads(params, args.requests, args.concurrency), args.requests)
+    report("async", *run_async(params, args.requests, args.concurrency), args.requests)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Compare JSON backends on realistic DocumentReference Bundles and Binary resources.
+
+Each payload is decoded the way the app used to (``response.json()``,
+which decodes the body to text first) and with ``commonwell.jsonio.loads``
+on the response bytes under every backend that is installed, then encoded
+again as the log writer and Raw JSON view do.
+
+    python benchmarks/json_codec.py --documents 5000 --binary-mb 4
+"""
+import argparse
+import base64
+import gc
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import requests
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+BINARY_BASE = "https://api.integration.commonwellalliance.lkopera.com/v2/R4/Binary/"
+
+def synthetic_bundle(documents: int) -> dict:
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": documents,
+        "link": [{"relation": "self", "url": "https://api.integration.commonwellalliance.lkopera.com/v2/R4/DocumentReference?patient=1"}],
+        "entry": [
+            {
+                "fullUrl": f"https://api.integration.commonwellalliance.lkopera.com/v2/R4/DocumentReference/doc-{i}",
+                "resource": {
+                    "resourceType": "DocumentReference",
+                    "id": f"doc-{i}",
+                    "meta": {"lastUpdated": "2024-01-15T10:30:00Z"},
+                    "masterIdentifier": {"system": "urn:ietf:rfc:3986", "value": f"urn:oid:2.16.840.1.113883.3.{i}"},
+                    "status": "current",
+                    "type": {"coding": [{"system": "http://loinc.org", "code": "34133-9", "display": "Summary of episode note"}]},
+                    "category": [{"coding": [{"system": "http://hl7.org/fhir/us/core/CodeSystem/us-core-documentreference-category", "code": "clinical-note"}]}],
+                    "subject": {"reference": f"Patient/{i % 50}"},
+                    "date": "2024-01-15T10:30:00Z",
+                    "author": [{"display": f"Clinic {i % 17} – Médecine générale"}],
+                    "description": f"Continuity of Care Document {i}",
+                    "content": [
+                        {"attachment": {"contentType": "application/xml", "url": f"{BINARY_BASE}{i}-xml", "size": 48213, "title": "C-CDA"}},
+                        {"attachment": {"contentType": "application/pdf", "url": f"{BINARY_BASE}{i}-pdf", "size": 120933, "title": "PDF"}}
+                    ],
+                    "context": {"period": {"start": "2024-01-01", "end": "2024-01-15"}, "facilityType": {"text": "Outpatient"}}
+                },
+                "search": {"mode": "match"}
+            }
+            for i in range(documents)
+        ]
+    }
+
+def synthetic_binary(megabytes: float) -> dict:
+    data = random.Random(0).randbytes(int(megabytes * 1024 * 1024))
+    return {"resourceType": "Binary", "id": "binary-1", "contentType": "application/pdf", "data": base64.b64encode(data).decode("ascii")}
+
+def as_response(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/fhir+json"
+    response._content = body
+    return response
+
+def best_of(func, repeat: int):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+        # Freeing a large decoded Bundle is the same for every backend; keep it out of the timing
+        del result
+    return min(times), statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5000, help="DocumentReferences in the Bundle")
+    parser.add_argument("--binary-mb", type=float, default=4, help="Decoded size of the Binary attachment")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    os.chdir(APP_DIR)
+    import config
+    from commonwell import jsonio
+
+    payloads = {
+        "Bundle": json.dumps(synthetic_bundle(args.documents)).encode("utf-8"),
+        "Binary": json.dumps(synthetic_binary(args.binary_mb)).encode("utf-8")
+    }
+    backends = [name for name, module in (("json", json), ("orjson", jsonio.orjson), ("msgspec", jsonio.msgspec)) if module is not None]
+
+    print(f"{'payload':<8} {'path':<24} {'decode min/med ms':>20} {'encode min/med ms':>20}")
+    for name, body in payloads.items():
+        print(f"{name:<8} {len(body) / (1024 * 1024):.1f} MB")
+        value = json.loads(body)
+        decode = best_of(lambda: as_response(body).json(), args.repeat)
+        encode = best_of(lambda: json.dumps(value), args.repeat)
+        print(f"{'':<8} {'response.json()':<24} {decode[0]:9.1f} /{decode[1]:8.1f} {encode[0]:9.1f} /{encode[1]:8.1f}")
+        for backend in backends:
+            config.JSON_BACKEND = backend
+            jsonio = importlib.reload(jsonio)
+            assert jsonio.loads(body) == value
+            decode = best_of(lambda: jsonio.loads(as_response(body).content), args.repeat)
+            encode = best_of(lambda: jsonio.dumps(value), args.repeat)
+            print(f"{'':<8} {'jsonio.loads (' + backend + ')':<24} {decode[0]:9.1f} /{decode[1]:8.1f} {encode[0]:9.1f} /{encode[1]:8.1f}")
+
+if __name__ == "__main__":
+    main()
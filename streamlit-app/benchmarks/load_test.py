@@ -0,0 +1,185 @@
+"""Load-test the app's CommonWell client code against the local mock server.
+
+Each simulated user runs the UI's flow in a loop: a paginated
+DocumentReference query, streamed downloads of the first --downloads
+documents, and now and then a patient create. Everything goes over mTLS
+to benchmarks/mock_server.py, started in this process with fresh test
+certificates, through the same retry, circuit breaker and session pool
+code the app uses.
+
+    python benchmarks/load_test.py --users 20 --duration 30 --latency 0.05 --error-rate 0.01
+    python benchmarks/load_test.py --users 20 --iterations 5 --client async
+
+Client-side rate limits are lifted unless --rate-limits is given, so the
+mock server and the client code are what is measured.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ENVIRONMENT = "mock"
+
+def configure_app(certs: Dict[str, str], mock) -> None:
+    # transport reads the certificate paths at import, so this runs before any commonwell import
+    import config
+    config.CLIENT_CERT_PATH = certs["client-cert"]
+    config.CLIENT_KEY_PATH = certs["client-key"]
+    config.CA_CERT_PATH = certs["ca-cert"]
+    config.API_BASE_URLS[ENVIRONMENT] = mock.fhir_url
+    config.PATIENT_API_BASE_URLS[ENVIRONMENT] = mock.base_url
+
+    from commonwell import fhir
+    from commonwell.log import get_logger
+    fhir.BINARY_ALLOWED_HOSTS[ENVIRONMENT] = "localhost"
+    # Keep log formatting off the measured path
+    get_logger().level = 100
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float, result: Dict[str, Any], size: int = 0):
+        with self._lock:
+            self.latencies[operation].append(seconds * 1000)
+            if not result.get("success"):
+                self.failures[operation] += 1
+            self.bytes += size
+
+def run_user(user: int, args, client, recorder: Recorder, stop: threading.Event):
+    from commonwell.fhir import download_document_stream, execute_paginated_query, extract_documents
+    from commonwell.patient import create_patient
+
+    params = {"environment": ENVIRONMENT, "jwt_token": "mock-token", "aaid": "2.16.840.1.113883.3.mock", "patient_id": f"user-{user}"}
+    iteration = 0
+    while not stop.is_set() and (args.iterations is None or iteration < args.iterations):
+        iteration += 1
+        start = time.perf_counter()
+        if client:
+            result = client.execute_paginated_query(params, max_documents=args.max_documents)
+        else:
+            result = execute_paginated_query(params, max_documents=args.max_documents)
+        recorder.record("query", time.perf_counter() - start, result)
+
+        documents = extract_documents(result["data"]) if result["success"] else []
+        for document in documents[:args.downloads]:
+            attachment = document["content"][0]
+            start = time.perf_counter()
+            if client:
+                download = client.download_document(ENVIRONMENT, params["jwt_token"], attachment["url"])
+                size = len(download.get("data") or "")
+            else:
+                download = download_document_stream(ENVIRONMENT, params["jwt_token"], attachment["url"], preferred_type=attachment["contentType"])
+                size = download.get("size") or 0
+                if download.get("file"):
+                    download["file"].close()
+            recorder.record("binary", time.perf_counter() - start, download, size)
+
+        if args.patient_every and iteration % args.patient_every == 0:
+            patient = {"resourceType": "Patient", "identifier": [{"system": "urn:oid:mock", "value": f"{user}-{iteration}"}]}
+            start = time.perf_counter()
+            if client:
+                created = client.create_patient(ENVIRONMENT, params["jwt_token"], patient)
+            else:
+                created = create_patient(ENVIRONMENT, params["jwt_token"], patient)
+            recorder.record("patient_create", time.perf_counter() - start, created)
+
+def report(recorder: Recorder, elapsed: float, rss_before: int, traced_peak: int, mock):
+    from commonwell.stats import latency_summary
+
+    print(f"{'operation':<15} {'count':>7} {'failed':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for operation, latencies in sorted(recorder.latencies.items()):
+        summary = latency_summary(latencies)
+        print(
+            f"{operation:<15} {summary['count']:>7} {recorder.failures[operation]:>7} {summary['count'] / elapsed:>8.1f} "
+            f"{summary['p50']:>8.1f} {summary['p95']:>8.1f} {summary['p99']:>8.1f} {summary['max']:>8.1f}"
+        )
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss_scale = 1 if sys.platform == "darwin" else 1024
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale
+    print(f"elapsed {elapsed:.1f}s, downloaded {recorder.bytes / (1024 * 1024):.1f} MB, server saw {mock.requests} requests ({mock.errors} injected errors)")
+    print(f"peak RSS {rss_peak / (1024 * 1024):.0f} MB (+{(rss_peak - rss_before) / (1024 * 1024):.0f} MB during the run)", end="")
+    print(f", peak traced Python memory {traced_peak / (1024 * 1024):.1f} MB" if traced_peak else "")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run, unless --iterations is given")
+    parser.add_argument("--iterations", type=int, help="Flows per user instead of a fixed duration")
+    parser.add_argument("--client", choices=["requests", "async"], default="requests", help="Session pool path or the async client facade")
+    parser.add_argument("--downloads", type=int, default=3, help="Documents each flow downloads")
+    parser.add_argument("--max-documents", type=int, help="Stop each query after this many documents")
+    parser.add_argument("--patient-every", type=int, default=5, help="Create a patient every N flows per user; 0 to disable")
+    parser.add_argument("--documents", type=int, default=120, help="DocumentReferences per patient on the mock")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--binary-kb", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock responses that are 503")
+    parser.add_argument("--rate-limits", action="store_true", help="Keep the client-side RATE_LIMITS")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also trace peak Python allocations (slows the run)")
+    parser.add_argument("--certs", help="Directory for test certificates (default: a temporary directory)")
+    args = parser.parse_args()
+
+    os.chdir(APP_DIR)
+    from mock_server import MockCommonWell, generate_test_certs
+
+    certs = generate_test_certs(args.certs or tempfile.mkdtemp(prefix="commonwell-mock-"))
+    mock = MockCommonWell(
+        certs, documents=args.documents, page_size=args.page_size, binary_bytes=args.binary_kb * 1024,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=1
+    ).start()
+    configure_app(certs, mock)
+
+    from commonwell.governor import get_governor
+    if not args.rate_limits:
+        for endpoint in ("query", "binary", "patient_create"):
+            get_governor().configure(endpoint, rate=1e9, burst=1e9, concurrency=args.users * 2)
+
+    client = None
+    if args.client == "async":
+        from commonwell.aio import CommonWellClient, async_client_available
+        if not async_client_available():
+            raise SystemExit('The async client requires httpx. Install with: pip install "httpx[http2]"')
+        client = CommonWellClient(max_connections=args.users)
+
+    print(f"{args.users} users, {args.client} client, mock latency {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms, "
+          f"error rate {args.error_rate:.0%}, {args.documents} documents in pages of {args.page_size}, {args.binary_kb} KB Binaries")
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    recorder = Recorder()
+    stop = threading.Event()
+    users = [threading.Thread(target=run_user, args=(user, args, client, recorder, stop), daemon=True) for user in range(args.users)]
+
+    start = time.perf_counter()
+    for thread in users:
+        thread.start()
+    if args.iterations is None:
+        stop.wait(args.duration)
+        stop.set()
+    for thread in users:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else 0
+    report(recorder, elapsed, rss_before, traced_peak, mock)
+    if client:
+        client.close()
+    mock.close()
+
+if __name__ == "__main__":
+    main()
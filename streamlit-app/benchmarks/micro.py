@@ -0,0 +1,294 @@
+"""Micro-benchmarks for the app's hot pure functions, checked against a stored baseline.
+
+Each case is timed with timeit (best of --repeat samples, per call) and
+run once under tracemalloc for its peak allocation. Results are compared
+with benchmarks/micro_baseline.json; the run exits non-zero when a case is
+slower than its baseline by more than --time-tolerance, or allocates more
+than --memory-tolerance.
+
+    python benchmarks/micro.py                     # compare with the baseline
+    python benchmarks/micro.py --save              # record a new baseline
+    python benchmarks/micro.py --filter extract    # only cases whose name contains "extract"
+
+Timings depend on the machine, so they are only checked against a
+baseline recorded on the same platform, Python and CPU count, and are
+scaled by a reference workload timed next to each case, so a machine
+that is busy overall does not read as a regression; peak memory is
+checked everywhere. Re-record the baseline with --save on the
+machine that runs the check when it changes.
+"""
+import argparse
+import base64
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+BINARY_BASE = "https://api.integration.commonwellalliance.lkopera.com/v2/R4/Binary/"
+
+# Allocations this small vary with interpreter internals, not with the code under test
+MEMORY_SLACK_BYTES = 16 * 1024
+CONFIRM_RUNS = 2
+
+def machine() -> str:
+    return f"{platform.system()} {platform.machine()} {platform.python_implementation()} {platform.python_version()} {os.cpu_count()} CPUs"
+
+def unsigned_token(claims: Dict[str, Any]) -> str:
+    def encode(value: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).rstrip(b"=").decode("ascii")
+    return f"{encode({'alg': 'RS256', 'typ': 'JWT'})}.{encode(claims)}.c2lnbmF0dXJl"
+
+def clear_claims() -> Dict[str, Any]:
+    return {
+        "sub": "clear-7f3a9c", "given_name": "Jane", "middle_name": "Q", "family_name": "Doe", "birthdate": "1980-04-12",
+        "gender": "female", "phone_number": "+15555550100", "email": "jane.doe@example.com",
+        "address": {"street_address": "1 Main St", "locality": "Springfield", "region": "IL", "postal_code": "62701", "country": "US"},
+        "exp": int(datetime.datetime.now().timestamp()) + 3600
+    }
+
+def signing_files(directory: str) -> Tuple[str, str]:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "micro-benchmark")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_path, cert_path = os.path.join(directory, "private_key.pem"), os.path.join(directory, "certificate.pem")
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return key_path, cert_path
+
+def synthetic_bundle(documents: int) -> Dict[str, Any]:
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": documents,
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "DocumentReference",
+                    "id": f"doc-{i}",
+                    "status": "current",
+                    "description": f"Continuity of Care Document {i}",
+                    "date": "2024-01-15T10:30:00Z",
+                    "author": [{"display": f"Clinic {i % 17}"}],
+                    "type": {"coding": [{"system": "http://loinc.org", "code": "34133-9"}]},
+                    "content": [
+                        {"attachment": {"contentType": "application/xml", "url": f"{BINARY_BASE}{i}-xml", "size": 48213}},
+                        {"attachment": {"contentType": "application/pdf", "url": f"{BINARY_BASE}{i}-pdf", "size": 120933}}
+                    ]
+                }
+            }
+            for i in range(documents)
+        ]
+    }
+
+def synthetic_ccda(sections: int, rows: int) -> bytes:
+    from commonwell.ccda import CCDA_SECTIONS
+
+    codes = list(CCDA_SECTIONS)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<ClinicalDocument xmlns="urn:hl7-org:v3" xmlns:sdtc="urn:hl7-org:sdtc"><title>Continuity of Care Document</title><component><structuredBody>'
+    ]
+    for s in range(sections):
+        code = codes[s % len(codes)]
+        parts.append(
+            f'<component><section><templateId root="2.16.840.1.113883.10.20.22.2.{s}"/>'
+            f'<code code="{code}" codeSystem="2.16.840.1.113883.6.1" displayName="{CCDA_SECTIONS[code]}"/>'
+            f'<title>{CCDA_SECTIONS[code]}</title><text><table><thead><tr><th>Name</th><th>Status</th><th>Date</th></tr></thead><tbody>'
+        )
+        parts.extend(f"<tr><td>Item {s}-{r} &amp; detail</td><td>active</td><td>2024-01-{r % 28 + 1:02d}</td></tr>" for r in range(rows))
+        parts.append("</tbody></table></text>")
+        parts.extend(
+            f'<entry typeCode="DRIV"><observation classCode="OBS" moodCode="EVN"><id root="{s}.{r}"/>'
+            f'<code code="{r}" codeSystem="2.16.840.1.113883.6.96"/><statusCode code="completed"/>'
+            f'<effectiveTime value="2024011{r % 10}"/></observation></entry>'
+            for r in range(rows)
+        )
+        parts.append("</section></component>")
+    parts.append("</structuredBody></component></ClinicalDocument>")
+    return "\n".join(parts).encode("utf-8")
+
+def synthetic_binary(megabytes: float) -> bytes:
+    data = random.Random(0).randbytes(int(megabytes * 1024 * 1024))
+    encoded = base64.b64encode(data).decode("ascii")
+    # Servers commonly wrap base64 at 76 characters
+    wrapped = "\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+    return json.dumps({"resourceType": "Binary", "id": "binary-1", "contentType": "application/pdf", "data": wrapped}).encode("utf-8")
+
+def build_cases(workdir: str) -> List[Tuple[str, Callable[[], Any]]]:
+    from commonwell import auth
+    from commonwell.binary import BinaryResourceParser
+    from commonwell.ccda import extract_outline, pretty_print_xml
+    from commonwell.fhir import build_query_url, extract_documents
+    from commonwell.patient import build_patient_object
+    from commonwell.signing import SigningMaterial
+
+    key_path, cert_path = signing_files(workdir)
+    # generate_commonwell_jwt checks the configured paths before signing
+    auth.PRIVATE_KEY_PATH, auth.CERTIFICATE_PATH = key_path, cert_path
+    material = SigningMaterial(key_path, cert_path)
+    claims = clear_claims()
+    id_token = unsigned_token(claims)
+    commonwell_jwt = auth.generate_commonwell_jwt(id_token, material)["jwt"]
+    query_params = {
+        "environment": "integration", "aaid": "2.16.840.1.113883.3.5958.1000.300", "patient_id": "PAT-000123",
+        "status": "current", "document_type": "34133-9", "date_from": datetime.date(2023, 1, 1), "date_to": datetime.date(2024, 12, 31),
+        "content_type": "application/pdf", "author": "Clinic 7", "page_size": 50
+    }
+    bundles = {size: synthetic_bundle(size) for size in (10, 1000, 10000)}
+    ccda = synthetic_ccda(sections=25, rows=400)
+    binary = synthetic_binary(8)
+
+    def parse_binary():
+        target = io.BytesIO()
+        parser = BinaryResourceParser(target)
+        view = memoryview(binary)
+        for offset in range(0, len(binary), 64 * 1024):
+            parser.feed(bytes(view[offset:offset + 64 * 1024]))
+        parser.close()
+        return target
+
+    return [
+        ("generate_commonwell_jwt", lambda: auth.generate_commonwell_jwt(id_token, material)),
+        ("decode_clear_id_token", lambda: auth.decode_clear_id_token(id_token)),
+        ("validate_jwt", lambda: auth.validate_jwt(commonwell_jwt)),
+        ("build_patient_object", lambda: build_patient_object(claims, "PAT-000123", "2.16.840.1.113883.3.5958.1000.300")),
+        ("build_query_url", lambda: build_query_url(query_params)),
+        *((f"extract_documents[{size}]", (lambda bundle: lambda: extract_documents(bundle))(bundle)) for size, bundle in bundles.items()),
+        (f"pretty_print_xml[{len(ccda) // 1024}KB]", lambda: pretty_print_xml(ccda)),
+        (f"extract_outline[{len(ccda) // 1024}KB]", lambda: extract_outline(ccda)),
+        ("binary_base64_decode[8MB]", parse_binary)
+    ]
+
+def reference_workload():
+    # Plain interpreter work (dicts, strings, sorting, json) to gauge how fast this machine is running right now
+    rows = [{"id": f"doc-{i}", "size": (i * 7919) % 1000, "tags": [str(i), "x" * (i % 7)]} for i in range(2000)]
+    rows.sort(key=lambda row: (row["size"], row["id"]))
+    return json.loads(json.dumps(rows))
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    func()
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    per_call = min(timer.repeat(repeat=repeat, number=loops)) / loops
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1] - before
+        del result
+    finally:
+        tracemalloc.stop()
+    return {"time_us": per_call * 1e6, "peak_kb": peak / 1024}
+
+def reference_time(repeat: int) -> float:
+    timer = timeit.Timer(reference_workload)
+    return min(timer.repeat(repeat=repeat, number=10)) / 10 * 1e6
+
+def measure_case(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    # The reference is timed on both sides of the case, since a shared machine's speed drifts within a run
+    before = reference_time(repeat)
+    result = measure(func, repeat)
+    result["reference_us"] = (before + reference_time(repeat)) / 2
+    return result
+
+def compare(
+    name: str,
+    result: Dict[str, float],
+    baseline: Dict[str, float],
+    check_time: bool,
+    time_tolerance: float,
+    memory_tolerance: float
+) -> List[str]:
+    failures = []
+    # Scale the baseline by how much slower the machine is running now than when it was recorded
+    speed = result["reference_us"] / baseline["reference_us"]
+    if check_time and result["time_us"] > baseline["time_us"] * speed * (1 + time_tolerance):
+        failures.append(f"{name}: {result['time_us']:.1f} us per call, baseline {baseline['time_us']:.1f} us x {speed:.2f} machine speed")
+    memory_limit = baseline["peak_kb"] * (1 + memory_tolerance) + MEMORY_SLACK_BYTES / 1024
+    if result["peak_kb"] > memory_limit:
+        failures.append(f"{name}: peak {result['peak_kb']:.0f} KB, baseline {baseline['peak_kb']:.0f} KB")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--filter", help="Only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing samples per case; the fastest is kept")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="Allowed slowdown before failing, as a fraction")
+    parser.add_argument("--memory-tolerance", type=float, default=0.10, help="Allowed growth in peak memory, as a fraction")
+    args = parser.parse_args()
+
+    os.chdir(APP_DIR)
+    from commonwell.log import get_logger
+    # Keep log formatting off the measured path
+    get_logger().level = 100
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    check_time = baseline.get("machine") == machine()
+    if baseline and not check_time and not args.save:
+        print(f"Baseline was recorded on {baseline.get('machine')}; checking peak memory only on {machine()}")
+
+    with tempfile.TemporaryDirectory(prefix="micro-bench-") as workdir:
+        cases = [(name, func) for name, func in build_cases(workdir) if not args.filter or args.filter in name]
+        results: Dict[str, Dict[str, float]] = {}
+        failures: List[str] = []
+        print(f"{'case':<32} {'us/call':>12} {'baseline':>12} {'peak KB':>10} {'baseline':>10}")
+        for name, func in cases:
+            result = results[name] = measure_case(func, args.repeat)
+            previous = baseline.get("results", {}).get(name)
+            print(
+                f"{name:<32} {result['time_us']:>12.1f} {previous['time_us'] if previous else float('nan'):>12.1f} "
+                f"{result['peak_kb']:>10.0f} {previous['peak_kb'] if previous else float('nan'):>10.0f}"
+            )
+            if previous and not args.save:
+                regressions = compare(name, result, previous, check_time, args.time_tolerance, args.memory_tolerance)
+                # Only fail if the slowdown holds up when measured again
+                for _ in range(CONFIRM_RUNS):
+                    if not regressions:
+                        break
+                    regressions = compare(name, measure_case(func, args.repeat), previous, check_time, args.time_tolerance, args.memory_tolerance)
+                failures.extend(regressions)
+
+    if args.save:
+        saved = baseline.get("results", {}) if args.filter and check_time else {}
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine(), "results": {**saved, **results}}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline for {len(results)} cases to {os.path.relpath(args.baseline)}")
+        return
+
+    if failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
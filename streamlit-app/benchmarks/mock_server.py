@@ -0,0 +1,283 @@
+"""Local mock of the CommonWell FHIR R4 API, served over mTLS with generated test certificates.
+
+Answers DocumentReference searches with synthetic, paged Bundles, Binary
+reads with payloads of a configurable size (as a FHIR Binary, or raw when
+the Accept header prefers a document type) and Patient creates. Latency
+and error rates can be injected per request.
+
+    python benchmarks/mock_server.py --port 8443 --documents 120 --page-size 50 --latency 0.05 --error-rate 0.02
+
+Certificates are written to --certs (default ./.cache/mock-certs): a test
+CA, a server certificate for localhost and a client certificate the
+server requires. Point config.py at the client certificate and CA, and
+add the printed URLs as an environment, to use the app against it.
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import random
+import ssl
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+MOCK_HOST = "localhost"
+
+def generate_test_certs(directory: str) -> Dict[str, str]:
+    """Write a test CA, a localhost server certificate and a client certificate; reuses them if present."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+    import ipaddress
+
+    paths = {name: os.path.join(directory, f"{name}.pem") for name in ("ca-cert", "server-cert", "server-key", "client-cert", "client-key")}
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+    os.makedirs(directory, exist_ok=True)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def name(common_name: str) -> x509.Name:
+        return x509.Name([x509.NameAttribute(NameOID.ORGANIZATION_NAME, "CommonWell Mock"), x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+    def certificate(subject: str, key, issuer: Optional[x509.Name], issuer_key, usage, san=None, ca: bool = False) -> x509.Certificate:
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(name(subject))
+            .issuer_name(issuer or name(subject))
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=30))
+            .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+        )
+        if usage:
+            builder = builder.add_extension(x509.ExtendedKeyUsage([usage]), critical=False)
+        if san:
+            builder = builder.add_extension(x509.SubjectAlternativeName(san), critical=False)
+        return builder.sign(issuer_key, hashes.SHA256())
+
+    def write(path: str, data: bytes, private: bool = False):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 if private else 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+    def write_key(path: str, key):
+        write(path, key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()), private=True)
+
+    ca_key = ec.generate_private_key(ec.SECP256R1())
+    ca_cert = certificate("CommonWell Mock CA", ca_key, None, ca_key, None, ca=True)
+    server_key = ec.generate_private_key(ec.SECP256R1())
+    server_cert = certificate(
+        MOCK_HOST, server_key, ca_cert.subject, ca_key, ExtendedKeyUsageOID.SERVER_AUTH,
+        san=[x509.DNSName(MOCK_HOST), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+    )
+    client_key = ec.generate_private_key(ec.SECP256R1())
+    client_cert = certificate("commonwell-mock-client", client_key, ca_cert.subject, ca_key, ExtendedKeyUsageOID.CLIENT_AUTH)
+
+    write(paths["ca-cert"], ca_cert.public_bytes(serialization.Encoding.PEM))
+    write(paths["server-cert"], server_cert.public_bytes(serialization.Encoding.PEM))
+    write_key(paths["server-key"], server_key)
+    write(paths["client-cert"], client_cert.public_bytes(serialization.Encoding.PEM))
+    write_key(paths["client-key"], client_key)
+    return paths
+
+class MockCommonWell:
+    """The mock API: a threaded HTTPS server that requires a client certificate from the test CA."""
+
+    def __init__(
+        self,
+        certs: Dict[str, str],
+        port: int = 0,
+        documents: int = 50,
+        page_size: int = 50,
+        binary_bytes: int = 256 * 1024,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.documents = documents
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        self.payload = random.Random(0).randbytes(binary_bytes)
+        self.payload_b64 = base64.b64encode(self.payload).decode("ascii")
+
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH, cafile=certs["ca-cert"])
+        context.load_cert_chain(certs["server-cert"], certs["server-key"])
+        context.verify_mode = ssl.CERT_REQUIRED
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _handler_for(self))
+        self.httpd.daemon_threads = True
+        # The handshake runs on the first read, in the request thread, so slow clients don't stall accept()
+        self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True, do_handshake_on_connect=False)
+        self.base_url = f"https://{MOCK_HOST}:{self.httpd.server_port}/v2/"
+
+    @property
+    def fhir_url(self) -> str:
+        return self.base_url + "R4/"
+
+    def start(self) -> "MockCommonWell":
+        threading.Thread(target=self.httpd.serve_forever, name="mock-commonwell", daemon=True).start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def bundle(self, query: Dict[str, str], offset: int) -> bytes:
+        patient = query.get("patient.identifier", "unknown")
+        rows = range(offset, min(offset + self.page_size, self.documents))
+        bundle = {
+            "resourceType": "Bundle",
+            "id": str(uuid.uuid4()),
+            "type": "searchset",
+            "total": self.documents,
+            "link": [{"relation": "self", "url": f"{self.fhir_url}DocumentReference?{urlencode(query)}"}],
+            "entry": [self.document_reference(patient, row) for row in rows]
+        }
+        if offset + self.page_size < self.documents:
+            bundle["link"].append({
+                "relation": "next",
+                "url": f"{self.fhir_url}DocumentReference?{urlencode({**query, '_offset': offset + self.page_size})}"
+            })
+        return json.dumps(bundle).encode("utf-8")
+
+    def document_reference(self, patient: str, row: int) -> Dict:
+        content_type = ("application/pdf", "application/xml", "text/plain")[row % 3]
+        return {
+            "fullUrl": f"{self.fhir_url}DocumentReference/{row}",
+            "resource": {
+                "resourceType": "DocumentReference",
+                "id": f"mock-{row}",
+                "status": "current",
+                "type": {"coding": [{"system": "http://loinc.org", "code": "34133-9", "display": "Summary of episode note"}]},
+                "subject": {"reference": f"Patient/{patient}"},
+                "date": (datetime.date(2024, 1, 1) + datetime.timedelta(days=row % 365)).isoformat() + "T10:30:00Z",
+                "author": [{"display": f"Mock Clinic {row % 17}"}],
+                "description": f"Synthetic document {row}",
+                "content": [{"attachment": {"contentType": content_type, "url": f"{self.fhir_url}Binary/{row}", "size": len(self.payload)}}]
+            }
+        }
+
+def _handler_for(mock: MockCommonWell):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_body(self, status: int, body: bytes, content_type: str = "application/fhir+json", headers: Optional[Dict[str, str]] = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def outcome(self, status: int, code: str, diagnostics: str, headers: Optional[Dict[str, str]] = None):
+            body = {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": code, "diagnostics": diagnostics}]}
+            self.send_body(status, json.dumps(body).encode("utf-8"), headers=headers)
+
+        def prepare(self) -> bool:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            time.sleep(mock.delay())
+            if not self.headers.get("Authorization", "").startswith("Bearer "):
+                self.outcome(401, "login", "Missing bearer token")
+                return False
+            if mock.should_fail():
+                self.outcome(503, "transient", "Injected failure", {"Retry-After": "0"})
+                return False
+            return True
+
+        def do_GET(self):
+            if not self.prepare():
+                return
+            parts = urlsplit(self.path)
+            query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+            if parts.path == "/v2/R4/DocumentReference":
+                offset = int(query.pop("_offset", 0))
+                self.send_body(200, mock.bundle(query, offset))
+            elif parts.path.startswith("/v2/R4/Binary/"):
+                binary_id = parts.path.rsplit("/", 1)[-1]
+                accept = self.headers.get("Accept", "")
+                if accept and not accept.startswith("application/fhir+json"):
+                    self.send_body(200, mock.payload, accept.split(",")[0].strip())
+                else:
+                    body = {"resourceType": "Binary", "id": binary_id, "contentType": "application/pdf", "data": mock.payload_b64}
+                    self.send_body(200, json.dumps(body).encode("utf-8"))
+            else:
+                self.outcome(404, "not-found", f"No route for {parts.path}")
+
+        def do_POST(self):
+            if not self.prepare():
+                return
+            if urlsplit(self.path).path.endswith("/Patient"):
+                patient = {"resourceType": "Patient", "id": str(uuid.uuid4()), "meta": {"lastUpdated": datetime.datetime.now(datetime.timezone.utc).isoformat()}}
+                self.send_body(201, json.dumps(patient).encode("utf-8"))
+            else:
+                self.outcome(404, "not-found", f"No route for {self.path}")
+
+        def handle(self):
+            try:
+                super().handle()
+            except (ssl.SSLError, ConnectionResetError, BrokenPipeError):
+                # Clients without the test certificate, or closing mid-response
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--certs", default="./.cache/mock-certs", help="Directory for the generated test certificates")
+    parser.add_argument("--documents", type=int, default=50, help="DocumentReferences per patient")
+    parser.add_argument("--page-size", type=int, default=50, help="Entries per Bundle page")
+    parser.add_argument("--binary-kb", type=int, default=256, help="Decoded size of each Binary")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter on the delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    certs = generate_test_certs(args.certs)
+    mock = MockCommonWell(
+        certs, args.port, args.documents, args.page_size, args.binary_kb * 1024,
+        args.latency, args.jitter, args.error_rate
+    ).start()
+    print(f"Mock CommonWell on {mock.base_url} (FHIR {mock.fhir_url})", file=sys.stderr)
+    print(f"Client certificate {certs['client-cert']}, key {certs['client-key']}, CA {certs['ca-cert']}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.close()
+
+if __name__ == "__main__":
+    main()
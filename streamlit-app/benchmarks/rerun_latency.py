@@ -0,0 +1,118 @@
+"""Measure Streamlit rerun latency of app.py with a loaded result set.
+
+"wall" is the full AppTest round trip; "script" is only the time spent
+executing app.py, without the test harness collecting the element tree.
+
+    python benchmarks/rerun_latency.py --documents 200
+    python benchmarks/rerun_latency.py --documents 200 --baseline-ref HEAD~1
+
+With --baseline-ref the same scenario also runs against the app as it was
+at that git revision, so a change can be compared before and after.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import io
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BINARY_BASE = "https://api.integration.commonwellalliance.lkopera.com/v2/R4/Binary/"
+
+def synthetic_bundle(documents: int):
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": documents,
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "DocumentReference",
+                    "id": f"doc-{i}",
+                    "status": "current",
+                    "description": f"Continuity of Care Document {i}",
+                    "date": "2024-01-15T10:30:00Z",
+                    "author": [{"display": f"Clinic {i % 17}"}],
+                    "type": {"coding": [{"system": "http://loinc.org", "code": "34133-9"}]},
+                    "content": [
+                        {"attachment": {"contentType": "application/xml", "url": f"{BINARY_BASE}{i}-xml", "size": 48213}},
+                        {"attachment": {"contentType": "application/pdf", "url": f"{BINARY_BASE}{i}-pdf", "size": 120933}}
+                    ]
+                }
+            }
+            for i in range(documents)
+        ]
+    }
+
+def export_revision(ref: str) -> str:
+    repo_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=APP_DIR, text=True).strip()
+    prefix = os.path.relpath(APP_DIR, repo_root)
+    archive = subprocess.check_output(["git", "archive", ref, prefix], cwd=repo_root)
+    target = tempfile.mkdtemp(prefix="rerun-bench-")
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return os.path.join(target, prefix)
+
+def measure(app_dir: str, documents: int, reruns: int):
+    from streamlit.testing.v1 import AppTest
+    from streamlit.runtime.scriptrunner import script_runner
+
+    script_times = []
+    run_script = script_runner.ScriptRunner._run_script
+
+    def timed_run_script(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return run_script(self, *args, **kwargs)
+        finally:
+            script_times.append((time.perf_counter() - start) * 1000)
+
+    previous_cwd = os.getcwd()
+    os.chdir(app_dir)
+    sys.path.insert(0, app_dir)
+    for name in [m for m in sys.modules if m == "config" or m.startswith("commonwell")]:
+        del sys.modules[name]
+    script_runner.ScriptRunner._run_script = timed_run_script
+    try:
+        at = AppTest.from_file(os.path.join(app_dir, "app.py"), default_timeout=600)
+        at.session_state["results"] = synthetic_bundle(documents)
+        start = time.perf_counter()
+        at.run()
+        first = (time.perf_counter() - start) * 1000
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+
+        timings = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            at.run()
+            timings.append((time.perf_counter() - start) * 1000)
+        return first, timings, script_times[1:]
+    finally:
+        script_runner.ScriptRunner._run_script = run_script
+        sys.path.remove(app_dir)
+        os.chdir(previous_cwd)
+
+def report(label: str, first: float, timings, script_times):
+    print(
+        f"{label:<12} first run {first:8.1f} ms | rerun median wall {statistics.median(timings):8.1f} ms"
+        f" / script {statistics.median(script_times):8.1f} ms | min {min(timings):8.1f} ms | max {max(timings):8.1f} ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200, help="DocumentReference entries in the loaded result")
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--baseline-ref", help="Git revision to compare against")
+    args = parser.parse_args()
+
+    print(f"{args.documents} documents, {args.reruns} reruns")
+    if args.baseline_ref:
+        report(args.baseline_ref, *measure(export_revision(args.baseline_ref), args.documents, args.reruns))
+    report("working tree", *measure(APP_DIR, args.documents, args.reruns))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import asyncio
+import importlib.util
+import ssl
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from config import API_TIMEOUT, ASYNC_HTTP2, ASYNC_MAX_CONNECTIONS, HTTP_POOL_IDLE_TIMEOUT
+from commonwell.fhir import (
+    binary_headers, binary_result, build_query_url, execute_paginated_query, query_headers, query_result,
+    validate_document_url
+)
+from commonwell.jsonio import dumps_bytes
+from commonwell.log import log_event, log_request
+from commonwell.metrics import record_failure
+from commonwell.patient import patient_headers, patient_result, patient_url
+from commonwell.governor import ThrottledError
+from commonwell.resilience import CircuitOpenError, circuit_for, send_with_retry_async, timeout_message
+from commonwell.transport import build_ssl_context
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+HTTP2_AVAILABLE = httpx is not None and importlib.util.find_spec("h2") is not None
+
+def async_client_available() -> bool:
+    return httpx is not None
+
+def _classify_error(error: Exception) -> Tuple[bool, bool]:
+    tls_error = isinstance(error.__cause__ or error.__context__, ssl.SSLError) or "SSL" in str(error)
+    not_sent = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)) and not tls_error
+    return not_sent, tls_error
+
+class AsyncCommonWellClient:
+    """CommonWell operations on httpx.AsyncClient, multiplexed over HTTP/2 when h2 is installed.
+
+    One client (and connection pool) is kept per (environment, skip_verify),
+    with the same mTLS material as the requests sessions. Results have the
+    same shape as the sync functions in ``commonwell.fhir`` and
+    ``commonwell.patient``, and requests go through the same retry policy,
+    circuit breakers and rate governor.
+    """
+
+    def __init__(self, http2: bool = ASYNC_HTTP2, max_connections: int = ASYNC_MAX_CONNECTIONS):
+        if httpx is None:
+            raise RuntimeError('The async client requires httpx. Install with: pip install "httpx[http2]"')
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.max_connections = max_connections
+        self._clients: Dict[Tuple[str, bool], "httpx.AsyncClient"] = {}
+        if http2 and not HTTP2_AVAILABLE:
+            log_event("Async Client", "h2 is not installed; falling back to HTTP/1.1", severity="WARNING")
+
+    def _client(self, environment: str, skip_verify: bool) -> "httpx.AsyncClient":
+        key = (environment, skip_verify)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = httpx.AsyncClient(
+                verify=build_ssl_context(skip_verify),
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.max_connections, keepalive_expiry=HTTP_POOL_IDLE_TIMEOUT),
+                timeout=API_TIMEOUT
+            )
+        return client
+
+    async def _send(self, operation: str, circuit: str, request: Callable[[Tuple[float, float]], Any], idempotent: bool = True):
+        return await send_with_retry_async(
+            request,
+            operation,
+            circuit,
+            (httpx.TransportError,),
+            _classify_error,
+            idempotent=idempotent
+        )
+
+    async def fetch_query_page(self, url: str, headers: Dict[str, str], environment: str, skip_verify: bool = False) -> Dict[str, Any]:
+        client = self._client(environment, skip_verify)
+        log_request("DocumentReference Query", "GET", url, headers)
+
+        start_time = time.perf_counter()
+        try:
+            response = await self._send(
+                "query",
+                circuit_for(environment, url),
+                lambda timeout: client.get(url, headers=headers, timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+            )
+            return query_result(response, response.reason_phrase, time.perf_counter() - start_time)
+        except httpx.TimeoutException as e:
+            record_failure("query", time.perf_counter() - start_time, e)
+            phase = "connect" if isinstance(e, httpx.ConnectTimeout) else "read"
+            return {"success": False, "error": timeout_message(e, phase)}
+        except (httpx.HTTPError, requests.exceptions.RequestException) as e:
+            record_failure("query", time.perf_counter() - start_time, e)
+            error = f"SSL/TLS Error: {str(e)}. Check your certificate configuration." if _classify_error(e)[1] else f"Request failed: {str(e)}"
+            return {"success": False, "error": error}
+
+    async def execute_query(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.fetch_query_page(
+            build_query_url(params),
+            query_headers(params.get("jwt_token", "").strip()),
+            params.get("environment", "integration"),
+            params.get("skip_tls_verify", False)
+        )
+
+    async def download_document(self, environment: str, jwt_token: str, document_url: str, skip_verify: bool = False) -> Dict[str, Any]:
+        url_error = validate_document_url(environment, document_url)
+        if url_error:
+            return {"success": False, "error": url_error}
+
+        client = self._client(environment, skip_verify)
+        headers = binary_headers(jwt_token)
+        log_request("Binary Retrieve", "GET", document_url, headers)
+
+        start_time = time.perf_counter()
+        try:
+            response = await self._send(
+                "binary",
+                circuit_for(environment, document_url),
+                lambda timeout: client.get(document_url, headers=headers, timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+            )
+            return binary_result(response, response.reason_phrase, time.perf_counter() - start_time)
+        except Exception as e:
+            record_failure("binary", time.perf_counter() - start_time, e)
+            return {"success": False, "error": str(e)}
+
+    async def download_documents(self, environment: str, jwt_token: str, document_urls: List[str], skip_verify: bool = False) -> List[Dict[str, Any]]:
+        return await asyncio.gather(*(
+            self.download_document(environment, jwt_token, url, skip_verify) for url in document_urls
+        ))
+
+    async def create_patient(self, environment: str, cw_jwt: str, patient_object: Dict[str, Any], skip_verify: bool = False) -> Dict[str, Any]:
+        url = patient_url(environment)
+        client = self._client(environment, skip_verify)
+        headers = patient_headers(cw_jwt)
+        body = dumps_bytes(patient_object)
+        log_request("Patient Create", "POST", url, headers, patient_object)
+
+        start_time = time.perf_counter()
+        try:
+            response = await self._send(
+                "patient_create",
+                environment,
+                lambda timeout: client.post(url, headers=headers, content=body, timeout=httpx.Timeout(timeout[1], connect=timeout[0])),
+                idempotent=False
+            )
+            return patient_result(response, response.reason_phrase, time.perf_counter() - start_time, patient_object)
+        except Exception as e:
+            record_failure("patient_create", time.perf_counter() - start_time, e)
+            log_event("Patient Create", f"Error: {str(e)}", severity="ERROR")
+            not_sent = isinstance(e, (ThrottledError, CircuitOpenError)) or _classify_error(e)[0]
+            return {"success": False, "error": str(e), "not_sent": not_sent, "patient_object": patient_object}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"clients": len(self._clients), "http2": self.http2, "max_connections": self.max_connections}
+
+    async def aclose(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+class CommonWellClient:
+    """Blocking facade over AsyncCommonWellClient for Streamlit and other sync callers.
+
+    The async client lives on an event loop in a background thread, so its
+    connections outlive any single call and concurrent callers share them.
+    Methods mirror the module-level sync functions.
+    """
+
+    def __init__(self, http2: bool = ASYNC_HTTP2, max_connections: int = ASYNC_MAX_CONNECTIONS):
+        self.client = AsyncCommonWellClient(http2, max_connections)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="commonwell-aio", daemon=True)
+        self._thread.start()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def execute_query(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._run(self.client.execute_query(params))
+
+    def execute_paginated_query(
+        self,
+        params: Dict[str, Any],
+        max_pages: Optional[int] = None,
+        max_documents: Optional[int] = None,
+        on_page: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        skip_verify = params.get("skip_tls_verify", False)
+        return execute_paginated_query(
+            params, max_pages, max_documents, on_page,
+            fetch_page=lambda url, headers, environment: self._run(self.client.fetch_query_page(url, headers, environment, skip_verify))
+        )
+
+    def download_document(self, environment: str, jwt_token: str, document_url: str, skip_verify: bool = False) -> Dict[str, Any]:
+        return self._run(self.client.download_document(environment, jwt_token, document_url, skip_verify))
+
+    def download_documents(self, environment: str, jwt_token: str, document_urls: List[str], skip_verify: bool = False) -> List[Dict[str, Any]]:
+        return self._run(self.client.download_documents(environment, jwt_token, document_urls, skip_verify))
+
+    def create_patient(self, environment: str, cw_jwt: str, patient_object: Dict[str, Any], skip_verify: bool = False) -> Dict[str, Any]:
+        return self._run(self.client.create_patient(environment, cw_jwt, patient_object, skip_verify))
+
+    def stats(self) -> Dict[str, Any]:
+        return self.client.stats()
+
+    def close(self):
+        if self._loop.is_running():
+            self._run(self.client.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
@@ -0,0 +1,98 @@
+import base64
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from config import CW_ORG_OID, CW_ORG_NAME, CERTIFICATE_PATH, PRIVATE_KEY_PATH
+from commonwell.signing import JWT_AVAILABLE, SigningMaterial
+
+_default_signing_material: Optional[SigningMaterial] = None
+_default_lock = threading.Lock()
+
+def get_default_signing_material() -> SigningMaterial:
+    global _default_signing_material
+    with _default_lock:
+        if _default_signing_material is None:
+            _default_signing_material = SigningMaterial(PRIVATE_KEY_PATH, CERTIFICATE_PATH)
+        return _default_signing_material
+
+def decode_clear_id_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        parts = token.split(".")
+        if len(parts) != 3:
+            return None
+        payload_padding = "=" * (4 - len(parts[1]) % 4) if len(parts[1]) % 4 else ""
+        payload = json.loads(base64.urlsafe_b64decode(parts[1] + payload_padding))
+        return payload
+    except Exception:
+        return None
+
+def generate_commonwell_jwt(clear_id_token: str, signing_material: Optional[SigningMaterial] = None) -> Dict[str, Any]:
+    if not JWT_AVAILABLE:
+        return {"error": "PyJWT and cryptography packages required. Install with: pip install PyJWT cryptography"}
+    
+    if not os.path.exists(CERTIFICATE_PATH) or not os.path.exists(PRIVATE_KEY_PATH):
+        return {"error": "Certificate files not found. Ensure certificate.pem and private_key.pem exist in certs/ folder."}
+    
+    try:
+        claims = decode_clear_id_token(clear_id_token)
+        if not claims:
+            return {"error": "Failed to decode CLEAR ID token"}
+        
+        patient_name = f"{claims.get('given_name', '')} {claims.get('family_name', '')}".strip()
+        now = datetime.now(timezone.utc)
+        
+        payload = {
+            "iss": f"urn:oid:{CW_ORG_OID}",
+            "sub": f"urn:oid:{CW_ORG_OID}",
+            "aud": "urn:commonwellalliance.org",
+            "iat": int(now.timestamp()),
+            "nbf": int(now.timestamp()),
+            "exp": int((now + timedelta(hours=1)).timestamp()),
+            "jti": str(uuid.uuid4()),
+            "urn:oasis:names:tc:xspa:1.0:subject:purposeofuse": "REQUEST",
+            "urn:oasis:names:tc:xacml:2.0:subject:role": "116154003",
+            "urn:oasis:names:tc:xspa:1.0:subject:subject-id": patient_name,
+            "urn:oasis:names:tc:xspa:1.0:subject:organization": CW_ORG_NAME,
+            "urn:oasis:names:tc:xspa:1.0:subject:organization-id": f"urn:oid:{CW_ORG_OID}",
+            "extensions": {
+                "tefca_ias": {
+                    "id_token": clear_id_token
+                }
+            }
+        }
+        
+        signed_jwt = (signing_material or get_default_signing_material()).sign(payload)
+        
+        return {"success": True, "jwt": signed_jwt, "claims": claims}
+    except Exception as e:
+        return {"error": f"Failed to generate JWT: {str(e)}"}
+
+def validate_jwt(token: str) -> Dict[str, Any]:
+    if not token or not token.strip():
+        return {"valid": False, "error": "JWT token is required"}
+    
+    parts = token.strip().split(".")
+    if len(parts) != 3:
+        return {"valid": False, "error": "Invalid JWT format - must have 3 parts separated by dots"}
+    
+    try:
+        header_padding = "=" * (4 - len(parts[0]) % 4) if len(parts[0]) % 4 else ""
+        header = json.loads(base64.urlsafe_b64decode(parts[0] + header_padding))
+        
+        payload_padding = "=" * (4 - len(parts[1]) % 4) if len(parts[1]) % 4 else ""
+        payload = json.loads(base64.urlsafe_b64decode(parts[1] + payload_padding))
+        
+        exp = payload.get("exp")
+        if exp:
+            exp_date = datetime.fromtimestamp(exp)
+            if exp_date < datetime.now():
+                return {"valid": False, "error": f"Token expired on {exp_date.strftime('%Y-%m-%d %H:%M:%S')}"}
+            return {"valid": True, "expires": exp_date.strftime('%Y-%m-%d %H:%M:%S')}
+        
+        return {"valid": True, "expires": None}
+    except Exception as e:
+        return {"valid": False, "error": f"Failed to decode JWT: {str(e)}"}
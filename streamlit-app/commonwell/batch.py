@@ -0,0 +1,336 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from config import RATE_LIMIT_SHARED_DIR
+from commonwell.auth import generate_commonwell_jwt
+from commonwell.fhir import build_query_url, execute_query, execute_paginated_query, extract_documents
+from commonwell.governor import get_governor
+from commonwell.metrics import get_registry
+from commonwell.stats import latency_summary
+from commonwell.token_cache import TokenCache
+from commonwell.transport import SessionPool
+
+FILTER_FIELDS = ["status", "document_type", "content_type", "author"]
+DATE_FIELDS = ["date_from", "date_to"]
+# Set on rows that could not be parsed, so one bad line is reported in place instead of ending the file
+ROW_ERROR = "_error"
+
+def parse_rows(f: Iterable[str], jsonl: bool) -> Iterator[Dict[str, Any]]:
+    if jsonl:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield {ROW_ERROR: f"line {number} is not valid JSON: {e}"}
+                continue
+            yield row if isinstance(row, dict) else {ROW_ERROR: f"line {number} is not a JSON object"}
+    else:
+        yield from csv.DictReader(f)
+
+def row_identifier(row: Dict[str, Any], field: str) -> str:
+    # Short CSV rows give None for missing columns
+    return str(row.get(field) or "").strip()
+
+def is_jsonl(path: str) -> bool:
+    return path.endswith(".jsonl") or path.endswith(".ndjson")
+
+def read_identifiers(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        yield from parse_rows(f, is_jsonl(path))
+
+def build_params(row: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    if row.get(ROW_ERROR):
+        raise ValueError(row[ROW_ERROR])
+    # Without both, the query URL has no patient.identifier and would search every patient
+    missing = [field for field in ("aaid", "patient_id") if not row_identifier(row, field)]
+    if missing:
+        raise ValueError(f"missing {' and '.join(missing)}")
+    params = {
+        "environment": row.get("environment") or args.environment,
+        "jwt_token": args.jwt,
+        "aaid": row_identifier(row, "aaid"),
+        "patient_id": row_identifier(row, "patient_id"),
+        "page_size": args.page_size,
+        "skip_tls_verify": args.skip_tls_verify
+    }
+    for field in FILTER_FIELDS:
+        params[field] = row.get(field) or ""
+    for field in DATE_FIELDS:
+        value = row.get(field)
+        params[field] = date.fromisoformat(value) if value else None
+    return params
+
+def run_query(
+    params: Dict[str, Any],
+    args: argparse.Namespace,
+    pool: SessionPool,
+    tokens: Optional[TokenCache] = None
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        if tokens:
+            # Long runs outlive a single JWT, so each query takes the current one from the cache
+            token = tokens.get(hashlib.sha256(args.clear_token.encode()).hexdigest()[:16], args.clear_token)
+            if "error" in token:
+                raise RuntimeError(token["error"])
+            params = {**params, "jwt_token": token["jwt"]}
+        if args.no_paginate:
+            result = execute_query(params, pool=pool)
+        else:
+            result = execute_paginated_query(params, args.max_pages, args.max_documents, pool=pool)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    latency_ms = (time.perf_counter() - start) * 1000
+
+    documents = extract_documents(result["data"]) if result.get("success") else []
+    return {
+        "environment": params["environment"],
+        "aaid": params["aaid"],
+        "patient_id": params["patient_id"],
+        "url": build_query_url(params),
+        "success": bool(result.get("success")),
+        "error": result.get("error"),
+        "pages": result.get("pages", 1 if result.get("success") else 0),
+        "truncated": bool(result.get("truncated")),
+        "document_count": len(documents),
+        "response_time_ms": result.get("response_time"),
+        "latency_ms": latency_ms,
+        "completed_at": datetime.now().isoformat(),
+        "documents": documents
+    }
+
+def invalid_row_record(row: Dict[str, Any], args: argparse.Namespace, error: str) -> Dict[str, Any]:
+    return {
+        "environment": row.get("environment") or args.environment,
+        "aaid": row_identifier(row, "aaid"),
+        "patient_id": row_identifier(row, "patient_id"),
+        "url": None,
+        "success": False,
+        "error": error,
+        "pages": 0,
+        "truncated": False,
+        "document_count": 0,
+        "response_time_ms": None,
+        "latency_ms": None,
+        "completed_at": datetime.now().isoformat(),
+        "documents": []
+    }
+
+class JsonlWriter:
+    def __init__(self, path: str, append: bool):
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    BATCH_SIZE = 500
+
+    def __init__(self, path: str, append: bool):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow. Install with: pip install pyarrow")
+
+        if append and os.path.exists(path):
+            # Parquet files cannot be appended to, so a resumed run writes a sibling part file
+            stem, ext = os.path.splitext(path)
+            path = f"{stem}.resume-{datetime.now().strftime('%Y%m%d%H%M%S')}{ext}"
+
+        document = pa.struct([
+            ("id", pa.string()),
+            ("status", pa.string()),
+            ("description", pa.string()),
+            ("date", pa.string()),
+            ("author", pa.string()),
+            ("content", pa.list_(pa.struct([
+                ("contentType", pa.string()),
+                ("url", pa.string()),
+                ("size", pa.int64()),
+                ("title", pa.string())
+            ])))
+        ])
+        self._pa = pa
+        self._schema = pa.schema([
+            ("environment", pa.string()),
+            ("aaid", pa.string()),
+            ("patient_id", pa.string()),
+            ("url", pa.string()),
+            ("success", pa.bool_()),
+            ("error", pa.string()),
+            ("pages", pa.int32()),
+            ("truncated", pa.bool_()),
+            ("document_count", pa.int32()),
+            ("response_time_ms", pa.float64()),
+            ("latency_ms", pa.float64()),
+            ("completed_at", pa.string()),
+            ("documents", pa.list_(document))
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]):
+        self._rows.append(record)
+        if len(self._rows) >= self.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+def load_checkpoint(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m commonwell.batch",
+        description="Run CommonWell DocumentReference queries for many patient identifiers."
+    )
+    parser.add_argument("input", help="CSV or JSONL file with aaid and patient_id columns (optional: environment, status, document_type, content_type, author, date_from, date_to)")
+    parser.add_argument("--output", required=True, help="Results file (.jsonl or .parquet)")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], help="Output format (default: from --output extension)")
+    parser.add_argument("--jwt", default=os.environ.get("CW_JWT", ""), help="CommonWell JWT (default: $CW_JWT)")
+    parser.add_argument("--clear-token", default=os.environ.get("CLEAR_ID_TOKEN", ""), help="CLEAR ID token to mint and refresh JWTs from instead of --jwt (default: $CLEAR_ID_TOKEN)")
+    parser.add_argument("--environment", default="integration", choices=["integration", "production"])
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent queries")
+    parser.add_argument("--rate", type=float, default=None, help="Maximum query page requests per second per environment (default: RATE_LIMITS in config.py)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Maximum query requests in flight per environment (default: RATE_LIMITS in config.py)")
+    parser.add_argument("--rate-limit-dir", default=RATE_LIMIT_SHARED_DIR, help="Directory for rate limit state shared with other processes on this host")
+    parser.add_argument("--checkpoint", help="Checkpoint of successful queries, skipped when resuming (default: <output>.checkpoint)")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--no-paginate", action="store_true", help="Only fetch the first page of each Bundle")
+    parser.add_argument("--page-size", type=int, default=None, help="_count per page")
+    parser.add_argument("--max-pages", type=int, default=None)
+    parser.add_argument("--max-documents", type=int, default=None)
+    parser.add_argument("--skip-tls-verify", action="store_true")
+    parser.add_argument("--metrics-out", help="Write per-phase latency histograms when done (.json snapshot, otherwise Prometheus text)")
+    return parser.parse_args(argv)
+
+def print_summary(latencies: List[float], succeeded: int, failed: int, skipped: int, duplicates: int, elapsed: float):
+    summary = latency_summary(latencies)
+    completed = succeeded + failed
+    print(
+        f"Completed {completed} queries ({succeeded} ok, {failed} failed, {skipped} skipped from checkpoint, "
+        f"{duplicates} duplicate rows) in {elapsed:.1f}s",
+        file=sys.stderr
+    )
+    if elapsed:
+        print(f"Throughput: {completed / elapsed:.2f} queries/s", file=sys.stderr)
+    if latencies:
+        print(
+            "Latency ms: " + ", ".join(f"{name}={summary[name]:.0f}" for name in ["min", "p50", "p90", "p95", "p99", "max"]),
+            file=sys.stderr
+        )
+
+def write_metrics(path: str):
+    registry = get_registry()
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            json.dump(registry.snapshot(), f, indent=2)
+        else:
+            f.write(registry.render_prometheus())
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if not args.jwt and not args.clear_token:
+        print("A CommonWell JWT (--jwt or $CW_JWT) or CLEAR ID token (--clear-token or $CLEAR_ID_TOKEN) is required", file=sys.stderr)
+        return 2
+    tokens = TokenCache(generate_commonwell_jwt) if args.clear_token else None
+
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint"
+    completed_keys = set() if args.no_resume else load_checkpoint(checkpoint_path)
+    resuming = bool(completed_keys)
+
+    writer = ParquetWriter(args.output, resuming) if output_format == "parquet" else JsonlWriter(args.output, resuming)
+    checkpoint = open(checkpoint_path, "a" if resuming else "w", encoding="utf-8")
+    pool = SessionPool(pool_size=max(args.workers, 1))
+    governor = get_governor()
+    governor.share_through(args.rate_limit_dir)
+    if args.rate or args.max_in_flight:
+        governor.configure("query", rate=args.rate, burst=max(1, int(args.rate)) if args.rate else None, concurrency=args.max_in_flight)
+
+    latencies: List[float] = []
+    seen_keys: Set[str] = set()
+    succeeded = failed = skipped = duplicates = 0
+    started = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            rows = read_identifiers(args.input)
+            in_flight = {}
+            exhausted = False
+
+            while not exhausted or in_flight:
+                while not exhausted and len(in_flight) < args.workers * 2:
+                    row = next(rows, None)
+                    if row is None:
+                        exhausted = True
+                        break
+                    try:
+                        params = build_params(row, args)
+                    except ValueError as e:
+                        # A malformed row fails on its own rather than ending the run
+                        writer.write(invalid_row_record(row, args, f"Invalid row: {e}"))
+                        failed += 1
+                        continue
+                    key = build_query_url(params)
+                    if key in seen_keys:
+                        duplicates += 1
+                        continue
+                    seen_keys.add(key)
+                    if key in completed_keys:
+                        skipped += 1
+                        continue
+                    in_flight[executor.submit(run_query, params, args, pool, tokens)] = key
+
+                if not in_flight:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = in_flight.pop(future)
+                    record = future.result()
+                    writer.write(record)
+                    if record["success"]:
+                        checkpoint.write(key + "\n")
+                        checkpoint.flush()
+                    latencies.append(record["latency_ms"])
+                    if record["success"]:
+                        succeeded += 1
+                    else:
+                        failed += 1
+    finally:
+        writer.close()
+        checkpoint.close()
+        pool.close()
+        print_summary(latencies, succeeded, failed, skipped, duplicates, time.perf_counter() - started)
+        if args.metrics_out:
+            write_metrics(args.metrics_out)
+
+    return 0 if failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
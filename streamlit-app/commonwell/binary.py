@@ -0,0 +1,257 @@
+import base64
+import json
+import tempfile
+import time
+from typing import Any, BinaryIO, Dict, Optional
+
+from config import BINARY_STREAM_CHUNK_SIZE, BINARY_SPOOL_MAX_MEMORY
+from commonwell.metrics import observe_phase, record_response
+from commonwell.resilience import circuit_for, send_with_retry
+
+WHITESPACE = b" \t\r\n"
+BASE64_CHARS = frozenset(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=")
+# Escapes that can appear in a base64 string: "\/" and line wrapping; "\uXXXX" is handled separately
+DATA_ESCAPES = {ord("/"): b"/", ord("n"): b"", ord("r"): b"", ord("t"): b""}
+QUOTE = ord('"')
+BACKSLASH = ord("\\")
+
+class Base64Sink:
+    def __init__(self, target: BinaryIO):
+        self.target = target
+        self.pending = b""
+        self.size = 0
+
+    def write(self, chars: bytes):
+        data = self.pending + chars.translate(None, WHITESPACE)
+        cut = len(data) - len(data) % 4
+        if cut:
+            decoded = base64.b64decode(data[:cut])
+            self.target.write(decoded)
+            self.size += len(decoded)
+        self.pending = data[cut:]
+
+    def close(self):
+        if self.pending:
+            decoded = base64.b64decode(self.pending + b"=" * (-len(self.pending) % 4))
+            self.target.write(decoded)
+            self.size += len(decoded)
+            self.pending = b""
+
+class BinaryResourceParser:
+    """Incremental parser for a FHIR Binary resource.
+
+    The base64 ``data`` member is decoded straight into ``target`` as it
+    arrives; every other top-level member is small and kept in ``fields``.
+    """
+
+    def __init__(self, target: BinaryIO):
+        self.sink = Base64Sink(target)
+        self.fields: Dict[str, Any] = {}
+        self.state = "start"
+        self.key = None
+        self.buffer = bytearray()
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.unicode_escape: Optional[bytearray] = None
+
+    def _finish_value(self, next_state: str):
+        self.fields[self.key] = json.loads(bytes(self.buffer))
+        self.buffer.clear()
+        self.state = next_state
+
+    def _decode_unicode_escape(self) -> bytes:
+        try:
+            code = int(bytes(self.unicode_escape), 16)
+        except ValueError:
+            raise ValueError("Invalid \\u escape in Binary data")
+        self.unicode_escape = None
+        if code in BASE64_CHARS:
+            return bytes([code])
+        if code in WHITESPACE:
+            return b""
+        raise ValueError(f"Unexpected character U+{code:04X} in Binary data")
+
+    def feed(self, chunk: bytes):
+        i = 0
+        n = len(chunk)
+        while i < n:
+            c = chunk[i]
+            state = self.state
+
+            if state == "data":
+                if self.unicode_escape is not None:
+                    # "\uXXXX" may be split across chunks, so its hex digits are collected one at a time
+                    self.unicode_escape.append(c)
+                    if len(self.unicode_escape) == 4:
+                        self.sink.write(self._decode_unicode_escape())
+                    i += 1
+                    continue
+                if self.escape:
+                    self.escape = False
+                    if c == ord("u"):
+                        self.unicode_escape = bytearray()
+                    elif c in DATA_ESCAPES:
+                        self.sink.write(DATA_ESCAPES[c])
+                    else:
+                        raise ValueError(f"Invalid escape {chr(c)!r} in Binary data")
+                    i += 1
+                    continue
+                quote = chunk.find(b'"', i)
+                end = n if quote == -1 else quote
+                backslash = chunk.find(b"\\", i, end)
+                if backslash != -1:
+                    self.sink.write(chunk[i:backslash])
+                    self.escape = True
+                    i = backslash + 1
+                    continue
+                self.sink.write(chunk[i:end])
+                if quote == -1:
+                    return
+                self.state = "after_value"
+                i = quote + 1
+                continue
+
+            if state == "value":
+                if self.in_string:
+                    self.buffer.append(c)
+                    if self.escape:
+                        self.escape = False
+                    elif c == BACKSLASH:
+                        self.escape = True
+                    elif c == QUOTE:
+                        self.in_string = False
+                        if self.depth == 0:
+                            self._finish_value("after_value")
+                elif c == QUOTE:
+                    self.in_string = True
+                    self.buffer.append(c)
+                elif c in b"{[":
+                    self.depth += 1
+                    self.buffer.append(c)
+                elif c in b"}]":
+                    if self.depth == 0:
+                        self._finish_value("done")
+                    else:
+                        self.depth -= 1
+                        self.buffer.append(c)
+                        if self.depth == 0:
+                            self._finish_value("after_value")
+                elif c == ord(",") and self.depth == 0:
+                    self._finish_value("key_start")
+                else:
+                    self.buffer.append(c)
+                i += 1
+                continue
+
+            if state == "key":
+                self.buffer.append(c)
+                if self.escape:
+                    self.escape = False
+                elif c == BACKSLASH:
+                    self.escape = True
+                elif c == QUOTE:
+                    self.key = json.loads(b'"' + bytes(self.buffer))
+                    self.buffer.clear()
+                    self.state = "colon"
+                i += 1
+                continue
+
+            if c in WHITESPACE:
+                i += 1
+                continue
+
+            if state == "start" and c == ord("{"):
+                self.state = "key_start"
+            elif state == "key_start" and c == QUOTE:
+                self.state = "key"
+            elif state == "key_start" and c == ord("}"):
+                self.state = "done"
+            elif state == "colon" and c == ord(":"):
+                self.state = "value_start"
+            elif state == "value_start":
+                if self.key == "data" and c == QUOTE:
+                    self.state = "data"
+                else:
+                    self.state = "value"
+                    continue
+            elif state == "after_value" and c == ord(","):
+                self.state = "key_start"
+            elif state == "after_value" and c == ord("}"):
+                self.state = "done"
+            else:
+                raise ValueError(f"Unexpected character {chr(c)!r} in Binary resource")
+            i += 1
+
+    def close(self):
+        if self.state != "done":
+            raise ValueError("Binary resource ended unexpectedly")
+        self.sink.close()
+
+def is_json_media_type(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type.endswith("/json") or media_type.endswith("+json")
+
+def fetch_binary(
+    session,
+    url: str,
+    headers: Dict[str, str],
+    chunk_size: int = BINARY_STREAM_CHUNK_SIZE,
+    spool_max_memory: int = BINARY_SPOOL_MAX_MEMORY,
+    operation: str = "binary",
+    circuit: Optional[str] = None
+) -> Dict[str, Any]:
+    start_time = time.perf_counter()
+    response = send_with_retry(
+        lambda timeout: session.get(url, headers=headers, timeout=timeout, stream=True),
+        operation,
+        circuit_for(circuit, url)
+    )
+    with response:
+        result = {
+            "status_code": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers)
+        }
+        if response.status_code == 304:
+            record_response(operation, response, time.perf_counter() - start_time)
+            return {**result, "success": True, "not_modified": True}
+        if response.status_code != 200:
+            error = f"HTTP {response.status_code}: {response.text}"
+            record_response(operation, response, time.perf_counter() - start_time)
+            return {**result, "success": False, "error": error}
+
+        target = tempfile.SpooledTemporaryFile(max_size=spool_max_memory)
+        body_start = time.perf_counter()
+        try:
+            response_type = response.headers.get("Content-Type", "")
+            if is_json_media_type(response_type):
+                parser = BinaryResourceParser(target)
+                for chunk in response.iter_content(chunk_size):
+                    parser.feed(chunk)
+                parser.close()
+                if parser.fields.get("resourceType") != "Binary":
+                    raise ValueError(f"Expected a Binary resource, got {parser.fields.get('resourceType', 'unknown')}")
+                result.update({
+                    "content_type": parser.fields.get("contentType", "application/octet-stream"),
+                    "id": parser.fields.get("id", ""),
+                    "raw": False
+                })
+            else:
+                for chunk in response.iter_content(chunk_size):
+                    target.write(chunk)
+                result.update({
+                    "content_type": response_type.split(";")[0].strip() or "application/octet-stream",
+                    "id": url.rstrip("/").rsplit("/", 1)[-1],
+                    "raw": True
+                })
+        except Exception:
+            target.close()
+            raise
+
+        # Streaming and base64 decoding are interleaved, so "body" covers both
+        observe_phase("body", time.perf_counter() - body_start, operation)
+        record_response(operation, response, time.perf_counter() - start_time, streamed=True)
+        result["size"] = target.tell()
+        target.seek(0)
+        return {**result, "success": True, "file": target}
@@ -0,0 +1,130 @@
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Union
+from urllib.parse import urlparse
+
+from config import BULK_DOWNLOAD_WORKERS, BULK_DOWNLOAD_PER_HOST
+from commonwell.binary import Base64Sink
+from commonwell.stats import percentile
+
+DECODE_CHUNK_SIZE = 4 * 1024 * 1024
+
+def file_extension(content_type: str) -> str:
+    if "xml" in content_type:
+        return ".xml"
+    if "pdf" in content_type:
+        return ".pdf"
+    if content_type.startswith("text/"):
+        return ".txt"
+    return ".bin"
+
+def write_base64(target: BinaryIO, data: str) -> int:
+    # The sink drops line breaks and carries partial quanta over, so chunk edges need not fall on 4-character boundaries
+    sink = Base64Sink(target)
+    for offset in range(0, len(data), DECODE_CHUNK_SIZE):
+        sink.write(data[offset:offset + DECODE_CHUNK_SIZE].encode("ascii"))
+    sink.close()
+    return sink.size
+
+class HostLimiter:
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).hostname or ""
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self._semaphores[host]
+
+def download_all(
+    jobs: List[Dict[str, Any]],
+    fetch: Callable[[Dict[str, Any]], Dict[str, Any]],
+    target: Union[str, BinaryIO],
+    max_workers: int = BULK_DOWNLOAD_WORKERS,
+    per_host: int = BULK_DOWNLOAD_PER_HOST,
+    on_progress: Optional[Callable[[int, int, Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    limiter = HostLimiter(per_host)
+
+    def run(job: Dict[str, Any]) -> Dict[str, Any]:
+        with limiter.for_url(job["url"]):
+            start = time.perf_counter()
+            result = fetch(job)
+            result["latency_ms"] = (time.perf_counter() - start) * 1000
+        return result
+
+    files = []
+    used_names = set()
+    started = time.perf_counter()
+    total_bytes = 0
+
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        queue = list(reversed(jobs))
+        in_flight = {}
+
+        while queue or in_flight:
+            while queue and len(in_flight) < max_workers * 2:
+                job = queue.pop()
+                in_flight[executor.submit(run, job)] = job
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                entry = {"name": job["name"], "url": job["url"]}
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+
+                entry["latency_ms"] = result.get("latency_ms")
+                if result.get("success"):
+                    name = job["name"] + file_extension(result.get("content_type", ""))
+                    suffix = 1
+                    while name in used_names:
+                        name = f"{job['name']}_{suffix}{file_extension(result.get('content_type', ''))}"
+                        suffix += 1
+                    used_names.add(name)
+
+                    with archive.open(name, "w") as member:
+                        if "file" in result:
+                            with result["file"] as document_file:
+                                document_file.seek(0)
+                                shutil.copyfileobj(document_file, member)
+                                size = document_file.tell()
+                        else:
+                            size = write_base64(member, result.get("data", ""))
+                    total_bytes += size
+                    entry.update({"success": True, "name": name, "bytes": size})
+                else:
+                    entry.update({"success": False, "error": result.get("error", "Download failed")})
+
+                # Drop the payload before the next completion so only in-flight results stay in memory
+                result = None
+                files.append(entry)
+                if on_progress:
+                    on_progress(len(files), len(jobs), entry)
+
+    elapsed = time.perf_counter() - started
+    latencies = [f["latency_ms"] for f in files if f.get("latency_ms") is not None]
+    succeeded = sum(1 for f in files if f["success"])
+
+    return {
+        "success": succeeded == len(jobs),
+        "files": files,
+        "file_count": succeeded,
+        "failed": len(files) - succeeded,
+        "bytes": total_bytes,
+        "elapsed_ms": elapsed * 1000,
+        "files_per_second": succeeded / elapsed if elapsed else None,
+        "mb_per_second": total_bytes / (1024 * 1024) / elapsed if elapsed else None,
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p95_ms": percentile(latencies, 95),
+        "latency_max_ms": max(latencies) if latencies else None
+    }
@@ -0,0 +1,232 @@
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+
+from config import XML_SECTION_TEXT_CHARS
+
+CCDA_SECTIONS = {
+    "11450-4": "Problems",
+    "10160-0": "Medications",
+    "48765-2": "Allergies",
+    "46240-8": "Encounters",
+    "47519-4": "Procedures",
+    "30954-2": "Results",
+    "8716-3": "Vital Signs",
+    "11369-6": "Immunizations",
+    "29762-2": "Social History",
+    "10157-6": "Family History",
+    "42348-3": "Advance Directives",
+    "18776-5": "Plan of Care",
+    "51847-2": "Assessment and Plan",
+    "29545-1": "Physical Exam",
+    "10164-2": "History of Present Illness",
+    "46264-8": "Medical Equipment",
+    "48768-6": "Payers",
+    "47420-5": "Functional Status",
+    "11535-2": "Hospital Discharge Diagnosis",
+    "10183-2": "Discharge Medications",
+    "8648-8": "Hospital Course",
+    "29299-5": "Reason for Visit",
+    "10154-3": "Chief Complaint",
+    "61146-7": "Goals",
+    "75310-3": "Health Concerns"
+}
+
+Source = Union[bytes, BinaryIO]
+
+class _OutputLimit(Exception):
+    pass
+
+def _local(name: str) -> str:
+    return name.rsplit(":", 1)[-1]
+
+def _new_parser() -> "expat.XMLParserType":
+    # No namespace processing, so prefixes are printed as written; external entities are never loaded
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+    return parser
+
+def _parse(parser, source: Source):
+    if isinstance(source, (bytes, bytearray)):
+        parser.Parse(source, True)
+    else:
+        source.seek(0)
+        parser.ParseFile(source)
+
+class _PrettyPrinter:
+    """Writes indented XML from expat callbacks without building a tree.
+
+    Whitespace-only text is dropped and an element holding only text stays
+    on one line; output stops with ``_OutputLimit`` after ``max_chars``.
+    """
+
+    def __init__(self, max_chars: Optional[int], indent: str = "  "):
+        self.max_chars = max_chars
+        self.indent = indent
+        self.parts: List[str] = []
+        self.size = 0
+        self.depth = 0
+        self.open_tag: Optional[str] = None
+        self.text: List[str] = []
+
+    def write(self, line: str):
+        self.parts.append(line)
+        self.size += len(line) + 1
+        if self.max_chars is not None and self.size > self.max_chars:
+            raise _OutputLimit()
+
+    def close_open_tag(self):
+        if self.open_tag is not None:
+            self.write(self.open_tag + ">")
+            self.open_tag = None
+
+    def flush_text(self):
+        text = "".join(self.text).strip()
+        self.text = []
+        if text:
+            self.close_open_tag()
+            self.write(self.indent * self.depth + escape(text))
+
+    def xml_decl(self, version, encoding, standalone):
+        declaration = f'<?xml version="{version or "1.0"}"'
+        if encoding:
+            declaration += f' encoding="{encoding}"'
+        if standalone != -1:
+            declaration += f' standalone="{"yes" if standalone else "no"}"'
+        self.write(declaration + "?>")
+
+    def start(self, name: str, attributes: List[str]):
+        self.flush_text()
+        self.close_open_tag()
+        attrs = "".join(f" {attributes[i]}={quoteattr(attributes[i + 1])}" for i in range(0, len(attributes), 2))
+        self.open_tag = f"{self.indent * self.depth}<{name}{attrs}"
+        self.depth += 1
+
+    def end(self, name: str):
+        self.depth -= 1
+        text = "".join(self.text).strip()
+        self.text = []
+        if self.open_tag is not None:
+            self.write(f"{self.open_tag}>{escape(text)}</{name}>" if text else self.open_tag + "/>")
+            self.open_tag = None
+            return
+        if text:
+            self.write(self.indent * (self.depth + 1) + escape(text))
+        self.write(f"{self.indent * self.depth}</{name}>")
+
+    def character_data(self, data: str):
+        self.text.append(data)
+
+    def comment(self, data: str):
+        self.flush_text()
+        self.close_open_tag()
+        self.write(f"{self.indent * self.depth}<!--{data}-->")
+
+    def processing_instruction(self, target: str, data: str):
+        self.flush_text()
+        self.close_open_tag()
+        self.write(f"{self.indent * self.depth}<?{target} {data}?>")
+
+def pretty_print_xml(source: Source, max_chars: Optional[int] = None) -> Tuple[str, bool]:
+    """Indent an XML document in one streaming pass.
+
+    Returns the formatted text and whether it was cut at ``max_chars``. A
+    document that is not well-formed is returned unchanged.
+    """
+    printer = _PrettyPrinter(max_chars)
+    parser = _new_parser()
+    parser.XmlDeclHandler = printer.xml_decl
+    parser.StartElementHandler = printer.start
+    parser.EndElementHandler = printer.end
+    parser.CharacterDataHandler = printer.character_data
+    parser.CommentHandler = printer.comment
+    parser.ProcessingInstructionHandler = printer.processing_instruction
+
+    truncated = False
+    try:
+        _parse(parser, source)
+    except _OutputLimit:
+        truncated = True
+    except expat.ExpatError:
+        raw = source if isinstance(source, (bytes, bytearray)) else _read(source, max_chars)
+        text = bytes(raw).decode("utf-8", errors="replace")
+        if max_chars is not None and len(text) > max_chars:
+            return text[:max_chars], True
+        return text, False
+    return "\n".join(printer.parts), truncated
+
+def _read(source: BinaryIO, max_chars: Optional[int]) -> bytes:
+    source.seek(0)
+    return source.read(-1 if max_chars is None else max_chars + 1)
+
+def extract_outline(source: Source, text_chars: int = XML_SECTION_TEXT_CHARS) -> Dict[str, Any]:
+    """Find the sections of a C-CDA document in one streaming pass.
+
+    Each section has its LOINC code, a display name, its title, the number
+    of entries and the start of its narrative text (up to ``text_chars``).
+    Nested sections are listed after their parent with a larger ``level``.
+    """
+    outline: Dict[str, Any] = {"title": None, "sections": [], "error": None}
+    path: List[str] = []
+    sections: List[Dict[str, Any]] = []
+    capture: List[Any] = []
+
+    def start(name: str, attributes: List[str]):
+        local = _local(name)
+        parent = path[-1] if path else None
+        path.append(local)
+        if local == "section":
+            section = {"level": len(sections), "code": None, "name": None, "title": "", "entries": 0, "text": ""}
+            sections.append(section)
+            outline["sections"].append(section)
+        elif sections and parent == "section":
+            section = sections[-1]
+            if local == "code":
+                attrs = dict(zip(attributes[::2], attributes[1::2]))
+                section["code"] = attrs.get("code")
+                section["name"] = CCDA_SECTIONS.get(attrs.get("code")) or attrs.get("displayName")
+            elif local == "title":
+                capture.append(["title", len(path), section, [], 0])
+            elif local == "entry":
+                section["entries"] += 1
+            elif local == "text":
+                capture.append(["text", len(path), section, [], 0])
+        elif local == "title" and parent == "ClinicalDocument":
+            capture.append(["document_title", len(path), None, [], 0])
+
+        if capture and local in ("paragraph", "item", "tr", "td", "th", "br", "caption"):
+            capture[-1][3].append(" ")
+
+    def end(name: str):
+        if capture and capture[-1][1] == len(path):
+            field, _, section, parts, _ = capture.pop()
+            text = " ".join("".join(parts).split())
+            if field == "document_title":
+                outline["title"] = text
+            elif field == "title":
+                section["title"] = text
+            else:
+                section["text"] = text[:text_chars]
+        if path.pop() == "section":
+            sections.pop()
+
+    def character_data(data: str):
+        # Sections can hold a lot of narrative; stop collecting once the preview is full
+        if capture and capture[-1][4] <= text_chars * 2:
+            capture[-1][3].append(data)
+            capture[-1][4] += len(data)
+
+    parser = _new_parser()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = character_data
+    try:
+        _parse(parser, source)
+    except expat.ExpatError as e:
+        outline["error"] = f"Not well-formed XML: {e}"
+
+    for section in outline["sections"]:
+        section["name"] = section["name"] or section["title"] or section["code"] or "Untitled section"
+    return outline
@@ -0,0 +1,324 @@
+import hashlib
+import hmac
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+from config import (
+    DOCUMENT_CACHE_DIR, DOCUMENT_CACHE_MAX_BYTES, DOCUMENT_CACHE_TTL,
+    BINARY_SPOOL_MAX_MEMORY
+)
+
+try:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    CRYPTO_AVAILABLE = True
+except ImportError:
+    CRYPTO_AVAILABLE = False
+
+MAGIC = b"CWDC1"
+CHUNK_SIZE = 1024 * 1024
+INDEX_FILE = "index.json"
+# Access times only steer eviction, so reads persist them at most this often
+INDEX_SAVE_INTERVAL = 30
+
+def derive_cache_key(key_paths) -> Optional[bytes]:
+    if not CRYPTO_AVAILABLE:
+        return None
+    for path in key_paths:
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                material = f.read()
+            return HKDF(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=b"commonwell-document-cache"
+            ).derive(material)
+    return None
+
+def header_value(headers: Optional[Dict[str, str]], name: str) -> Optional[str]:
+    for key, value in (headers or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+class DocumentCache:
+    """Encrypted, content-addressed Binary cache with LRU eviction by size.
+
+    Blobs are named after a keyed hash of their plaintext so identical
+    documents reached through different URLs are stored once. Each blob is
+    AES-GCM encrypted in 1 MiB frames; a frame's nonce and associated data
+    bind its position and whether it is the last one.
+    """
+
+    def __init__(
+        self,
+        key: bytes,
+        directory: str = DOCUMENT_CACHE_DIR,
+        max_bytes: int = DOCUMENT_CACHE_MAX_BYTES,
+        ttl: float = DOCUMENT_CACHE_TTL
+    ):
+        self.aead = AESGCM(key)
+        self._name_key = hashlib.sha256(b"commonwell-document-cache-names" + key).digest()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "blobs"), mode=0o700, exist_ok=True)
+        self._index = self._load_index()
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def _load_index(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {"entries": {}, "blobs": {}}
+        index.setdefault("entries", {})
+        index.setdefault("blobs", {})
+        return index
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".index-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, path)
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+
+    def _touch_index(self):
+        self._index_dirty = True
+        if time.monotonic() - self._index_saved_at >= INDEX_SAVE_INTERVAL:
+            self._save_index()
+
+    def _cache_key(self, environment: str, url: str) -> str:
+        return hmac.new(self._name_key, f"{environment}\n{url}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "blobs", digest)
+
+    def _nonce(self, prefix: bytes, counter: int) -> bytes:
+        return prefix + struct.pack(">I", counter)
+
+    def _encrypt(self, source: BinaryIO, target: BinaryIO):
+        prefix = os.urandom(8)
+        target.write(MAGIC + prefix)
+        counter = 0
+        chunk = source.read(CHUNK_SIZE)
+        while True:
+            next_chunk = source.read(CHUNK_SIZE)
+            final = not next_chunk
+            aad = struct.pack(">I?", counter, final)
+            target.write(self.aead.encrypt(self._nonce(prefix, counter), chunk, aad))
+            if final:
+                return
+            chunk = next_chunk
+            counter += 1
+
+    def _decrypt(self, source: BinaryIO, target: BinaryIO):
+        header = source.read(len(MAGIC) + 8)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a document cache blob")
+        prefix = header[len(MAGIC):]
+        frame_size = CHUNK_SIZE + 16
+        counter = 0
+        frame = source.read(frame_size)
+        while True:
+            next_frame = source.read(frame_size)
+            final = not next_frame
+            aad = struct.pack(">I?", counter, final)
+            target.write(self.aead.decrypt(self._nonce(prefix, counter), frame, aad))
+            if final:
+                return
+            frame = next_frame
+            counter += 1
+
+    def lookup(self, environment: str, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._index["entries"].get(self._cache_key(environment, url))
+            if entry and os.path.exists(self._blob_path(entry["digest"])):
+                return dict(entry)
+            return None
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["validated_at"] < self.ttl
+
+    def conditional_headers(self, entry: Dict[str, Any]) -> Dict[str, str]:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def can_revalidate(self, entry: Dict[str, Any]) -> bool:
+        return bool(entry.get("etag") or entry.get("last_modified"))
+
+    def open(self, entry: Dict[str, Any]) -> Optional[BinaryIO]:
+        """Decrypt the entry's blob into a temporary file, or return None if it has been evicted."""
+        with self._lock:
+            blob = self._index["blobs"].get(entry["digest"])
+            try:
+                # Opened under the lock, so a concurrent eviction can only unlink it once we hold the handle
+                source = open(self._blob_path(entry["digest"]), "rb")
+            except FileNotFoundError:
+                return None
+            if blob:
+                blob["last_access"] = time.time()
+                self._touch_index()
+
+        target = tempfile.SpooledTemporaryFile(max_size=BINARY_SPOOL_MAX_MEMORY)
+        with source:
+            self._decrypt(source, target)
+        target.seek(0)
+        return target
+
+    def mark_validated(self, entry: Dict[str, Any]):
+        with self._lock:
+            stored = self._index["entries"].get(entry["key"])
+            if stored:
+                stored["validated_at"] = time.time()
+                self._touch_index()
+        self.revalidated += 1
+
+    def store(
+        self,
+        environment: str,
+        url: str,
+        document_file: BinaryIO,
+        metadata: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        digest_hash = hmac.new(self._name_key, digestmod=hashlib.sha256)
+        document_file.seek(0)
+        for chunk in iter(lambda: document_file.read(CHUNK_SIZE), b""):
+            digest_hash.update(chunk)
+        size = document_file.tell()
+        digest = digest_hash.hexdigest()
+
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            document_file.seek(0)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob_path), prefix=".blob-")
+            with os.fdopen(fd, "wb") as target:
+                self._encrypt(document_file, target)
+            os.replace(tmp_path, blob_path)
+        document_file.seek(0)
+
+        now = time.time()
+        entry = {
+            "key": self._cache_key(environment, url),
+            "digest": digest,
+            "size": size,
+            "content_type": metadata.get("content_type"),
+            "id": metadata.get("id"),
+            "etag": metadata.get("etag"),
+            "last_modified": metadata.get("last_modified"),
+            "validated_at": now
+        }
+        with self._lock:
+            self._index["entries"][entry["key"]] = entry
+            blob = self._index["blobs"].setdefault(digest, {"size": os.path.getsize(blob_path)})
+            blob["last_access"] = now
+            self._evict()
+            self._save_index()
+        return dict(entry)
+
+    def _evict(self):
+        blobs = self._index["blobs"]
+        total = sum(blob["size"] for blob in blobs.values())
+        for digest, blob in sorted(blobs.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= blob["size"]
+            self._remove_blob(digest)
+
+    def _remove_blob(self, digest: str):
+        self._index["blobs"].pop(digest, None)
+        for key in [k for k, e in self._index["entries"].items() if e["digest"] == digest]:
+            del self._index["entries"][key]
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+
+    def cached_result(self, entry: Dict[str, Any], document_file: BinaryIO) -> Dict[str, Any]:
+        return {
+            "success": True,
+            "file": document_file,
+            "content_type": entry.get("content_type") or "application/octet-stream",
+            "id": entry.get("id", ""),
+            "size": entry["size"],
+            "raw": False,
+            "cached": True
+        }
+
+    def fetch(
+        self,
+        environment: str,
+        url: str,
+        headers: Dict[str, str],
+        fetch: Callable[[Dict[str, str]], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        entry = self.lookup(environment, url)
+        if entry and self.is_fresh(entry):
+            document_file = self.open(entry)
+            if document_file is not None:
+                self.hits += 1
+                return self.cached_result(entry, document_file)
+            entry = None
+
+        request_headers = dict(headers)
+        if entry and self.can_revalidate(entry):
+            request_headers.update(self.conditional_headers(entry))
+
+        result = fetch(request_headers)
+        if result.get("not_modified") and entry:
+            document_file = self.open(entry)
+            if document_file is not None:
+                self.mark_validated(entry)
+                self.hits += 1
+                return {**result, **self.cached_result(entry, document_file)}
+            # Evicted while revalidating, so fetch the body unconditionally
+            result = fetch(dict(headers))
+
+        self.misses += 1
+        if result.get("success") and "file" in result:
+            try:
+                self.store(environment, url, result["file"], {
+                    "content_type": result.get("content_type"),
+                    "id": result.get("id"),
+                    "etag": header_value(result.get("headers"), "ETag"),
+                    "last_modified": header_value(result.get("headers"), "Last-Modified")
+                })
+            except OSError:
+                result["file"].seek(0)
+        return result
+
+    def clear(self):
+        with self._lock:
+            for digest in list(self._index["blobs"]):
+                self._remove_blob(digest)
+            self._save_index()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._index["entries"]),
+                "blobs": len(self._index["blobs"]),
+                "bytes": sum(blob["size"] for blob in self._index["blobs"].values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated
+            }
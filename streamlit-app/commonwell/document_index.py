@@ -0,0 +1,162 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+class DocumentIndex:
+    """Column-oriented view of the DocumentReferences in a search Bundle.
+
+    Built once per result; filter, sort and search work on the columns and
+    return row numbers, so nothing is re-parsed on a Streamlit rerun.
+    """
+
+    __slots__ = (
+        "ids", "statuses", "descriptions", "dates", "authors", "type_codes", "type_labels",
+        "content_types", "sizes", "contents", "_search_text", "_sort_orders", "_documents"
+    )
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.statuses: List[str] = []
+        self.descriptions: List[str] = []
+        self.dates: List[Optional[str]] = []
+        self.authors: List[Optional[str]] = []
+        self.type_codes: List[Optional[str]] = []
+        self.type_labels: List[Optional[str]] = []
+        self.content_types: List[Tuple[str, ...]] = []
+        self.sizes: List[Optional[int]] = []
+        self.contents: List[Tuple[Dict[str, Any], ...]] = []
+        self._search_text: List[str] = []
+        self._sort_orders: Dict[str, List[int]] = {}
+        self._documents: Dict[int, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_bundle(cls, bundle: Dict[str, Any]) -> "DocumentIndex":
+        index = cls()
+        for entry in bundle.get("entry", []):
+            resource = entry.get("resource", {})
+            if resource.get("resourceType") == "DocumentReference":
+                index._append(resource)
+        return index
+
+    def _append(self, resource: Dict[str, Any]):
+        authors = resource.get("author", [])
+        author = (authors[0].get("display") or authors[0].get("reference")) if authors else None
+
+        doc_type = resource.get("type") or {}
+        coding = next(iter(doc_type.get("coding") or []), {})
+        type_code = coding.get("code")
+        type_label = coding.get("display") or doc_type.get("text") or type_code
+
+        contents = tuple(
+            {
+                "contentType": attachment.get("contentType", "unknown"),
+                "url": attachment.get("url"),
+                "size": attachment.get("size"),
+                "title": attachment.get("title")
+            }
+            for attachment in (content.get("attachment", {}) for content in resource.get("content", []))
+        )
+        sizes = [content["size"] for content in contents if isinstance(content["size"], int)]
+
+        doc_id = resource.get("id", "Unknown")
+        description = resource.get("description", "No description")
+        self.ids.append(doc_id)
+        self.statuses.append(resource.get("status", "unknown"))
+        self.descriptions.append(description)
+        self.dates.append(resource.get("date"))
+        self.authors.append(author)
+        self.type_codes.append(type_code)
+        self.type_labels.append(type_label)
+        self.content_types.append(tuple(content["contentType"] for content in contents))
+        self.sizes.append(sum(sizes) if sizes else None)
+        self.contents.append(contents)
+        self._search_text.append(" ".join(" | ".join(
+            str(value) for value in (doc_id, description, author, type_code, type_label) if value
+        ).lower().split()))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def document(self, row: int) -> Dict[str, Any]:
+        document = self._documents.get(row)
+        if document is None:
+            document = self._documents[row] = {
+                "id": self.ids[row],
+                "status": self.statuses[row],
+                "description": self.descriptions[row],
+                "date": self.dates[row],
+                "author": self.authors[row],
+                "content": list(self.contents[row])
+            }
+        return document
+
+    def attachments(self) -> List[Dict[str, Any]]:
+        return [
+            {"name": self.ids[row] if idx == 0 else f"{self.ids[row]}_{idx}", "url": content["url"], "content_type": content["contentType"]}
+            for row in range(len(self))
+            for idx, content in enumerate(self.contents[row])
+            if content.get("url")
+        ]
+
+    def distinct(self, column: str) -> List[str]:
+        if column == "content_type":
+            values: Iterable = (value for types in self.content_types for value in types)
+        else:
+            values = self._column(column)
+        return sorted({value for value in values if value})
+
+    def _column(self, column: str) -> List[Any]:
+        return {
+            "id": self.ids,
+            "status": self.statuses,
+            "date": self.dates,
+            "author": self.authors,
+            "type": self.type_labels,
+            "content_type": [types[0] if types else None for types in self.content_types],
+            "size": self.sizes
+        }[column]
+
+    def _sort_order(self, column: str) -> List[int]:
+        order = self._sort_orders.get(column)
+        if order is None:
+            values = self._column(column)
+            # Missing values sort last in ascending order
+            order = sorted(range(len(values)), key=lambda row: (values[row] is None, values[row] if values[row] is not None else 0))
+            self._sort_orders[column] = order
+        return order
+
+    def rows(
+        self,
+        statuses: Optional[Iterable[str]] = None,
+        types: Optional[Iterable[str]] = None,
+        content_types: Optional[Iterable[str]] = None,
+        authors: Optional[Iterable[str]] = None,
+        text: str = "",
+        sort_by: Optional[str] = None,
+        descending: bool = False
+    ) -> List[int]:
+        statuses = set(statuses or ())
+        types = set(types or ())
+        content_types = set(content_types or ())
+        authors = set(authors or ())
+        needle = " ".join(text.lower().split())
+
+        keep = [
+            row for row in range(len(self))
+            if (not statuses or self.statuses[row] in statuses)
+            and (not types or self.type_labels[row] in types)
+            and (not content_types or not content_types.isdisjoint(self.content_types[row]))
+            and (not authors or self.authors[row] in authors)
+            and (not needle or needle in self._search_text[row])
+        ]
+        if not sort_by:
+            return keep
+
+        order = self._sort_order(sort_by)
+        if len(keep) < len(self):
+            selected = set(keep)
+            order = [row for row in order if row in selected]
+        if descending:
+            # Reverse the non-missing part only so missing values stay last
+            values = self._column(sort_by)
+            present = [row for row in order if values[row] is not None]
+            order = present[::-1] + [row for row in order if values[row] is None]
+        return list(order)
@@ -0,0 +1,358 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import ENROLLMENT_REGISTRY_PATH, ENROLLMENT_WORKERS, PATIENT_API_BASE_URLS, RATE_LIMIT_SHARED_DIR
+from commonwell.auth import decode_clear_id_token, generate_commonwell_jwt
+from commonwell.batch import ROW_ERROR, JsonlWriter, is_jsonl, read_identifiers, row_identifier
+from commonwell.governor import get_governor
+from commonwell.patient import build_patient_object, create_patient
+from commonwell.resilience import NOT_PROCESSED_STATUS_CODES
+from commonwell.stats import latency_summary
+from commonwell.token_cache import TokenCache
+from commonwell.transport import SessionPool
+
+PENDING = "pending"
+CREATED = "created"
+FAILED = "failed"
+UNKNOWN = "unknown"
+
+REQUIRED_CLEAR_CLAIMS = ["given_name", "family_name", "birthdate"]
+REPORT_FIELDS = ["row", "environment", "aaid", "patient_id", "outcome", "status_code", "error", "latency_ms", "completed_at"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrollments (
+    environment TEXT NOT NULL,
+    aaid TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    clear_sub TEXT,
+    status_code INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (environment, aaid, patient_id)
+);
+CREATE INDEX IF NOT EXISTS ix_enrollments_status ON enrollments (status, updated_at);
+"""
+
+COLUMNS = ["environment", "aaid", "patient_id", "status", "clear_sub", "status_code", "attempts", "error", "created_at", "updated_at"]
+
+CreatePatient = Callable[[str, str, Dict[str, Any], bool], Dict[str, Any]]
+
+class EnrollmentRegistry:
+    """Patients this host has sent to CommonWell, keyed by (environment, AAID, patient ID).
+
+    A row is claimed as ``pending`` before its POST, in a transaction, so
+    duplicate rows, concurrent workers and other processes sharing the file
+    never send the same patient twice. A definite rejection is recorded as
+    ``failed`` and may be claimed again; a POST whose outcome is unknown
+    (timeout, reset connection, 5xx from a gateway) is recorded as
+    ``unknown`` and, like a ``pending`` left by a crashed run, is only sent
+    again when the caller passes ``retry_unknown``.
+    """
+
+    def __init__(self, path: str = ENROLLMENT_REGISTRY_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if not os.path.exists(path):
+                # Holds patient identifiers, so readable by the owner only
+                os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def claim(self, environment: str, aaid: str, patient_id: str, clear_sub: Optional[str] = None, retry_unknown: bool = False) -> Optional[Dict[str, Any]]:
+        """Mark the patient ``pending`` and return None, or return the existing entry that rules out sending it."""
+        key = (environment, aaid, patient_id)
+        reclaimable = (FAILED, UNKNOWN, PENDING) if retry_unknown else (FAILED,)
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes cannot both see the row as free
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM enrollments WHERE environment = ? AND aaid = ? AND patient_id = ?", key
+                ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT INTO enrollments (environment, aaid, patient_id, status, clear_sub, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (*key, PENDING, clear_sub, now, now)
+                    )
+                elif row[3] in reclaimable:
+                    self._conn.execute(
+                        "UPDATE enrollments SET status = ?, clear_sub = ?, status_code = NULL, error = NULL, attempts = attempts + 1, updated_at = ? "
+                        "WHERE environment = ? AND aaid = ? AND patient_id = ?",
+                        (PENDING, clear_sub, now, *key)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None or row[3] in reclaimable:
+            return None
+        return dict(zip(COLUMNS, row))
+
+    def resolve(self, environment: str, aaid: str, patient_id: str, status: str, status_code: Optional[int] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE enrollments SET status = ?, status_code = ?, error = ?, updated_at = ? WHERE environment = ? AND aaid = ? AND patient_id = ?",
+                (status, status_code, error, time.time(), environment, aaid, patient_id)
+            )
+
+    def get(self, environment: str, aaid: str, patient_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM enrollments WHERE environment = ? AND aaid = ? AND patient_id = ?",
+                (environment, aaid, patient_id)
+            ).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM enrollments GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def outcome_status(result: Dict[str, Any]) -> str:
+    """Registry status for a create_patient result."""
+    if result.get("success"):
+        return CREATED
+    status_code = result.get("status_code")
+    if status_code is None:
+        return FAILED if result.get("not_sent") else UNKNOWN
+    # A POST that hit a gateway error or server fault may still have been processed
+    if status_code >= 500 and status_code not in NOT_PROCESSED_STATUS_CODES:
+        return UNKNOWN
+    return FAILED
+
+def _skip(entry: Dict[str, Any]) -> Tuple[str, str]:
+    when = datetime.fromtimestamp(entry["updated_at"]).strftime("%Y-%m-%d %H:%M:%S")
+    if entry["status"] == CREATED:
+        return "duplicate", f"Already created {when}"
+    if entry["status"] == PENDING:
+        return "blocked", f"A create started {when} is in flight or was interrupted; confirm the patient is absent, then retry unknown outcomes"
+    return "blocked", f"The create at {when} has an unknown outcome ({entry['error']}); confirm the patient is absent, then retry unknown outcomes"
+
+def new_record(index: int, row: Dict[str, Any], environment: str) -> Dict[str, Any]:
+    return {
+        "row": index,
+        "environment": row_identifier(row, "environment") or environment,
+        "aaid": row_identifier(row, "aaid"),
+        "patient_id": row_identifier(row, "patient_id"),
+        "outcome": None,
+        "status_code": None,
+        "error": None
+    }
+
+def finish_record(record: Dict[str, Any], start: float, outcome: str, error: Optional[str] = None) -> Dict[str, Any]:
+    record["outcome"] = outcome
+    record["error"] = error
+    record["latency_ms"] = (time.perf_counter() - start) * 1000
+    record["completed_at"] = datetime.now().isoformat()
+    return record
+
+def enroll_row(
+    index: int,
+    row: Dict[str, Any],
+    environment: str,
+    registry: EnrollmentRegistry,
+    tokens: TokenCache,
+    create: CreatePatient,
+    skip_verify: bool = False,
+    retry_unknown: bool = False,
+    environment_column: bool = True
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    clear_token = str(row.get("clear_token") or row.get("clear_id_token") or "").strip()
+    record = new_record(index, row, environment)
+    finish = lambda outcome, error=None: finish_record(record, start, outcome, error)
+
+    if row.get(ROW_ERROR):
+        return finish("invalid", row[ROW_ERROR])
+    if record["environment"] not in PATIENT_API_BASE_URLS:
+        return finish("invalid", f"Unknown environment {record['environment']!r}")
+    if not environment_column and record["environment"] != environment:
+        return finish("invalid", f"Row environment {record['environment']!r} differs from the selected environment {environment!r}")
+    claims = decode_clear_id_token(clear_token) if clear_token else None
+    if not record["aaid"] or not record["patient_id"]:
+        return finish("invalid", "aaid and patient_id are required")
+    if not claims:
+        return finish("invalid", "Missing or malformed CLEAR ID token")
+    missing_claims = [c for c in REQUIRED_CLEAR_CLAIMS if not claims.get(c)]
+    if missing_claims:
+        return finish("invalid", f"CLEAR token missing required claims: {', '.join(missing_claims)}")
+
+    key = (record["environment"], record["aaid"], record["patient_id"])
+    existing = registry.claim(*key, clear_sub=claims.get("sub"), retry_unknown=retry_unknown)
+    if existing:
+        return finish(*_skip(existing))
+
+    try:
+        token = tokens.get(hashlib.sha256(clear_token.encode()).hexdigest()[:16], clear_token)
+        if "error" in token:
+            registry.resolve(*key, FAILED, error=token["error"])
+            return finish("failed", f"JWT generation failed: {token['error']}")
+        patient_object = build_patient_object(claims, record["patient_id"], record["aaid"])
+        result = create(record["environment"], token["jwt"], patient_object, skip_verify)
+    except Exception as e:
+        # Raised before the POST went out, so the claim is released
+        registry.resolve(*key, FAILED, error=str(e))
+        return finish("failed", str(e))
+
+    status = outcome_status(result)
+    record["status_code"] = result.get("status_code")
+    registry.resolve(*key, status, record["status_code"], result.get("error"))
+    return finish(status, result.get("error"))
+
+def enroll(
+    rows: Iterable[Dict[str, Any]],
+    environment: str,
+    registry: EnrollmentRegistry,
+    tokens: TokenCache,
+    create: CreatePatient,
+    skip_verify: bool = False,
+    retry_unknown: bool = False,
+    workers: int = ENROLLMENT_WORKERS,
+    environment_column: bool = True
+) -> Iterator[Dict[str, Any]]:
+    """Enroll ``rows`` with up to ``workers`` creates in flight, yielding each row's record as it completes.
+
+    The ``patient_create`` budget in RATE_LIMITS still applies on top of ``workers``.
+    Rows repeating an earlier row's patient are reported as duplicates without
+    being sent. With ``environment_column`` off, rows naming an environment
+    other than ``environment`` are rejected rather than sent there.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enroll") as executor:
+        rows = iter(enumerate(rows, start=1))
+        in_flight = set()
+        first_rows: Dict[Tuple[str, str, str], int] = {}
+        exhausted = False
+
+        while not exhausted or in_flight:
+            while not exhausted and len(in_flight) < workers * 2:
+                item = next(rows, None)
+                if item is None:
+                    exhausted = True
+                    break
+                index, row = item
+                record = new_record(index, row, environment)
+                key = (record["environment"], record["aaid"], record["patient_id"])
+                if record["aaid"] and record["patient_id"] and record["environment"] in PATIENT_API_BASE_URLS and key in first_rows:
+                    yield finish_record(record, time.perf_counter(), "duplicate", f"Same patient as row {first_rows[key]}")
+                    continue
+                first_rows.setdefault(key, index)
+                in_flight.add(executor.submit(
+                    enroll_row, index, row, environment, registry, tokens, create, skip_verify, retry_unknown, environment_column
+                ))
+
+            if not in_flight:
+                continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+class CsvReportWriter:
+    def __init__(self, path: str):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, REPORT_FIELDS, extrasaction="ignore")
+        self._writer.writeheader()
+
+    def write(self, record: Dict[str, Any]):
+        self._writer.writerow(record)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def report_csv(records: List[Dict[str, Any]]) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, REPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(sorted(records, key=lambda record: record["row"]))
+    return buffer.getvalue()
+
+def summarize(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    outcomes: Dict[str, int] = {}
+    for record in records:
+        outcomes[record["outcome"]] = outcomes.get(record["outcome"], 0) + 1
+    # Skipped and invalid rows never reach CommonWell, so they would flatter the latency
+    sent = [record["latency_ms"] for record in records if record["status_code"] is not None or record["outcome"] == UNKNOWN]
+    return {"rows": len(records), "outcomes": outcomes, "latency": latency_summary(sent)}
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m commonwell.enrollment",
+        description="Create many patients in CommonWell from CLEAR ID tokens, skipping any already created."
+    )
+    parser.add_argument("input", help="CSV or JSONL file with clear_token, patient_id and aaid columns (optional: environment)")
+    parser.add_argument("--report", required=True, help="Per-row report (.csv or .jsonl)")
+    parser.add_argument("--environment", default="integration", choices=["integration", "production"], help="Environment for rows without an environment column")
+    parser.add_argument("--workers", type=int, default=ENROLLMENT_WORKERS, help="Concurrent creates")
+    parser.add_argument("--rate", type=float, default=None, help="Maximum patient creates per second per environment (default: RATE_LIMITS in config.py)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Maximum patient creates in flight per environment (default: RATE_LIMITS in config.py)")
+    parser.add_argument("--rate-limit-dir", default=RATE_LIMIT_SHARED_DIR, help="Directory for rate limit state shared with other processes on this host")
+    parser.add_argument("--registry", default=ENROLLMENT_REGISTRY_PATH, help="SQLite registry of patients already sent")
+    parser.add_argument("--retry-unknown", action="store_true", help="Send again patients whose earlier create had an unknown outcome or was interrupted")
+    parser.add_argument("--skip-tls-verify", action="store_true")
+    return parser.parse_args(argv)
+
+def print_summary(summary: Dict[str, Any], elapsed: float):
+    outcomes = ", ".join(f"{count} {outcome}" for outcome, count in sorted(summary["outcomes"].items()))
+    print(f"Processed {summary['rows']} rows ({outcomes or 'none'}) in {elapsed:.1f}s", file=sys.stderr)
+    latency = summary["latency"]
+    if latency["count"]:
+        print(
+            "Create latency ms: " + ", ".join(f"{name}={latency[name]:.0f}" for name in ["min", "p50", "p90", "p95", "p99", "max"]),
+            file=sys.stderr
+        )
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    registry = EnrollmentRegistry(args.registry)
+    tokens = TokenCache(generate_commonwell_jwt)
+    pool = SessionPool(pool_size=max(args.workers, 1))
+    governor = get_governor()
+    governor.share_through(args.rate_limit_dir)
+    if args.rate or args.max_in_flight:
+        governor.configure("patient_create", rate=args.rate, burst=max(1, int(args.rate)) if args.rate else None, concurrency=args.max_in_flight)
+
+    writer = JsonlWriter(args.report, False) if is_jsonl(args.report) else CsvReportWriter(args.report)
+    create = lambda environment, jwt, patient, skip_verify: create_patient(environment, jwt, patient, skip_verify, pool=pool)
+    records: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+
+    try:
+        for record in enroll(
+            read_identifiers(args.input), args.environment, registry, tokens, create,
+            args.skip_tls_verify, args.retry_unknown, max(args.workers, 1)
+        ):
+            writer.write(record)
+            records.append(record)
+    finally:
+        writer.close()
+        pool.close()
+        registry.close()
+        print_summary(summarize(records), time.perf_counter() - started)
+
+    return 0 if all(record["outcome"] in (CREATED, "duplicate") for record in records) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
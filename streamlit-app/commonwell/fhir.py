@@ -0,0 +1,444 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import quote, urlparse
+
+import requests
+
+from config import API_BASE_URLS, BINARY_RAW_CONTENT_TYPES
+from commonwell.binary import fetch_binary
+from commonwell.document_cache import DocumentCache
+from commonwell.jsonio import loads
+from commonwell.log import log_request, log_response, log_event
+from commonwell.metrics import record_failure, record_response, timed
+from commonwell.resilience import circuit_for, send_with_retry, timeout_message
+from commonwell.transport import SessionPool, get_default_pool
+
+DOCUMENT_STATUS_OPTIONS = [
+    {"value": "", "label": "All Statuses"},
+    {"value": "current", "label": "Current"},
+    {"value": "superseded", "label": "Superseded"},
+    {"value": "entered-in-error", "label": "Entered in Error"}
+]
+
+DOCUMENT_TYPE_OPTIONS = [
+    {"value": "", "label": "All Types"},
+    {"value": "34133-9", "label": "Summarization of Episode Note (34133-9)"},
+    {"value": "11488-4", "label": "Consultation Note (11488-4)"},
+    {"value": "18842-5", "label": "Discharge Summary (18842-5)"},
+    {"value": "11506-3", "label": "Progress Note (11506-3)"},
+    {"value": "28570-0", "label": "Procedure Note (28570-0)"},
+    {"value": "57133-1", "label": "Referral Note (57133-1)"}
+]
+
+CONTENT_TYPE_OPTIONS = [
+    {"value": "", "label": "All Content Types"},
+    {"value": "application/xml", "label": "XML (application/xml)"},
+    {"value": "text/xml", "label": "XML (text/xml)"},
+    {"value": "application/pdf", "label": "PDF (application/pdf)"},
+    {"value": "text/plain", "label": "Plain Text (text/plain)"},
+    {"value": "application/hl7-v3+xml", "label": "HL7 V3 (application/hl7-v3+xml)"}
+]
+
+def build_query_url(params: Dict[str, Any]) -> str:
+    base_url = API_BASE_URLS.get(params.get("environment", "integration"), API_BASE_URLS["integration"])
+    url = f"{base_url}DocumentReference?"
+    
+    query_params = []
+    
+    aaid = params.get("aaid", "").strip()
+    patient_id = params.get("patient_id", "").strip()
+    if aaid and patient_id:
+        identifier = f"{aaid}|{patient_id}"
+        query_params.append(f"patient.identifier={quote(identifier, safe='')}")
+    
+    status = params.get("status", "")
+    if status:
+        query_params.append(f"status={status}")
+    
+    date_from = params.get("date_from")
+    date_to = params.get("date_to")
+    if date_from:
+        query_params.append(f"date=ge{date_from.strftime('%Y-%m-%d')}")
+    if date_to:
+        query_params.append(f"date=le{date_to.strftime('%Y-%m-%d')}")
+    
+    doc_type = params.get("document_type", "")
+    if doc_type:
+        query_params.append(f"type={quote(f'http://loinc.org|{doc_type}', safe='')}")
+    
+    content_type = params.get("content_type", "")
+    if content_type:
+        query_params.append(f"contenttype={quote(content_type, safe='')}")
+    
+    author = params.get("author", "").strip()
+    if author:
+        query_params.append(f"author={quote(author, safe='')}")
+    
+    page_size = params.get("page_size")
+    if page_size:
+        query_params.append(f"_count={int(page_size)}")
+    
+    return url + "&".join(query_params)
+
+def query_headers(jwt_token: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {jwt_token}",
+        "Accept": "application/fhir+json",
+        "Content-Type": "application/fhir+json"
+    }
+
+def query_result(response, status_text: str, response_seconds: float) -> Dict[str, Any]:
+    response_time = response_seconds * 1000
+    record_response("query", response, response_seconds)
+    
+    with timed("parse", "query"):
+        try:
+            response_data = loads(response.content)
+        except:
+            response_data = {"raw": response.text}
+    
+    log_response("DocumentReference Query", response.status_code, status_text, dict(response.headers), response_data, response_time)
+    
+    if response.status_code == 200:
+        return {
+            "success": True,
+            "data": response_data,
+            "response_time": response_time
+        }
+    else:
+        return {
+            "success": False,
+            "error": f"HTTP {response.status_code}: {response.text}",
+            "response_time": response_time
+        }
+
+def fetch_query_page(session, url: str, headers: Dict[str, str], environment: Optional[str] = None) -> Dict[str, Any]:
+    log_request("DocumentReference Query", "GET", url, headers)
+    
+    start_time = time.perf_counter()
+    try:
+        response = send_with_retry(
+            lambda timeout: session.get(url, headers=headers, timeout=timeout),
+            "query",
+            circuit_for(environment, url),
+            hedge=True
+        )
+        return query_result(response, response.reason, time.perf_counter() - start_time)
+    except requests.exceptions.SSLError as e:
+        record_failure("query", time.perf_counter() - start_time, e)
+        return {"success": False, "error": f"SSL/TLS Error: {str(e)}. Check your certificate configuration."}
+    except requests.exceptions.Timeout as e:
+        record_failure("query", time.perf_counter() - start_time, e)
+        phase = "connect" if isinstance(e, requests.exceptions.ConnectTimeout) else "read"
+        return {"success": False, "error": timeout_message(e, phase)}
+    except requests.exceptions.RequestException as e:
+        record_failure("query", time.perf_counter() - start_time, e)
+        return {"success": False, "error": f"Request failed: {str(e)}"}
+
+def execute_query(params: Dict[str, Any], pool: Optional[SessionPool] = None) -> Dict[str, Any]:
+    url = build_query_url(params)
+    jwt_token = params.get("jwt_token", "").strip()
+    skip_verify = params.get("skip_tls_verify", False)
+    
+    environment = params.get("environment", "integration")
+    session = (pool or get_default_pool()).session(environment, skip_verify)
+    
+    return fetch_query_page(session, url, query_headers(jwt_token), environment)
+
+def get_next_link(bundle: Dict[str, Any]) -> Optional[str]:
+    for link in bundle.get("link", []) or []:
+        if link.get("relation") == "next" and link.get("url"):
+            return link["url"]
+    return None
+
+def iter_query_pages(
+    params: Dict[str, Any],
+    max_pages: Optional[int] = None,
+    max_documents: Optional[int] = None,
+    prefetch: bool = True,
+    pool: Optional[SessionPool] = None,
+    fetch_page: Optional[Callable[[str, Dict[str, str], str], Dict[str, Any]]] = None
+) -> Iterator[Dict[str, Any]]:
+    url = build_query_url(params)
+    jwt_token = params.get("jwt_token", "").strip()
+    skip_verify = params.get("skip_tls_verify", False)
+    
+    environment = params.get("environment", "integration")
+    if fetch_page is None:
+        session = (pool or get_default_pool()).session(environment, skip_verify)
+        fetch_page = lambda page_url, page_headers, page_environment: fetch_query_page(session, page_url, page_headers, page_environment)
+    headers = query_headers(jwt_token)
+    expected_host = urlparse(url).hostname
+    
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    pending = None
+    page_number = 0
+    document_count = 0
+    
+    try:
+        result = fetch_page(url, headers, environment)
+        while True:
+            page_number += 1
+            if not result["success"]:
+                yield {**result, "page": page_number}
+                return
+            
+            bundle = result["data"]
+            with timed("extract", "query"):
+                documents = extract_documents(bundle)
+            next_url = get_next_link(bundle)
+            truncated = False
+            
+            if max_documents is not None and document_count + len(documents) >= max_documents:
+                truncated = bool(next_url) or document_count + len(documents) > max_documents
+                documents = documents[:max_documents - document_count]
+                next_url = None
+            if next_url and max_pages is not None and page_number >= max_pages:
+                truncated = True
+                next_url = None
+            if next_url:
+                parsed = urlparse(next_url)
+                if parsed.scheme != "https" or parsed.hostname != expected_host:
+                    yield {
+                        "success": False,
+                        "error": f"Refusing to follow next link outside {expected_host}",
+                        "page": page_number
+                    }
+                    return
+                if executor:
+                    pending = executor.submit(fetch_page, next_url, headers, environment)
+            
+            document_count += len(documents)
+            yield {
+                "success": True,
+                "page": page_number,
+                "bundle": bundle,
+                "documents": documents,
+                "document_count": document_count,
+                "response_time": result.get("response_time"),
+                "has_more": bool(next_url),
+                "truncated": truncated
+            }
+            
+            if not next_url:
+                return
+            result = pending.result() if pending else fetch_page(next_url, headers, environment)
+            pending = None
+    finally:
+        if pending:
+            pending.cancel()
+        if executor:
+            executor.shutdown(wait=False)
+
+def execute_paginated_query(
+    params: Dict[str, Any],
+    max_pages: Optional[int] = None,
+    max_documents: Optional[int] = None,
+    on_page: Optional[Callable[[Dict[str, Any]], None]] = None,
+    pool: Optional[SessionPool] = None,
+    fetch_page: Optional[Callable[[str, Dict[str, str], str], Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    entries = []
+    total = None
+    response_time = 0.0
+    pages = 0
+    truncated = False
+    
+    for page in iter_query_pages(params, max_pages, max_documents, pool=pool, fetch_page=fetch_page):
+        response_time += page.get("response_time") or 0
+        if not page["success"]:
+            return {"success": False, "error": page["error"], "response_time": response_time}
+        
+        pages = page["page"]
+        truncated = page["truncated"]
+        bundle = page["bundle"]
+        if total is None:
+            total = bundle.get("total")
+        keep = len(page["documents"])
+        for entry in bundle.get("entry", []):
+            if entry.get("resource", {}).get("resourceType") == "DocumentReference":
+                if keep == 0:
+                    continue
+                keep -= 1
+            entries.append(entry)
+        if on_page:
+            on_page(page)
+    
+    merged = {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": total if total is not None else len(entries),
+        "entry": entries
+    }
+    return {
+        "success": True,
+        "data": merged,
+        "response_time": response_time,
+        "pages": pages,
+        "truncated": truncated
+    }
+
+BINARY_ALLOWED_HOSTS = {
+    "integration": "api.integration.commonwellalliance.lkopera.com",
+    "production": "api.commonwellalliance.lkopera.com"
+}
+
+def validate_document_url(environment: str, document_url: str) -> Optional[str]:
+    parsed = urlparse(document_url)
+    expected_host = BINARY_ALLOWED_HOSTS.get(environment)
+    
+    if parsed.scheme != "https" or parsed.hostname != expected_host:
+        return f"Invalid URL. Must be from {expected_host} using HTTPS"
+    return None
+
+def binary_headers(jwt_token: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {jwt_token}",
+        "Accept": "application/fhir+json"
+    }
+
+def binary_result(response, status_text: str, response_seconds: float) -> Dict[str, Any]:
+    record_response("binary", response, response_seconds)
+    
+    with timed("parse", "binary"):
+        try:
+            response_data = loads(response.content)
+        except:
+            response_data = {"raw": response.text}
+    
+    log_response("Binary Retrieve", response.status_code, status_text, dict(response.headers), response_data, response_seconds * 1000)
+    
+    if response.status_code == 200:
+        data = response_data
+        return {
+            "success": True,
+            "content_type": data.get("contentType", "application/octet-stream"),
+            "data": data.get("data", ""),
+            "id": data.get("id", "")
+        }
+    else:
+        return {"success": False, "error": f"HTTP {response.status_code}: {response.text}"}
+
+def download_document(
+    environment: str,
+    jwt_token: str,
+    document_url: str,
+    skip_verify: bool = False,
+    pool: Optional[SessionPool] = None
+) -> Dict[str, Any]:
+    url_error = validate_document_url(environment, document_url)
+    if url_error:
+        return {"success": False, "error": url_error}
+    
+    session = (pool or get_default_pool()).session(environment, skip_verify)
+    headers = binary_headers(jwt_token)
+    
+    log_request("Binary Retrieve", "GET", document_url, headers)
+    
+    start_time = time.perf_counter()
+    try:
+        response = send_with_retry(
+            lambda timeout: session.get(document_url, headers=headers, timeout=timeout),
+            "binary",
+            circuit_for(environment, document_url)
+        )
+        return binary_result(response, response.reason, time.perf_counter() - start_time)
+    except Exception as e:
+        record_failure("binary", time.perf_counter() - start_time, e)
+        return {"success": False, "error": str(e)}
+
+def download_document_stream(
+    environment: str,
+    jwt_token: str,
+    document_url: str,
+    skip_verify: bool = False,
+    preferred_type: Optional[str] = None,
+    pool: Optional[SessionPool] = None,
+    cache: Optional[DocumentCache] = None
+) -> Dict[str, Any]:
+    url_error = validate_document_url(environment, document_url)
+    if url_error:
+        return {"success": False, "error": url_error}
+    
+    session = (pool or get_default_pool()).session(environment, skip_verify)
+    
+    accept = "application/fhir+json"
+    if preferred_type in BINARY_RAW_CONTENT_TYPES:
+        accept = f"{preferred_type}, application/fhir+json;q=0.9"
+    
+    headers = {
+        "Authorization": f"Bearer {jwt_token}",
+        "Accept": accept
+    }
+    
+    def fetch(request_headers: Dict[str, str]) -> Dict[str, Any]:
+        log_request("Binary Retrieve", "GET", document_url, request_headers)
+        start_time = time.perf_counter()
+        try:
+            result = fetch_binary(session, document_url, request_headers, operation="binary", circuit=environment)
+            if result["status_code"] in (406, 415) and request_headers["Accept"] != "application/fhir+json":
+                request_headers = {**request_headers, "Accept": "application/fhir+json"}
+                result = fetch_binary(session, document_url, request_headers, operation="binary", circuit=environment)
+        except Exception as e:
+            record_failure("binary", time.perf_counter() - start_time, e)
+            raise
+        response_time = (time.perf_counter() - start_time) * 1000
+        
+        if result.get("not_modified"):
+            body = None
+        elif result["success"]:
+            body = {"id": result["id"], "contentType": result["content_type"], "size": result["size"], "raw": result["raw"]}
+        else:
+            body = {"error": result["error"]}
+        log_response("Binary Retrieve", result["status_code"], result["reason"], result["headers"], body, response_time)
+        return result
+    
+    try:
+        if not cache:
+            return fetch(headers)
+        
+        result = cache.fetch(environment, document_url, headers, fetch)
+        if result.get("cached"):
+            log_event("Binary Retrieve", "Served from document cache", {"url": document_url, "size": result["size"]})
+        return result
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+def read_document_bytes(result: Dict[str, Any], limit: Optional[int] = None) -> bytes:
+    document_file = result["file"]
+    document_file.seek(0)
+    return document_file.read(-1 if limit is None else limit)
+
+def extract_documents(bundle: Dict[str, Any]) -> List[Dict[str, Any]]:
+    documents = []
+    entries = bundle.get("entry", [])
+    
+    for entry in entries:
+        resource = entry.get("resource", {})
+        if resource.get("resourceType") == "DocumentReference":
+            doc = {
+                "id": resource.get("id", "Unknown"),
+                "status": resource.get("status", "unknown"),
+                "description": resource.get("description", "No description"),
+                "date": resource.get("date"),
+                "author": None,
+                "content": []
+            }
+            
+            authors = resource.get("author", [])
+            if authors and len(authors) > 0:
+                doc["author"] = authors[0].get("display") or authors[0].get("reference")
+            
+            for content in resource.get("content", []):
+                attachment = content.get("attachment", {})
+                doc["content"].append({
+                    "contentType": attachment.get("contentType", "unknown"),
+                    "url": attachment.get("url"),
+                    "size": attachment.get("size"),
+                    "title": attachment.get("title")
+                })
+            
+            documents.append(doc)
+    
+    return documents
@@ -0,0 +1,270 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import requests
+
+from config import CW_ORG_OID, RATE_LIMITS, RATE_LIMIT_SHARED_DIR, RATE_LIMIT_MAX_WAIT
+from commonwell.log import log_event
+from commonwell.metrics import QUEUE_WAIT_METRIC, THROTTLED_METRIC, get_registry
+
+try:
+    import fcntl
+    FILE_LOCKS_AVAILABLE = True
+except ImportError:
+    FILE_LOCKS_AVAILABLE = False
+
+class ThrottledError(requests.exceptions.RequestException):
+    pass
+
+class TokenBucket:
+    """In-process token bucket.
+
+    ``reserve`` takes a token immediately, going into debt if necessary, and
+    returns how long the caller must wait. Callers are served in order of
+    arrival without polling.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait_for = max(-(self._tokens - 1) / self.rate if self._tokens < 1 else 0.0, self._paused_until - now)
+            if wait_for > max_wait:
+                return None
+            self._tokens -= 1
+            return wait_for
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class FileTokenBucket:
+    """Token bucket whose state lives in a file, shared by processes on one host.
+
+    Every reservation takes an exclusive ``flock`` on the file, so the budget
+    holds across Streamlit replicas and batch runs that use the same directory.
+    """
+
+    def __init__(self, path: str, rate: float, burst: float):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @contextmanager
+    def _locked_state(self) -> Iterator[Dict[str, float]]:
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                state.setdefault("tokens", float(self.burst))
+                state.setdefault("updated", now)
+                state.setdefault("paused_until", 0.0)
+                state["tokens"] = min(self.burst, state["tokens"] + max(0.0, now - state["updated"]) * self.rate)
+                state["updated"] = now
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        with self._locked_state() as state:
+            tokens = state["tokens"]
+            wait_for = max(-(tokens - 1) / self.rate if tokens < 1 else 0.0, state["paused_until"] - state["updated"])
+            if wait_for > max_wait:
+                return None
+            state["tokens"] = tokens - 1
+            return wait_for
+
+    def pause(self, seconds: float):
+        with self._locked_state() as state:
+            state["paused_until"] = max(state["paused_until"], state["updated"] + seconds)
+
+class Lane:
+    def __init__(self, bucket, concurrency: int):
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+
+class RequestGovernor:
+    """Paces requests per (environment, endpoint) with a token bucket and a concurrency cap.
+
+    Budgets come from ``RATE_LIMITS``; endpoints without a budget are not
+    limited. With ``shared_dir`` the rate budget is shared through files by
+    every process on the host using the same org OID; the concurrency cap
+    is always per process.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Dict[str, float]]] = None,
+        shared_dir: Optional[str] = RATE_LIMIT_SHARED_DIR,
+        max_wait: float = RATE_LIMIT_MAX_WAIT
+    ):
+        self.limits = {endpoint: dict(limit) for endpoint, limit in (limits or RATE_LIMITS).items()}
+        self.shared_dir = shared_dir
+        self.max_wait = max_wait
+        self._lanes: Dict[Tuple[str, str], Lane] = {}
+        self._lock = threading.Lock()
+        if shared_dir and not FILE_LOCKS_AVAILABLE:
+            log_event("Rate Limiter", "File locks unavailable on this platform; rate limits apply per process", severity="WARNING")
+
+    def configure(self, endpoint: str, **limit: Optional[float]):
+        with self._lock:
+            current = self.limits.setdefault(endpoint, {"rate": 1.0, "burst": 1, "concurrency": 1})
+            current.update({key: value for key, value in limit.items() if value is not None})
+            for key in [key for key in self._lanes if key[1] == endpoint]:
+                del self._lanes[key]
+
+    def share_through(self, shared_dir: Optional[str]):
+        with self._lock:
+            self.shared_dir = shared_dir
+            self._lanes.clear()
+
+    def _lane(self, environment: str, endpoint: str) -> Optional[Lane]:
+        limit = self.limits.get(endpoint)
+        if not limit:
+            return None
+        key = (environment, endpoint)
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                if self.shared_dir and FILE_LOCKS_AVAILABLE:
+                    path = os.path.join(self.shared_dir, f"{CW_ORG_OID}.{environment}.{endpoint}.bucket")
+                    bucket = FileTokenBucket(path, limit["rate"], limit["burst"])
+                else:
+                    bucket = TokenBucket(limit["rate"], limit["burst"])
+                lane = self._lanes[key] = Lane(bucket, int(limit["concurrency"]))
+            return lane
+
+    @contextmanager
+    def slot(self, environment: str, endpoint: str, max_wait: Optional[float] = None):
+        lane = self._lane(environment, endpoint)
+        if lane is None:
+            yield
+            return
+
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        start = time.perf_counter()
+        lane.waiting += 1
+        try:
+            if not lane.semaphore.acquire(timeout=max_wait):
+                self._throttled(environment, endpoint, "concurrency", max_wait)
+            try:
+                wait_for = lane.bucket.reserve(max_wait - (time.perf_counter() - start))
+                if wait_for is None:
+                    self._throttled(environment, endpoint, "rate", max_wait)
+                if wait_for > 0:
+                    time.sleep(wait_for)
+            except BaseException:
+                lane.semaphore.release()
+                raise
+        finally:
+            lane.waiting -= 1
+
+        get_registry().observe(QUEUE_WAIT_METRIC, time.perf_counter() - start, environment=environment, endpoint=endpoint)
+        lane.in_flight += 1
+        try:
+            yield
+        finally:
+            lane.in_flight -= 1
+            lane.semaphore.release()
+
+    @asynccontextmanager
+    async def async_slot(self, environment: str, endpoint: str, max_wait: Optional[float] = None) -> AsyncIterator[None]:
+        lane = self._lane(environment, endpoint)
+        if lane is None:
+            yield
+            return
+
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        start = time.perf_counter()
+        lane.waiting += 1
+        try:
+            if not lane.semaphore.acquire(blocking=False):
+                # The cap is shared with threads, so wait for it off the event loop
+                acquiring = asyncio.get_running_loop().run_in_executor(None, lane.semaphore.acquire, True, max_wait)
+                try:
+                    acquired = await asyncio.shield(acquiring)
+                except asyncio.CancelledError:
+                    acquiring.add_done_callback(lambda future: future.result() and lane.semaphore.release())
+                    raise
+                if not acquired:
+                    self._throttled(environment, endpoint, "concurrency", max_wait)
+            try:
+                wait_for = lane.bucket.reserve(max_wait - (time.perf_counter() - start))
+                if wait_for is None:
+                    self._throttled(environment, endpoint, "rate", max_wait)
+                if wait_for > 0:
+                    await asyncio.sleep(wait_for)
+            except BaseException:
+                lane.semaphore.release()
+                raise
+        finally:
+            lane.waiting -= 1
+
+        get_registry().observe(QUEUE_WAIT_METRIC, time.perf_counter() - start, environment=environment, endpoint=endpoint)
+        lane.in_flight += 1
+        try:
+            yield
+        finally:
+            lane.in_flight -= 1
+            lane.semaphore.release()
+
+    def _throttled(self, environment: str, endpoint: str, reason: str, max_wait: float):
+        get_registry().inc(THROTTLED_METRIC, environment=environment, endpoint=endpoint, reason=reason)
+        raise ThrottledError(f"Client-side {reason} limit for {endpoint} in {environment} not available within {max_wait:.1f}s")
+
+    def penalize(self, environment: str, endpoint: str, seconds: float):
+        lane = self._lane(environment, endpoint)
+        if lane is not None and seconds > 0:
+            lane.bucket.pause(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                f"{environment}/{endpoint}": {
+                    "in_flight": lane.in_flight,
+                    "waiting": lane.waiting,
+                    "concurrency": lane.concurrency,
+                    "rate": self.limits[endpoint]["rate"]
+                }
+                for (environment, endpoint), lane in self._lanes.items()
+            }
+
+_default_governor: Optional[RequestGovernor] = None
+_default_lock = threading.Lock()
+
+def get_governor() -> RequestGovernor:
+    global _default_governor
+    with _default_lock:
+        if _default_governor is None:
+            _default_governor = RequestGovernor()
+        return _default_governor
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import HISTORY_DB_PATH, HISTORY_RETENTION_DAYS
+from commonwell.stats import percentile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_history (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    environment TEXT NOT NULL,
+    aaid TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    cache TEXT,
+    url TEXT NOT NULL,
+    latency_ms REAL,
+    document_count INTEGER,
+    pages INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_history_patient ON query_history (aaid, patient_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_history_environment ON query_history (environment, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_history_created ON query_history (created_at DESC, id DESC);
+"""
+
+COLUMNS = ["id", "created_at", "environment", "aaid", "patient_id", "success", "cache", "url", "latency_ms", "document_count", "pages", "error"]
+
+Cursor = Tuple[float, int]
+
+class HistoryStore:
+    """Query history in SQLite (WAL mode), shared by every session of the app.
+
+    Pages are read newest first with keyset pagination on
+    (created_at, id), so a page costs the same however long the history
+    gets. Rows older than ``retention_days`` are pruned on open.
+    """
+
+    def __init__(self, path: str = HISTORY_DB_PATH, retention_days: Optional[int] = HISTORY_RETENTION_DAYS):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if not os.path.exists(path):
+                # Holds patient identifiers, so readable by the owner only
+                os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            if retention_days:
+                self._conn.execute("DELETE FROM query_history WHERE created_at < ?", (time.time() - retention_days * 86400,))
+
+    def add(
+        self,
+        environment: str,
+        aaid: str,
+        patient_id: str,
+        success: bool,
+        url: str,
+        cache: Optional[str] = None,
+        latency_ms: Optional[float] = None,
+        document_count: Optional[int] = None,
+        pages: Optional[int] = None,
+        error: Optional[str] = None,
+        created_at: Optional[float] = None
+    ) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO query_history (created_at, environment, aaid, patient_id, success, cache, url, latency_ms, document_count, pages, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (created_at or time.time(), environment, aaid or "", patient_id or "", int(success), cache, url, latency_ms, document_count, pages, error)
+            )
+            return cursor.lastrowid
+
+    def _where(self, environment: Optional[str], aaid: Optional[str], patient_id: Optional[str], since: Optional[float]) -> Tuple[List[str], List[Any]]:
+        clauses, args = [], []
+        if environment:
+            clauses.append("environment = ?")
+            args.append(environment)
+        if aaid:
+            clauses.append("aaid = ?")
+            args.append(aaid)
+        if patient_id:
+            clauses.append("patient_id = ?")
+            args.append(patient_id)
+        if since:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        return clauses, args
+
+    def page(
+        self,
+        limit: int,
+        before: Optional[Cursor] = None,
+        environment: Optional[str] = None,
+        aaid: Optional[str] = None,
+        patient_id: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[Cursor]]:
+        """Return up to ``limit`` entries older than ``before``, and the cursor for the next page (None at the end)."""
+        clauses, args = self._where(environment, aaid, patient_id, None)
+        if before:
+            clauses.append("(created_at, id) < (?, ?)")
+            args.extend(before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM query_history {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+                (*args, limit + 1)
+            ).fetchall()
+        entries = [dict(zip(COLUMNS, row)) for row in rows[:limit]]
+        for entry in entries:
+            entry["success"] = bool(entry["success"])
+        next_cursor = (entries[-1]["created_at"], entries[-1]["id"]) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def daily_summary(self, days: int = 14, environment: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Per-day query count, success rate and latency percentiles for queries sent to CommonWell."""
+        clauses, args = self._where(environment, None, None, time.time() - days * 86400)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT created_at, success, cache, latency_ms FROM query_history WHERE {' AND '.join(clauses)}",
+                args
+            ).fetchall()
+
+        days_seen: Dict[str, Dict[str, Any]] = {}
+        for created_at, success, cache, latency_ms in rows:
+            day = days_seen.setdefault(datetime.fromtimestamp(created_at).strftime("%Y-%m-%d"), {"queries": 0, "succeeded": 0, "latencies": []})
+            day["queries"] += 1
+            day["succeeded"] += success
+            # Cached results would hide a slower CommonWell
+            if latency_ms is not None and cache not in ("hit", "stale"):
+                day["latencies"].append(latency_ms)
+
+        return [
+            {
+                "day": day,
+                "queries": stats["queries"],
+                "success_rate": stats["succeeded"] / stats["queries"],
+                "p50_ms": percentile(stats["latencies"], 50),
+                "p95_ms": percentile(stats["latencies"], 95),
+                "max_ms": max(stats["latencies"]) if stats["latencies"] else None
+            }
+            for day, stats in sorted(days_seen.items(), reverse=True)
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM query_history")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
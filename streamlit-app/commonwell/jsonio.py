@@ -0,0 +1,59 @@
+import json
+from typing import Any, Callable, Optional, Union
+
+from config import JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+def _select_backend(name: str) -> str:
+    available = {"orjson": orjson is not None, "msgspec": msgspec is not None, "json": True}
+    if name == "auto":
+        return next(backend for backend in ("orjson", "msgspec", "json") if available[backend])
+    if name not in available:
+        raise ValueError(f"Unknown JSON_BACKEND {name!r}; expected auto, orjson, msgspec or json")
+    return name if available[name] else "json"
+
+BACKEND = _select_backend(JSON_BACKEND)
+
+if BACKEND == "msgspec":
+    _decoder = msgspec.json.Decoder()
+    _encoder = msgspec.json.Encoder()
+    _DECODE_ERRORS = (msgspec.DecodeError,)
+    _ENCODE_ERRORS = (msgspec.EncodeError, TypeError, OverflowError)
+else:
+    _DECODE_ERRORS = (ValueError,)
+    _ENCODE_ERRORS = (TypeError, ValueError)
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Decode JSON, straight from response bytes where the backend allows it."""
+    try:
+        if BACKEND == "orjson":
+            return orjson.loads(data)
+        if BACKEND == "msgspec":
+            return _decoder.decode(data)
+    except _DECODE_ERRORS:
+        # Native codecs reject a few documents the standard library accepts, e.g. NaN or lone surrogates
+        pass
+    return json.loads(data)
+
+def dumps_bytes(value: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Compact UTF-8 JSON."""
+    try:
+        if BACKEND == "orjson":
+            return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+        if BACKEND == "msgspec":
+            return msgspec.json.encode(value, enc_hook=default) if default else _encoder.encode(value)
+    except _ENCODE_ERRORS:
+        pass
+    return json.dumps(value, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps(value: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    return dumps_bytes(value, default).decode("utf-8")
@@ -0,0 +1,325 @@
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import (
+    LOG_LEVEL, LOG_SAMPLE_RATES, LOG_BODY_MODE, LOG_MAX_BODY_CHARS, LOG_MAX_STRING_CHARS,
+    LOG_REDACT_PHI, LOG_OUTPUT, LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL
+)
+from commonwell.jsonio import dumps
+
+SEVERITY_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+PHI_FIELDS = {
+    "name", "given", "family", "given_name", "family_name", "middle_name", "birthdate", "birthDate",
+    "gender", "address", "historical_address", "telecom", "phone_number", "email", "identifier",
+    "alternatePatients", "photo", "contact", "subject", "div", "data", "id_token", "sub",
+    "urn:oasis:names:tc:xspa:1.0:subject:subject-id"
+}
+SECRET_HEADERS = {"authorization", "cookie", "set-cookie"}
+PHI_QUERY_PARAMS = {"patient.identifier", "patient", "subject"}
+URL_FIELDS = {"url", "fullUrl", "next"}
+
+# Per-process key: hashes correlate values within one run without being reversible by brute force later
+_HASH_KEY = os.urandom(16)
+
+def format_timestamp():
+    return datetime.now().isoformat()
+
+def fingerprint(value: Any) -> str:
+    data = value if isinstance(value, bytes) else str(value).encode("utf-8", errors="replace")
+    return hmac.new(_HASH_KEY, data, hashlib.sha256).hexdigest()[:16]
+
+def redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [
+        (key, f"redacted-{fingerprint(value)}" if key in PHI_QUERY_PARAMS else value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+    ]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query, safe="|"), parts.fragment))
+
+def redact_headers(headers: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+    if not headers:
+        return None
+    sanitized = {}
+    for key, value in headers.items():
+        if key.lower() in SECRET_HEADERS:
+            scheme, _, credential = str(value).partition(" ")
+            sanitized[key] = f"{scheme} [redacted {fingerprint(credential or scheme)}]"
+        else:
+            sanitized[key] = value
+    return sanitized
+
+def redact(value: Any, redact_phi: bool = True, max_string: int = LOG_MAX_STRING_CHARS) -> Any:
+    if isinstance(value, dict):
+        redacted = {}
+        for key, item in value.items():
+            if redact_phi and key in PHI_FIELDS and item not in (None, "", [], {}):
+                redacted[key] = f"[redacted {fingerprint(json.dumps(item, sort_keys=True, default=str))}]"
+            elif key in URL_FIELDS and isinstance(item, str):
+                redacted[key] = redact_url(item) if redact_phi else item
+            else:
+                redacted[key] = redact(item, redact_phi, max_string)
+        return redacted
+    if isinstance(value, (list, tuple)):
+        return [redact(item, redact_phi, max_string) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {"bytes": len(value), "sha256": fingerprint(bytes(value))}
+    if isinstance(value, str) and len(value) > max_string:
+        return f"{value[:max_string]}...[{len(value)} chars, {fingerprint(value)}]"
+    return value
+
+def summarize_resource(resource: Dict[str, Any]) -> Dict[str, Any]:
+    summary = {"resourceType": resource.get("resourceType")}
+    if "id" in resource:
+        summary["id"] = resource["id"]
+    if "total" in resource:
+        summary["total"] = resource["total"]
+    if "entry" in resource:
+        summary["entries"] = len(resource["entry"] or [])
+    if resource.get("link"):
+        summary["links"] = [link.get("relation") for link in resource["link"]]
+    if "contentType" in resource:
+        summary["contentType"] = resource["contentType"]
+    if isinstance(resource.get("data"), str):
+        summary["dataChars"] = len(resource["data"])
+    if resource.get("issue"):
+        summary["issue"] = [
+            {key: issue.get(key) for key in ("severity", "code", "diagnostics") if issue.get(key)}
+            for issue in resource["issue"]
+        ]
+    return summary
+
+def encode_body(body: Any, mode: str = LOG_BODY_MODE, redact_phi: bool = LOG_REDACT_PHI, max_chars: int = LOG_MAX_BODY_CHARS) -> str:
+    if body is None or mode == "none":
+        return "null"
+    if mode == "summary" and isinstance(body, dict) and body.get("resourceType"):
+        return dumps(summarize_resource(body), default=str)
+
+    # Encoded once: the text that is measured is the text that is written
+    text = dumps(redact(body, redact_phi), default=str)
+    if len(text) <= max_chars:
+        return text
+    return dumps({"truncated": True, "chars": len(text), "sha256": fingerprint(text), "preview": text[:max_chars]})
+
+def prepare_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    prepared = {key: value for key, value in entry.items() if key != "body"}
+    if "headers" in prepared:
+        prepared["headers"] = redact_headers(prepared["headers"])
+    for key, value in prepared.items():
+        if key == "headers":
+            continue
+        prepared[key] = redact({key: value}, LOG_REDACT_PHI)[key]
+    return prepared
+
+def encode_entry(entry: Dict[str, Any]) -> str:
+    line = dumps(prepare_entry(entry), default=str)
+    if "body" not in entry:
+        return line
+    return f'{line[:-1]}{"," if len(line) > 2 else ""}"body":{encode_body(entry["body"])}}}'
+
+class AsyncLogger:
+    """Structured JSON logger that formats and writes entries on a background thread.
+
+    ``emit`` only samples and enqueues; redaction, truncation and
+    serialization happen on the writer thread. When the bounded queue is
+    full the entry is dropped and counted instead of blocking the caller.
+    Bodies are read by the writer thread later, so they must not be mutated
+    after they are logged.
+    """
+
+    def __init__(
+        self,
+        output: str = LOG_OUTPUT,
+        level: str = LOG_LEVEL,
+        sample_rates: Optional[Dict[str, float]] = None,
+        queue_size: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL
+    ):
+        self.output = output
+        self.level = SEVERITY_LEVELS.get(level, SEVERITY_LEVELS["INFO"])
+        self.sample_rates = LOG_SAMPLE_RATES if sample_rates is None else sample_rates
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stream = None
+        self.emitted = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def emit(self, entry: Dict[str, Any]):
+        severity = entry.get("severity", "INFO")
+        if SEVERITY_LEVELS.get(severity, SEVERITY_LEVELS["INFO"]) < self.level:
+            self.sampled_out += 1
+            return
+        rate = self.sample_rates.get(severity, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self.sampled_out += 1
+            return
+
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+        try:
+            self._queue.put_nowait(entry)
+            self.emitted += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _open(self):
+        if self._stream is None:
+            self._stream = sys.stdout if self.output == "stdout" else open(self.output, "a", encoding="utf-8")
+        return self._stream
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        lines = []
+        for entry in batch:
+            try:
+                lines.append(encode_entry(entry))
+            except Exception as e:
+                self.errors += 1
+                lines.append(dumps({
+                    "timestamp": entry.get("timestamp"),
+                    "severity": "ERROR",
+                    "type": "LOG_ERROR",
+                    "operation": entry.get("operation"),
+                    "message": f"Failed to format log entry: {e}"
+                }))
+        try:
+            stream = self._open()
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+            self.written += len(batch)
+        except Exception:
+            self.errors += len(batch)
+
+    def _run(self):
+        reported_drops = 0
+        while True:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+
+            if self.dropped > reported_drops:
+                batch.append({
+                    "timestamp": format_timestamp(),
+                    "severity": "WARNING",
+                    "type": "EVENT",
+                    "operation": "Logging",
+                    "message": f"Log buffer full, dropped {self.dropped - reported_drops} entries"
+                })
+                reported_drops = self.dropped
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def flush(self, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        while self._thread and self._thread.is_alive() and time.monotonic() < deadline:
+            if self._queue.empty() and self.written + self.errors >= self.emitted:
+                return
+            time.sleep(0.01)
+
+    def close(self, timeout: float = 5.0):
+        if self._thread and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        if self._stream is not None and self._stream is not sys.stdout:
+            self._stream.close()
+        self._stream = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "emitted": self.emitted,
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "errors": self.errors
+        }
+
+_default_logger: Optional[AsyncLogger] = None
+_default_lock = threading.Lock()
+
+def get_logger() -> AsyncLogger:
+    global _default_logger
+    with _default_lock:
+        if _default_logger is None:
+            _default_logger = AsyncLogger()
+            atexit.register(_default_logger.close)
+        return _default_logger
+
+def log_json(log_entry):
+    get_logger().emit(log_entry)
+
+def log_request(operation, method, url, headers, body=None):
+    log_json({
+        "timestamp": format_timestamp(),
+        "severity": "INFO",
+        "type": "REQUEST",
+        "operation": operation,
+        "method": method,
+        "url": url,
+        "headers": dict(headers) if headers else None,
+        "body": body
+    })
+
+def log_response(operation, status_code, status_text, headers=None, body=None, response_time_ms=None):
+    log_json({
+        "timestamp": format_timestamp(),
+        "severity": "ERROR" if status_code >= 400 else "INFO",
+        "type": "RESPONSE",
+        "operation": operation,
+        "statusCode": status_code,
+        "statusText": status_text,
+        "headers": dict(headers) if headers else None,
+        "body": body,
+        "responseTimeMs": response_time_ms
+    })
+
+def log_event(operation, message, data=None, severity="INFO"):
+    log_entry = {
+        "timestamp": format_timestamp(),
+        "severity": severity,
+        "type": "EVENT",
+        "operation": operation,
+        "message": message
+    }
+    if data:
+        log_entry.update(data)
+    log_json(log_entry)
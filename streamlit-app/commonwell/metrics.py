@@ -0,0 +1,249 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import METRICS_BUCKETS
+
+PHASE_METRIC = "commonwell_phase_seconds"
+CONNECTION_METRIC = "commonwell_connection_seconds"
+REQUEST_METRIC = "commonwell_requests_total"
+RETRY_METRIC = "commonwell_retries_total"
+HEDGE_METRIC = "commonwell_hedged_requests_total"
+CIRCUIT_METRIC = "commonwell_circuit_rejections_total"
+QUEUE_WAIT_METRIC = "commonwell_queue_wait_seconds"
+THROTTLED_METRIC = "commonwell_throttled_total"
+
+METRIC_HELP = {
+    PHASE_METRIC: "Time spent per request phase (ttfb, body, parse, extract, total, ...)",
+    CONNECTION_METRIC: "Time to open connections: connect (DNS + TCP) and TLS handshake",
+    REQUEST_METRIC: "HTTP requests by operation and status code",
+    RETRY_METRIC: "Retried requests by operation and reason",
+    HEDGE_METRIC: "Hedged second requests by operation and which request won",
+    CIRCUIT_METRIC: "Requests rejected by an open circuit breaker",
+    QUEUE_WAIT_METRIC: "Time requests waited for the client-side rate limit and concurrency cap",
+    THROTTLED_METRIC: "Requests rejected because the client-side limit was not available in time"
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style, plus the max seen."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if count and seen + count >= rank:
+                # Interpolate within the bucket, never past the largest observed value
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+            lower = upper
+        return self.max
+
+class MetricsRegistry:
+    def __init__(self, buckets: Optional[List[float]] = None):
+        self.buckets = buckets or METRICS_BUCKETS
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def quantile(self, name: str, q: float, min_count: int = 1, **labels: str) -> Optional[float]:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(key)
+            if histogram is None or histogram.count < min_count:
+                return None
+            return histogram.quantile(q)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms = [
+                {
+                    "name": name,
+                    **dict(labels),
+                    "count": histogram.count,
+                    "sum_seconds": histogram.sum,
+                    "p50_ms": _ms(histogram.quantile(0.5)),
+                    "p95_ms": _ms(histogram.quantile(0.95)),
+                    "p99_ms": _ms(histogram.quantile(0.99)),
+                    "max_ms": _ms(histogram.max)
+                }
+                for name, series in self._histograms.items()
+                for labels, histogram in series.items()
+            ]
+            counters = [
+                {"name": name, **dict(labels), "value": value}
+                for name, series in self._counters.items()
+                for labels, value in series.items()
+            ]
+        return {"timestamp": time.time(), "histograms": histograms, "counters": counters}
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + [float("inf")], histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else seconds * 1000
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+_default_registry = MetricsRegistry()
+
+def get_registry() -> MetricsRegistry:
+    return _default_registry
+
+def observe_phase(phase: str, seconds: float, operation: str = ""):
+    _default_registry.observe(PHASE_METRIC, seconds, phase=phase, operation=operation)
+
+@contextmanager
+def timed(phase: str, operation: str = ""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - start, operation)
+
+def record_response(operation: str, response, total_seconds: float, streamed: bool = False):
+    """Record ttfb, body download and total for a completed requests response.
+
+    ``response.elapsed`` runs from sending the request to parsing the headers;
+    for a non-streamed response the rest of ``total_seconds`` is the body.
+    """
+    ttfb = response.elapsed.total_seconds()
+    observe_phase("ttfb", ttfb, operation)
+    if not streamed:
+        observe_phase("body", max(0.0, total_seconds - ttfb), operation)
+    observe_phase("total", total_seconds, operation)
+    _default_registry.inc(REQUEST_METRIC, operation=operation, status=str(response.status_code))
+
+def record_failure(operation: str, total_seconds: float, error: Exception):
+    observe_phase("total", total_seconds, operation)
+    _default_registry.inc(REQUEST_METRIC, operation=operation, status=type(error).__name__)
+
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        self._connect_seconds = time.perf_counter() - start
+        _default_registry.observe(CONNECTION_METRIC, self._connect_seconds, phase="connect", host=self.host)
+        return sock
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        self._connect_seconds = time.perf_counter() - start
+        _default_registry.observe(CONNECTION_METRIC, self._connect_seconds, phase="connect", host=self.host)
+        return sock
+
+    def connect(self):
+        self._connect_seconds = 0.0
+        start = time.perf_counter()
+        super().connect()
+        # connect() opens the socket through _new_conn and then wraps it in TLS
+        tls_seconds = time.perf_counter() - start - self._connect_seconds
+        _default_registry.observe(CONNECTION_METRIC, max(0.0, tls_seconds), phase="tls", host=self.host)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _default_registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError:
+                # Already bound, e.g. by another Streamlit process on this host
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
@@ -0,0 +1,181 @@
+import re
+import time
+from typing import Any, Dict, Optional
+
+from config import CW_ORG_OID, CW_ORG_NAME, CLEAR_OID, PATIENT_API_BASE_URLS
+from commonwell.jsonio import dumps_bytes, loads
+from commonwell.log import log_request, log_response, log_event
+from commonwell.metrics import record_failure, record_response, timed
+from commonwell.resilience import request_not_sent, send_with_retry
+from commonwell.transport import SessionPool, get_default_pool
+
+def build_patient_object(clear_claims: Dict[str, Any], cvs_patient_id: str, cvs_aaid: str) -> Dict[str, Any]:
+    patient = {
+        "identifier": [
+            {
+                "value": cvs_patient_id,
+                "system": cvs_aaid,
+                "use": "official",
+                "assigner": CW_ORG_NAME
+            },
+            {
+                "value": clear_claims.get("sub", ""),
+                "system": CLEAR_OID,
+                "use": "secondary",
+                "type": "IAL2",
+                "assigner": "CLEAR"
+            }
+        ],
+        "name": [{
+            "given": [clear_claims.get("given_name", "")],
+            "family": [clear_claims.get("family_name", "")],
+            "text": f"{clear_claims.get('given_name', '')} {clear_claims.get('middle_name', '')} {clear_claims.get('family_name', '')}".replace("  ", " ").strip(),
+            "use": "usual"
+        }],
+        "birthDate": clear_claims.get("birthdate"),
+        "active": True
+    }
+    
+    if clear_claims.get("middle_name"):
+        patient["name"][0]["given"].append(clear_claims["middle_name"])
+    
+    if clear_claims.get("gender"):
+        patient["gender"] = clear_claims["gender"]
+    
+    address = clear_claims.get("address")
+    if address:
+        patient["address"] = [{
+            "line": [address.get("street_address", "")],
+            "city": address.get("locality", ""),
+            "state": address.get("region", ""),
+            "postalCode": address.get("postal_code", ""),
+            "country": address.get("country", "US"),
+            "use": "home"
+        }]
+    
+    phone = clear_claims.get("phone_number")
+    if phone:
+        phone_clean = re.sub(r"^\+1", "", phone)
+        phone_clean = re.sub(r"\D", "", phone_clean)
+        patient["telecom"] = [{
+            "value": phone_clean,
+            "system": "phone",
+            "use": "home"
+        }]
+    
+    historical = clear_claims.get("historical_address", [])
+    if historical:
+        if "address" not in patient:
+            patient["address"] = []
+        for hist in historical:
+            patient["address"].append({
+                "line": [hist.get("street_address", "")],
+                "city": hist.get("locality", ""),
+                "state": hist.get("region", ""),
+                "postalCode": hist.get("postal_code", ""),
+                "country": hist.get("country", "US"),
+                "use": "old",
+                "type": "both"
+            })
+    
+    alternate = {
+        "identifier": [{
+            "value": clear_claims.get("sub", ""),
+            "system": CLEAR_OID,
+            "use": "secondary",
+            "type": "IAL2",
+            "assigner": "CLEAR"
+        }],
+        "name": [{
+            "given": [clear_claims.get("given_name", "")],
+            "family": [clear_claims.get("family_name", "")],
+            "use": "usual"
+        }],
+        "birthDate": clear_claims.get("birthdate")
+    }
+    
+    if clear_claims.get("middle_name"):
+        alternate["name"][0]["given"].append(clear_claims["middle_name"])
+    
+    if clear_claims.get("gender"):
+        alternate["gender"] = clear_claims["gender"]
+    
+    if address:
+        alternate["address"] = [{
+            "line": [address.get("street_address", "")],
+            "city": address.get("locality", ""),
+            "state": address.get("region", ""),
+            "postalCode": address.get("postal_code", ""),
+            "use": "home"
+        }]
+    
+    if phone and clear_claims.get("phone_number_verified") is True:
+        phone_clean = re.sub(r"^\+1", "", phone)
+        phone_clean = re.sub(r"\D", "", phone_clean)
+        alternate["telecom"] = [{
+            "value": phone_clean,
+            "system": "phone",
+            "use": "home"
+        }]
+    
+    patient["alternatePatients"] = [alternate]
+    
+    return patient
+
+def patient_url(environment: str) -> str:
+    return f"{PATIENT_API_BASE_URLS[environment]}org/{CW_ORG_OID}/Patient"
+
+def patient_headers(cw_jwt: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {cw_jwt}",
+        "Accept": "application/fhir+json",
+        "Content-Type": "application/fhir+json"
+    }
+
+def patient_result(response, status_text: str, response_seconds: float, patient_object: Dict[str, Any]) -> Dict[str, Any]:
+    record_response("patient_create", response, response_seconds)
+    
+    with timed("parse", "patient_create"):
+        try:
+            response_data = loads(response.content) if response.content else {}
+        except:
+            response_data = {"raw": response.text}
+    
+    log_response("Patient Create", response.status_code, status_text, dict(response.headers), response_data, response_seconds * 1000)
+    
+    if response.status_code >= 200 and response.status_code < 300:
+        return {
+            "success": True,
+            "status_code": response.status_code,
+            "patient": response_data,
+            "patient_object": patient_object
+        }
+    else:
+        return {
+            "success": False,
+            "status_code": response.status_code,
+            "error": f"HTTP {response.status_code}: {response.text}",
+            "patient_object": patient_object
+        }
+
+def create_patient(environment: str, cw_jwt: str, patient_object: Dict[str, Any], skip_verify: bool = False, pool: Optional[SessionPool] = None) -> Dict[str, Any]:
+    url = patient_url(environment)
+    session = (pool or get_default_pool()).session(environment, skip_verify)
+    headers = patient_headers(cw_jwt)
+    
+    body = dumps_bytes(patient_object)
+    log_request("Patient Create", "POST", url, headers, patient_object)
+    
+    start_time = time.perf_counter()
+    try:
+        response = send_with_retry(
+            lambda timeout: session.post(url, headers=headers, data=body, timeout=timeout),
+            "patient_create",
+            environment,
+            idempotent=False
+        )
+        return patient_result(response, response.reason, time.perf_counter() - start_time, patient_object)
+    except Exception as e:
+        record_failure("patient_create", time.perf_counter() - start_time, e)
+        log_event("Patient Create", f"Error: {str(e)}", severity="ERROR")
+        return {"success": False, "error": str(e), "not_sent": request_not_sent(e), "patient_object": patient_object}
@@ -0,0 +1,198 @@
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from config import PREVIEW_SERVER_HOST, PREVIEW_PUBLIC_URL, PREVIEW_URL_TTL
+
+CHUNK_SIZE = 256 * 1024
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class PublishedDocument:
+    def __init__(self, document_file: BinaryIO, size: int, content_type: str):
+        self.file = document_file
+        self.size = size
+        self.content_type = content_type
+        self.lock = threading.Lock()
+        self.last_published = time.time()
+
+    def read(self, offset: int, length: int) -> bytes:
+        # The file also backs the Streamlit preview, so every read sets its own position
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+class PreviewServer:
+    """Serves decoded preview documents to the browser over signed, expiring URLs.
+
+    Documents stay in the spooled files the download produced, so nothing
+    is written to disk in the clear. URLs name the document by its SHA-256
+    and carry an HMAC over the digest and expiry, with a per-process key.
+    Expiry is rounded to ``ttl`` so the URL, and the browser's copy, stays the
+    same across reruns. Range requests are supported so PDF viewers can
+    fetch the pages they show.
+    """
+
+    def __init__(self, host: str, port: int, public_url: Optional[str] = PREVIEW_PUBLIC_URL, ttl: int = PREVIEW_URL_TTL):
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._documents: Dict[str, PublishedDocument] = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _handler_for(self))
+        self.httpd.daemon_threads = True
+        self.public_url = (public_url or f"http://{'localhost' if host in ('127.0.0.1', '0.0.0.0') else host}:{self.httpd.server_port}").rstrip("/")
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="preview-server", daemon=True).start()
+
+    def sign(self, digest: str, expires: int) -> str:
+        return hmac.new(self._key, f"{digest}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def publish(self, digest: str, document_file: BinaryIO, size: int, content_type: str) -> str:
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            document = self._documents.get(digest)
+            if document is None or document.file is not document_file:
+                # A re-download brings a new file; the old one may already be closed
+                document = self._documents[digest] = PublishedDocument(document_file, size, content_type)
+            document.last_published = now
+        expires = (int(now) // self.ttl + 2) * self.ttl
+        return f"{self.public_url}/documents/{digest}?expires={expires}&sig={self.sign(digest, expires)}"
+
+    def _evict(self, now: float):
+        for digest, document in list(self._documents.items()):
+            if now - document.last_published > 2 * self.ttl:
+                del self._documents[digest]
+
+    def resolve(self, path: str) -> Tuple[int, Optional[PublishedDocument]]:
+        parts = urlsplit(path)
+        match = re.fullmatch(r"/documents/([0-9a-f]{64})", parts.path)
+        if not match:
+            return 404, None
+        query = parse_qs(parts.query)
+        try:
+            expires = int(query["expires"][0])
+            signature = query["sig"][0]
+        except (KeyError, ValueError):
+            return 403, None
+        digest = match.group(1)
+        if not hmac.compare_digest(signature, self.sign(digest, expires)):
+            return 403, None
+        if expires < time.time():
+            return 410, None
+        with self._lock:
+            document = self._documents.get(digest)
+        if document is None or document.file.closed:
+            return 410, None
+        return 200, document
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "bytes": sum(document.size for document in self._documents.values()),
+                "url": self.public_url
+            }
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Return the inclusive (start, end) of a single byte range; raises ValueError if unsatisfiable."""
+    if not header:
+        return None
+    if size == 0:
+        raise ValueError("Empty document")
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        # Multiple or malformed ranges: serve the whole document, which RFC 9110 allows
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+def _handler_for(server: PreviewServer):
+    class PreviewHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self):
+            self._serve(send_body=False)
+
+        def do_GET(self):
+            self._serve(send_body=True)
+
+        def _serve(self, send_body: bool):
+            status, document = server.resolve(self.path)
+            if document is None:
+                self.send_error(status)
+                return
+
+            try:
+                byte_range = parse_range(self.headers.get("Range"), document.size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{document.size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            start, end = byte_range or (0, document.size - 1)
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", document.content_type)
+            self.send_header("Content-Length", str(max(0, end - start + 1)))
+            self.send_header("Accept-Ranges", "bytes")
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{document.size}")
+            self.send_header("Content-Disposition", "inline")
+            self.send_header("Cache-Control", f"private, max-age={server.ttl}")
+            self.send_header("X-Content-Type-Options", "nosniff")
+            self.end_headers()
+            if not send_body:
+                return
+
+            offset = start
+            try:
+                while offset <= end:
+                    chunk = document.read(offset, min(CHUNK_SIZE, end - offset + 1))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    offset += len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # The viewer cancelled the range, e.g. after scrolling past it
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return PreviewHandler
+
+_server: Optional[PreviewServer] = None
+_server_lock = threading.Lock()
+
+def start_preview_server(port: int, host: str = PREVIEW_SERVER_HOST) -> Optional[PreviewServer]:
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = PreviewServer(host, port)
+            except OSError:
+                # Already bound, e.g. by another Streamlit process on this host
+                return None
+            _server.start()
+        return _server
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import QUERY_CACHE_TTL, QUERY_CACHE_STALE_TTL, QUERY_CACHE_MAX_ENTRIES
+from commonwell.signing import decode_jwt_payload
+
+SUBJECT_ID_CLAIM = "urn:oasis:names:tc:xspa:1.0:subject:subject-id"
+
+def normalize_query_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+def jwt_subject(token: str) -> str:
+    payload = decode_jwt_payload(token)
+    if payload is None:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+    return f"{payload.get('sub', '')}|{payload.get(SUBJECT_ID_CLAIM, '')}"
+
+class QueryCache:
+    """In-process LRU cache of successful DocumentReference search results.
+
+    Entries younger than ``ttl`` are served as hits. Until ``ttl + stale_ttl``
+    they are still served, but a background refresh replaces them.
+    """
+
+    def __init__(
+        self,
+        ttl: float = QUERY_CACHE_TTL,
+        stale_ttl: float = QUERY_CACHE_STALE_TTL,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._refreshing = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="query-cache")
+        self.stats = {"hit": 0, "stale": 0, "miss": 0, "bypass": 0, "refreshed": 0}
+
+    def _key(self, url: str, jwt_token: str, variant: str) -> Tuple[str, str, str]:
+        return normalize_query_url(url), jwt_subject(jwt_token), variant
+
+    def _put(self, key: Tuple[str, str, str], identifier: str, result: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = {"result": result, "identifier": identifier, "stored_at": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, key: Tuple[str, str, str], identifier: str, fetch: Callable[[], Dict[str, Any]], generation: int):
+        try:
+            result = fetch()
+            # Skip results that raced with an invalidation
+            if result.get("success") and generation == self._generation:
+                self._put(key, identifier, result)
+                self.stats["refreshed"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_fetch(
+        self,
+        url: str,
+        jwt_token: str,
+        identifier: str,
+        fetch: Callable[[], Dict[str, Any]],
+        bypass: bool = False,
+        variant: str = "",
+        refresh: Optional[Callable[[], Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        key = self._key(url, jwt_token, variant)
+
+        if not bypass:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry:
+                    self._entries.move_to_end(key)
+            if entry:
+                age = time.time() - entry["stored_at"]
+                if age < self.ttl:
+                    self.stats["hit"] += 1
+                    return {**entry["result"], "cache": "hit", "cache_age": age}
+                if age < self.ttl + self.stale_ttl:
+                    with self._lock:
+                        start_refresh = key not in self._refreshing
+                        self._refreshing.add(key)
+                    if start_refresh:
+                        self._executor.submit(self._refresh, key, identifier, refresh or fetch, self._generation)
+                    self.stats["stale"] += 1
+                    return {**entry["result"], "cache": "stale", "cache_age": age}
+
+        result = fetch()
+        if result.get("success"):
+            self._put(key, identifier, result)
+        status = "bypass" if bypass else "miss"
+        self.stats[status] += 1
+        return {**result, "cache": status}
+
+    def invalidate_identifier(self, identifier: str) -> int:
+        with self._lock:
+            self._generation += 1
+            keys = [key for key, entry in self._entries.items() if entry["identifier"] == identifier]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
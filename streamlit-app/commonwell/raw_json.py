@@ -0,0 +1,53 @@
+from typing import Any, Dict, List, Optional
+
+from commonwell.jsonio import dumps as _dumps
+
+class RawBundle:
+    """A search Bundle serialized once, for the Raw JSON view.
+
+    Each entry's resource is kept as compact JSON text, so a chunk of
+    entries or a single DocumentReference reaches the browser by joining
+    strings rather than dumping the Bundle again on every rerun. The same
+    text makes the NDJSON export, one resource per line.
+    """
+
+    __slots__ = ("envelope", "resources", "wrappers", "ids", "size", "_rows", "_ndjson")
+
+    def __init__(self, envelope: str, resources: List[str], wrappers: List[str], ids: List[Optional[str]]):
+        self.envelope = envelope
+        self.resources = resources
+        self.wrappers = wrappers
+        self.ids = ids
+        self.size = len(envelope) + sum(len(wrapper) + len(resource) + 14 for wrapper, resource in zip(wrappers, resources))
+        self._rows = {doc_id: row for row, doc_id in enumerate(ids) if doc_id}
+        self._ndjson: Optional[bytes] = None
+
+    @classmethod
+    def from_bundle(cls, bundle: Dict[str, Any]) -> "RawBundle":
+        resources, wrappers, ids = [], [], []
+        for entry in bundle.get("entry", []):
+            resource = entry.get("resource") or {}
+            resources.append(_dumps(resource))
+            # fullUrl, search and the like, without the closing brace the resource is spliced in before
+            wrappers.append(_dumps({key: value for key, value in entry.items() if key != "resource"})[:-1])
+            ids.append(resource.get("id"))
+        return cls(_dumps({key: value for key, value in bundle.items() if key != "entry"}), resources, wrappers, ids)
+
+    def __len__(self) -> int:
+        return len(self.resources)
+
+    def entry(self, row: int) -> str:
+        wrapper = self.wrappers[row]
+        return f'{wrapper}{"," if len(wrapper) > 1 else ""}"resource":{self.resources[row]}}}'
+
+    def chunk(self, start: int, count: int) -> str:
+        return "[" + ",".join(self.entry(row) for row in range(start, min(start + count, len(self)))) + "]"
+
+    def find(self, doc_id: str) -> Optional[str]:
+        row = self._rows.get(doc_id.strip())
+        return None if row is None else self.entry(row)
+
+    def ndjson(self) -> bytes:
+        if self._ndjson is None:
+            self._ndjson = "".join(resource + "\n" for resource in self.resources).encode("utf-8")
+        return self._ndjson
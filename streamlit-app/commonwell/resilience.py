@@ -0,0 +1,346 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+from urllib.parse import urlsplit
+
+import requests
+
+from config import (
+    API_TIMEOUT, API_CONNECT_TIMEOUT, API_READ_TIMEOUT,
+    RETRY_MAX_ATTEMPTS, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX, RETRY_STATUS_CODES,
+    HEDGE_ENABLED, HEDGE_QUANTILE, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+from commonwell.governor import ThrottledError, get_governor
+from commonwell.log import log_event
+from commonwell.metrics import (
+    CIRCUIT_METRIC, HEDGE_METRIC, PHASE_METRIC, RETRY_METRIC, get_registry, observe_phase
+)
+
+# Statuses that mean the server did not process the request, so even a POST can be resent
+NOT_PROCESSED_STATUS_CODES = {429, 503}
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+class CircuitBreaker:
+    """Fails fast after repeated server or network failures against one environment.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    requests are rejected for ``reset_timeout`` seconds; then a single trial
+    request is let through and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        # The attempt ended without an outcome (throttled or cancelled), so let the next caller make the trial
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    log_event("Circuit Breaker", f"Circuit opened for {self.name}", {"failures": self.failures}, severity="WARNING")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def retry_in(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+def breaker_states() -> Dict[str, str]:
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+def backoff_delay(attempt: int, base: float = RETRY_BACKOFF_BASE, cap: float = RETRY_BACKOFF_MAX) -> float:
+    # Full jitter: spreads retries from many clients instead of synchronizing them
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def _send_hedged(send: Callable[[Tuple[float, float]], requests.Response], timeout: Tuple[float, float], hedge_after: float, operation: str) -> requests.Response:
+    first = _hedge_executor.submit(send, timeout)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return first.result()
+
+    second = _hedge_executor.submit(send, timeout)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.add_done_callback(_close_response)
+                get_registry().inc(HEDGE_METRIC, operation=operation, winner="hedge" if future is second else "primary")
+                return future.result()
+            error = future.exception()
+    raise error
+
+def hedge_delay(operation: str) -> Optional[float]:
+    if not HEDGE_ENABLED:
+        return None
+    latency = get_registry().quantile(PHASE_METRIC, HEDGE_QUANTILE, HEDGE_MIN_SAMPLES, phase="attempt", operation=operation)
+    if latency is None:
+        return None
+    return max(HEDGE_MIN_DELAY, latency)
+
+def send_with_retry(
+    send: Callable[[Tuple[float, float]], requests.Response],
+    operation: str,
+    circuit: str,
+    idempotent: bool = True,
+    hedge: bool = False,
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    deadline: float = API_TIMEOUT,
+    connect_timeout: float = API_CONNECT_TIMEOUT,
+    read_timeout: float = API_READ_TIMEOUT
+) -> requests.Response:
+    """Send a request through the circuit breaker for ``circuit`` with retries.
+
+    ``send`` receives a (connect, read) timeout and returns a response. Only
+    idempotent requests are retried after a read timeout or a 502/504; any
+    request is retried when it never reached the server or got 429/503.
+    Retries wait for Retry-After or a jittered backoff, and stop once the
+    overall ``deadline`` would be exceeded. Every request, hedges included,
+    first takes a slot from the rate governor for (``circuit``, ``operation``).
+    The last response is returned as-is, so callers keep their own status
+    handling.
+    """
+    breaker = get_breaker(circuit)
+    governor = get_governor()
+    started = time.monotonic()
+    attempt = 0
+
+    while True:
+        _check_circuit(breaker, circuit)
+
+        remaining = deadline - (time.monotonic() - started)
+        timeout = (max(0.1, min(connect_timeout, remaining)), max(0.1, min(read_timeout, remaining)))
+
+        def governed_send(timeout: Tuple[float, float], max_wait: float = remaining) -> requests.Response:
+            with governor.slot(circuit, operation, max_wait):
+                return send(timeout)
+
+        attempt_started = time.perf_counter()
+        response = None
+        error: Optional[Exception] = None
+        try:
+            delay = hedge_delay(operation) if hedge else None
+            if delay is not None and delay < remaining:
+                response = _send_hedged(governed_send, timeout, delay, operation)
+            else:
+                response = governed_send(timeout)
+        except ThrottledError:
+            # Nothing was sent and the wait budget is already spent
+            breaker.release_trial()
+            raise
+        except requests.exceptions.RequestException as e:
+            error = e
+        except BaseException:
+            breaker.release_trial()
+            raise
+        observe_phase("attempt", time.perf_counter() - attempt_started, operation)
+
+        if error is not None:
+            not_sent = request_not_sent(error)
+            fatal = isinstance(error, requests.exceptions.SSLError)
+            retryable, reason, wait_for = _error_outcome(breaker, error, idempotent, not_sent, fatal, attempt)
+        else:
+            retryable, reason, wait_for = _response_outcome(breaker, governor, response, circuit, operation, idempotent, attempt)
+
+        attempt += 1
+        if not retryable or attempt >= max_attempts or time.monotonic() - started + wait_for >= deadline:
+            if error is not None:
+                # Lets callers report the limit that actually expired rather than the overall deadline
+                error.attempts = attempt
+                error.timeout = timeout
+                raise error
+            return response
+
+        if response is not None:
+            response.close()
+        _log_retry(operation, reason, attempt, wait_for)
+        time.sleep(wait_for)
+
+async def send_with_retry_async(
+    send: Callable[[Tuple[float, float]], Awaitable[Any]],
+    operation: str,
+    circuit: str,
+    transport_errors: Tuple[Type[Exception], ...],
+    classify_error: Callable[[Exception], Tuple[bool, bool]],
+    idempotent: bool = True,
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    deadline: float = API_TIMEOUT,
+    connect_timeout: float = API_CONNECT_TIMEOUT,
+    read_timeout: float = API_READ_TIMEOUT
+) -> Any:
+    """Coroutine counterpart of ``send_with_retry`` for async HTTP clients.
+
+    The breaker, governor and retry policy are shared with the sync path.
+    The client library's exceptions are passed in: ``transport_errors`` are
+    caught, and ``classify_error`` returns (not_sent, fatal) for one of them.
+    Requests are not hedged.
+    """
+    breaker = get_breaker(circuit)
+    governor = get_governor()
+    started = time.monotonic()
+    attempt = 0
+
+    while True:
+        _check_circuit(breaker, circuit)
+
+        remaining = deadline - (time.monotonic() - started)
+        timeout = (max(0.1, min(connect_timeout, remaining)), max(0.1, min(read_timeout, remaining)))
+        attempt_started = time.perf_counter()
+        response = None
+        error: Optional[Exception] = None
+        try:
+            async with governor.async_slot(circuit, operation, remaining):
+                response = await send(timeout)
+        except ThrottledError:
+            breaker.release_trial()
+            raise
+        except transport_errors as e:
+            error = e
+        except BaseException:
+            # Includes CancelledError; without an outcome the half-open trial would never end
+            breaker.release_trial()
+            raise
+        observe_phase("attempt", time.perf_counter() - attempt_started, operation)
+
+        if error is not None:
+            not_sent, fatal = classify_error(error)
+            retryable, reason, wait_for = _error_outcome(breaker, error, idempotent, not_sent, fatal, attempt)
+        else:
+            retryable, reason, wait_for = _response_outcome(breaker, governor, response, circuit, operation, idempotent, attempt)
+
+        attempt += 1
+        if not retryable or attempt >= max_attempts or time.monotonic() - started + wait_for >= deadline:
+            if error is not None:
+                # Lets callers report the limit that actually expired rather than the overall deadline
+                error.attempts = attempt
+                error.timeout = timeout
+                raise error
+            return response
+
+        _log_retry(operation, reason, attempt, wait_for)
+        await asyncio.sleep(wait_for)
+
+def timeout_message(error: Exception, phase: str) -> str:
+    """Describe a timeout raised by ``send_with_retry``; ``phase`` is "connect" or "read"."""
+    connect_timeout, read_timeout = getattr(error, "timeout", (API_CONNECT_TIMEOUT, API_READ_TIMEOUT))
+    attempts = getattr(error, "attempts", 1)
+    seconds = connect_timeout if phase == "connect" else read_timeout
+    return f"Request timed out ({phase} timeout of {round(seconds, 1):g} seconds) after {attempts} attempt{'' if attempts == 1 else 's'}"
+
+def _check_circuit(breaker: CircuitBreaker, circuit: str):
+    if not breaker.allow():
+        get_registry().inc(CIRCUIT_METRIC, circuit=circuit)
+        raise CircuitOpenError(f"Circuit open for {circuit} after repeated failures; retry in {breaker.retry_in():.0f}s")
+
+def _error_outcome(breaker: CircuitBreaker, error: Exception, idempotent: bool, not_sent: bool, fatal: bool, attempt: int) -> Tuple[bool, str, float]:
+    breaker.record_failure()
+    return not fatal and (idempotent or not_sent), type(error).__name__, backoff_delay(attempt)
+
+def _response_outcome(breaker: CircuitBreaker, governor, response, circuit: str, operation: str, idempotent: bool, attempt: int) -> Tuple[bool, str, float]:
+    status = response.status_code
+    # 429 means CommonWell is up but throttling us, which is not a reason to open the circuit
+    if status >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    retryable = status in RETRY_STATUS_CODES and (idempotent or status in NOT_PROCESSED_STATUS_CODES)
+    wait_for = parse_retry_after(response.headers.get("Retry-After"))
+    if status == 429 and wait_for is not None:
+        # Hold back every caller sharing this budget, not just this retry
+        governor.penalize(circuit, operation, wait_for)
+    if wait_for is None:
+        wait_for = backoff_delay(attempt)
+    return retryable, str(status), wait_for
+
+def _log_retry(operation: str, reason: str, attempt: int, wait_for: float):
+    get_registry().inc(RETRY_METRIC, operation=operation, reason=reason)
+    log_event(operation, f"Retrying after {reason}", {"attempt": attempt, "waitSeconds": round(wait_for, 2)}, severity="WARNING")
+
+def request_not_sent(error: Exception) -> bool:
+    """True when ``error`` shows the request never reached the server, so even a POST can be sent again."""
+    if isinstance(error, (ThrottledError, CircuitOpenError, requests.exceptions.ConnectTimeout)):
+        return True
+    return (
+        isinstance(error, requests.exceptions.ConnectionError) and not isinstance(error, requests.exceptions.SSLError)
+        and _connection_refused(error)
+    )
+
+def _connection_refused(error: Exception) -> bool:
+    # A refused or unresolvable connection never delivered the request; a reset mid-response might have
+    text = str(error)
+    return any(marker in text for marker in ("NewConnectionError", "Failed to resolve", "Connection refused", "NameResolutionError"))
+
+def circuit_for(environment: Optional[str], url: str) -> str:
+    if environment:
+        return environment
+    return urlsplit(url).hostname or "default"
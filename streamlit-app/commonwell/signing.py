@@ -0,0 +1,94 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import jwt as pyjwt
+    from cryptography import x509
+    from cryptography.hazmat.primitives import serialization
+    JWT_AVAILABLE = True
+except ImportError:
+    JWT_AVAILABLE = False
+
+def decode_jwt_payload(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        parts = token.strip().split(".")
+        if len(parts) != 3:
+            return None
+        padding = "=" * (-len(parts[1]) % 4)
+        return json.loads(base64.urlsafe_b64decode(parts[1] + padding))
+    except Exception:
+        return None
+
+def x5t_thumbprint(cert) -> str:
+    cert_der = cert.public_bytes(serialization.Encoding.DER)
+    thumbprint = hashlib.sha1(cert_der).digest()
+    return base64.urlsafe_b64encode(thumbprint).rstrip(b"=").decode("utf-8")
+
+def file_version(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class SigningMaterial:
+    """Parsed JWT signing key and certificate, reloaded only when the files change."""
+
+    def __init__(self, key_path: str, cert_path: str, algorithm: str = "RS384"):
+        self.key_path = key_path
+        self.cert_path = cert_path
+        self.algorithm = algorithm
+        self._lock = threading.Lock()
+        self._versions = None
+        self._material = (None, None)
+        self.loads = 0
+        self.signatures = 0
+
+    def _refresh(self):
+        versions = (file_version(self.key_path), file_version(self.cert_path))
+        if versions == self._versions:
+            return
+
+        with self._lock:
+            if versions == self._versions:
+                return
+            if versions[0] is None:
+                raise FileNotFoundError(f"Signing key not found: {self.key_path}")
+
+            with open(self.key_path, "rb") as f:
+                private_key = serialization.load_pem_private_key(f.read(), password=None)
+
+            x5t = None
+            if versions[1] is not None:
+                try:
+                    with open(self.cert_path, "rb") as f:
+                        x5t = x5t_thumbprint(x509.load_pem_x509_certificate(f.read()))
+                except ValueError:
+                    x5t = None
+
+            self._material = (private_key, x5t)
+            self._versions = versions
+            self.loads += 1
+
+    @property
+    def x5t(self) -> Optional[str]:
+        self._refresh()
+        return self._material[1]
+
+    def sign(self, claims: Dict[str, Any]) -> str:
+        self._refresh()
+        private_key, x5t = self._material
+        headers = {
+            "typ": "JWT",
+            "alg": self.algorithm,
+        }
+        if x5t:
+            headers["x5t"] = x5t
+
+        signed = pyjwt.encode(claims, private_key, algorithm=self.algorithm, headers=headers)
+        self.signatures += 1
+        return signed
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import JWT_REFRESH_WINDOW, JWT_CACHE_MAX_ENTRIES
+from commonwell.signing import decode_jwt_payload
+
+class TokenCache:
+    """CommonWell JWTs keyed by CLEAR token hash, shared across sessions.
+
+    A JWT is reused until it is within ``refresh_window`` seconds of ``exp``;
+    from then on callers still get it while a replacement is signed in the
+    background. Nothing is reused or re-signed past the CLEAR token's ``exp``.
+    """
+
+    def __init__(
+        self,
+        mint: Callable[[str], Dict[str, Any]],
+        refresh_window: float = JWT_REFRESH_WINDOW,
+        max_entries: int = JWT_CACHE_MAX_ENTRIES
+    ):
+        self.mint = mint
+        self.refresh_window = refresh_window
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jwt-refresh")
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def _mint(self, token_hash: str, clear_id_token: str) -> Dict[str, Any]:
+        result = self.mint(clear_id_token)
+        if "error" in result:
+            self.failures += 1
+            return result
+
+        jwt_claims = decode_jwt_payload(result["jwt"]) or {}
+        clear_exp = (result.get("claims") or {}).get("exp")
+        expires_at = jwt_claims.get("exp") or time.time()
+        if clear_exp:
+            expires_at = min(expires_at, clear_exp)
+
+        entry = {
+            "jwt": result["jwt"],
+            "claims": result.get("claims"),
+            "clear_id_token": clear_id_token,
+            "expires_at": expires_at,
+            "clear_expires_at": clear_exp
+        }
+        with self._lock:
+            self._entries[token_hash] = entry
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def _refresh(self, token_hash: str, clear_id_token: str):
+        try:
+            if "error" not in self._mint(token_hash, clear_id_token):
+                self.refreshes += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(token_hash)
+
+    def _schedule_refresh(self, token_hash: str, entry: Dict[str, Any]):
+        clear_exp = entry.get("clear_expires_at")
+        # A new JWT cannot outlive the CLEAR token, so re-signing near its exp gains nothing
+        if clear_exp and clear_exp - time.time() <= self.refresh_window:
+            return
+        with self._lock:
+            if token_hash in self._refreshing:
+                return
+            self._refreshing.add(token_hash)
+        self._executor.submit(self._refresh, token_hash, entry["clear_id_token"])
+
+    def get(
+        self,
+        token_hash: str,
+        clear_id_token: str,
+        mint_on_miss: bool = True,
+        record: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry and entry["expires_at"] <= now:
+                del self._entries[token_hash]
+                entry = None
+            if entry:
+                self._entries.move_to_end(token_hash)
+
+        if entry:
+            if record:
+                self.hits += 1
+            if entry["expires_at"] - now <= self.refresh_window:
+                self._schedule_refresh(token_hash, entry)
+            return {
+                "success": True,
+                "jwt": entry["jwt"],
+                "claims": entry["claims"],
+                "expires_at": entry["expires_at"],
+                "cached": True
+            }
+
+        if not mint_on_miss:
+            return None
+
+        if record:
+            self.misses += 1
+        result = self._mint(token_hash, clear_id_token)
+        if "error" in result:
+            return result
+        return {**result, "expires_at": self._entries.get(token_hash, {}).get("expires_at"), "cached": False}
+
+    def invalidate(self, token_hash: str):
+        with self._lock:
+            self._entries.pop(token_hash, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "signatures": self.misses + self.refreshes,
+            "signatures_saved": max(0, self.hits - self.refreshes),
+            "background_refreshes": self.refreshes,
+            "failures": self.failures
+        }
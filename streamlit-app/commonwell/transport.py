@@ -0,0 +1,128 @@
+import os
+import ssl
+import threading
+import time
+from typing import Dict, Optional, Tuple, Any
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from config import (
+    CLIENT_CERT_PATH, CLIENT_KEY_PATH, CA_CERT_PATH,
+    SKIP_TLS_VERIFY, HTTP_POOL_SIZE, HTTP_POOL_IDLE_TIMEOUT
+)
+from commonwell.metrics import TimedHTTPConnectionPool, TimedHTTPSConnectionPool
+
+def get_ssl_context(skip_verify: bool = False):
+    cert_path = CLIENT_CERT_PATH
+    key_path = CLIENT_KEY_PATH
+    ca_path = CA_CERT_PATH
+
+    cert = None
+    verify = True
+
+    if cert_path and key_path and os.path.exists(cert_path) and os.path.exists(key_path):
+        cert = (cert_path, key_path)
+
+    if skip_verify or SKIP_TLS_VERIFY:
+        verify = False
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    elif ca_path and os.path.exists(ca_path):
+        verify = ca_path
+
+    return cert, verify
+
+def build_ssl_context(skip_verify: bool = False) -> ssl.SSLContext:
+    cert, verify = get_ssl_context(skip_verify)
+    context = ssl.create_default_context(cafile=verify if isinstance(verify, str) else None)
+    if verify is False:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if cert:
+        context.load_cert_chain(*cert)
+    return context
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record connect and TLS handshake time.
+
+    ``verify`` pins certificate verification for every request: requests
+    otherwise lets REQUESTS_CA_BUNDLE/CURL_CA_BUNDLE override the session's
+    CA file, and even a disabled check.
+    """
+
+    def __init__(self, *args, verify: Any = None, **kwargs):
+        self.verify = verify
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if self.verify is not None:
+            kwargs["verify"] = self.verify
+        return super().send(request, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool
+        }
+
+class SessionPool:
+    """Keep-alive mTLS sessions, one per (environment, cert, verify) tuple."""
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, idle_timeout: float = HTTP_POOL_IDLE_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[Tuple[Any, ...], Tuple[requests.Session, float]] = {}
+        self._lock = threading.Lock()
+
+    def _new_session(self, cert, verify) -> requests.Session:
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, verify=verify)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.cert = cert
+        session.verify = verify
+        return session
+
+    def _evict_idle(self, now: float):
+        for key, (session, last_used) in list(self._sessions.items()):
+            if now - last_used > self.idle_timeout:
+                del self._sessions[key]
+                session.close()
+
+    def session(self, environment: str, skip_verify: bool = False) -> requests.Session:
+        cert, verify = get_ssl_context(skip_verify)
+        key = (environment, cert, verify)
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._sessions.get(key)
+            session = entry[0] if entry else self._new_session(cert, verify)
+            self._sessions[key] = (session, now)
+            return session
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "pool_size": self.pool_size,
+                "idle_timeout": self.idle_timeout
+            }
+
+    def close(self):
+        with self._lock:
+            for session, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+_default_pool: Optional[SessionPool] = None
+_default_pool_lock = threading.Lock()
+
+def get_default_pool() -> SessionPool:
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = SessionPool()
+        return _default_pool
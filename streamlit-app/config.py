@@ -21,3 +21,98 @@ PATIENT_API_BASE_URLS = {
     "integration": "https://api.integration.commonwellalliance.lkopera.com/v2/",
     "production": "https://api.commonwellalliance.lkopera.com/v2/"
 }
+
+HTTP_POOL_SIZE = 10
+HTTP_POOL_IDLE_TIMEOUT = 300
+
+BULK_DOWNLOAD_WORKERS = 8
+BULK_DOWNLOAD_PER_HOST = 4
+
+BINARY_STREAM_CHUNK_SIZE = 64 * 1024
+BINARY_SPOOL_MAX_MEMORY = 5 * 1024 * 1024
+BINARY_RAW_CONTENT_TYPES = ["application/pdf", "application/xml", "text/xml"]
+
+DOCUMENT_CACHE_ENABLED = True
+DOCUMENT_CACHE_DIR = "./.cache/documents"
+DOCUMENT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+DOCUMENT_CACHE_TTL = 3600
+
+QUERY_CACHE_TTL = 300
+QUERY_CACHE_STALE_TTL = 900
+QUERY_CACHE_MAX_ENTRIES = 100
+
+JWT_REFRESH_WINDOW = 300
+JWT_CACHE_MAX_ENTRIES = 100
+
+RESULTS_PAGE_SIZE = 20
+RESULTS_PAGE_SIZE_OPTIONS = [10, 20, 50, 100]
+RESULTS_TABLE_VIEW_THRESHOLD = 100
+
+LOG_LEVEL = "INFO"
+LOG_SAMPLE_RATES = {"DEBUG": 0.0, "INFO": 1.0, "WARNING": 1.0, "ERROR": 1.0}
+LOG_BODY_MODE = "summary"  # "none", "summary" or "full"
+LOG_MAX_BODY_CHARS = 4096
+LOG_MAX_STRING_CHARS = 256
+LOG_REDACT_PHI = True
+LOG_OUTPUT = "stdout"  # or a file path
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_INTERVAL = 1.0
+
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 55]
+METRICS_PORT = 9464  # Prometheus endpoint on 127.0.0.1; None to disable
+
+API_CONNECT_TIMEOUT = 5
+API_READ_TIMEOUT = 50
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 8
+RETRY_STATUS_CODES = [429, 502, 503, 504]
+HEDGE_ENABLED = True
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 20
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Client-side budgets per environment and endpoint: requests per second, burst size and requests in flight
+RATE_LIMITS = {
+    "query": {"rate": 5.0, "burst": 10, "concurrency": 4},
+    "binary": {"rate": 10.0, "burst": 20, "concurrency": 8},
+    "patient_create": {"rate": 1.0, "burst": 2, "concurrency": 2}
+}
+RATE_LIMIT_SHARED_DIR = None  # directory shared by replicas on one host, e.g. "./.cache/ratelimit"
+RATE_LIMIT_MAX_WAIT = 30
+
+# Async client (commonwell.aio): needs httpx, plus h2 for HTTP/2 (pip install "httpx[http2]")
+ASYNC_CLIENT_ENABLED = False
+ASYNC_HTTP2 = True
+ASYNC_MAX_CONNECTIONS = 10
+
+# XML previews: larger documents show the C-CDA section outline and only the start of the formatted/raw text
+XML_PREVIEW_MAX_BYTES = 2 * 1024 * 1024
+XML_PREVIEW_MAX_CHARS = 200_000
+XML_SECTION_TEXT_CHARS = 2000
+
+# Local endpoint that serves PDF previews to the browser by signed URL, with Range support. Only used once
+# PREVIEW_PUBLIC_URL says where the browser reaches it (e.g. "http://localhost:8599"); otherwise PDFs are embedded as data: URIs
+PREVIEW_SERVER_PORT = 8599
+PREVIEW_SERVER_HOST = "127.0.0.1"
+PREVIEW_PUBLIC_URL = None
+PREVIEW_URL_TTL = 300
+
+# Query history (SQLite, WAL mode); holds patient identifiers, so keep it under the git-ignored .cache directory
+HISTORY_DB_PATH = "./.cache/history.sqlite3"
+HISTORY_RETENTION_DAYS = 90
+HISTORY_PAGE_SIZE = 25
+
+# Batch patient enrollment: registry of patients already created, so re-runs and duplicate rows never POST twice
+ENROLLMENT_REGISTRY_PATH = "./.cache/enrollment.sqlite3"
+ENROLLMENT_WORKERS = 4
+
+# Raw JSON view: entries are shown in chunks; larger results are offered as an NDJSON download instead
+RAW_JSON_CHUNK_ENTRIES = 20
+RAW_JSON_MAX_BYTES = 5 * 1024 * 1024
+
+# JSON codec for responses and logs: "auto" uses orjson or msgspec when installed, else the standard library
+JSON_BACKEND = "auto"